@@ -36,7 +36,8 @@ def main():
         required=True,
         default="",
         help="""
-        Path to the input structure in .pdb format.
+        Path to the input structure in .pdb format. Can be a file in a structure store
+        (e.g. structures.store/protein.pdb).
         """,
     )
     parser_struc_get_domains.add_argument(
@@ -58,7 +59,10 @@ def main():
         help="""
         Directory of the output domains. Files will be labled
         {output_dir}/{basename of structure}_domain-{i}.pdb.
-        Note that the domain number will be 1-indexed.
+        Note that the domain number will be 1-indexed. If the directory ends in .store,
+        the domains are added to a structure store - a few large tar archives with an
+        index - rather than written as separate files. Many runs can add to the same
+        store at once.
         """,
     )
     parser_struc_get_domains.add_argument(
@@ -156,6 +160,75 @@ def main():
         This file will be APPENDED to. The columns are domain_name, average_PAE.
         """,
     )
+    parser_struc_get_domains.add_argument(
+        "-d",
+        "--domain_report",
+        type=str,
+        required=False,
+        default="",
+        help="""
+        If specified, writes a tab-delimited report of all domains in the structure to
+        this file, which is overwritten. Each line is a domain, with its length,
+        start, end, mean/median/min pLDDT, mean/median intra-domain PAE, and the mean
+        PAE to every domain (mean_pae_to_{domain} columns).
+        """,
+    )
+    parser_struc_get_domains.add_argument(
+        "-S",
+        "--single_file",
+        type=arg_str2bool,
+        required=False,
+        default=False,
+        nargs="?",
+        const=True,
+        help="""
+        If specified, all domains are written to a single file,
+        {output_dir}/{basename of structure}_domains.pdb, where each domain is a model
+        (numbered from 1 in the order of the domains). The reports still name domains
+        {basename of structure}_domain-{i}.pdb.
+        """,
+    )
+    parser_struc_get_domains.add_argument(
+        "-b",
+        "--clustering_backend",
+        type=str,
+        required=False,
+        default="networkx",
+        choices=["networkx", "sparse"],
+        help="""
+        How the PAE matrix is clustered. 'networkx' uses networkx's greedy modularity
+        communities. 'sparse' builds the PAE graph as a sparse matrix and clusters it
+        with the Louvain algorithm, which is much faster for large proteins but may
+        give somewhat different clusters. [Default: networkx]
+        """,
+    )
+    parser_struc_get_domains.add_argument(
+        "-C",
+        "--pae_cache",
+        type=arg_str2bool,
+        required=False,
+        default=False,
+        nargs="?",
+        const=True,
+        help="""
+        If specified, the PAE matrix is stored in a binary file next to the json file
+        ({json}.pae_cache.npz) the first time it is read. Later runs load it from
+        there instead of parsing the json file, as long as the json file is unchanged.
+        """,
+    )
+    parser_struc_get_domains.add_argument(
+        "-T",
+        "--pae_cache_dtype",
+        type=str,
+        required=False,
+        default="float64",
+        choices=["float64", "float32", "float16"],
+        help="""
+        The precision with which the PAE matrix is stored in and read from the PAE
+        cache. Lower precision takes less memory. Only used with --pae_cache.
+        [Default: float64]
+        """,
+    )
     parser_struc_get_domains.set_defaults(func=call_struc_get_domains)
 
     # -------------------------------------------------------------------------------- #
@@ -179,17 +252,55 @@ def main():
         default="",
         help="""
         Glob specifying the structures to be compared. Remember to wrap the glob in
-        quotes!
+        quotes! Can also be a structure store (a directory ending in .store).
         """,
     )
     parser_struc_remove_redundant.add_argument(
         "-o",
         "--output_dir",
         type=str,
-        required=True,
+        required=False,
         default="",
         help="""
         Path to the output directory in which the filtered files will be saved.
+        Required unless --output_mode is none. If it ends in .store, the files are
+        added to a structure store.
+        """,
+    )
+    parser_struc_remove_redundant.add_argument(
+        "-m",
+        "--output_mode",
+        type=str,
+        required=False,
+        default="rewrite",
+        choices=["rewrite", "copy", "hardlink", "none"],
+        help="""
+        How the filtered files are saved to the output directory. 'rewrite' parses
+        each structure and writes it in pdb format (mmCIF files are renamed to .pdb).
+        'copy' copies the input files, so they are byte-identical. 'hardlink' hardlinks
+        the input files (or copies them if that isn't possible). 'none' doesn't save
+        any files, which is useful with --survivor_list. [Default: rewrite]
+        """,
+    )
+    parser_struc_remove_redundant.add_argument(
+        "-l",
+        "--survivor_list",
+        type=str,
+        required=False,
+        default="",
+        help="""
+        If specified, the paths of the structures that passed filtering are written to
+        this file, one per line.
+        """,
+    )
+    parser_struc_remove_redundant.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        required=False,
+        default=1,
+        help="""
+        Number of worker processes used to read the structures. [Default: 1]
         """,
     )
     parser_struc_remove_redundant.set_defaults(func=call_struc_remove_redundant)
@@ -213,6 +324,10 @@ def main():
             - end
 
             Where start and end are 1-indexed.
+
+            Many sequences (a multi-sequence fasta or several structures) and/or many
+            motifs (--motif_file) can be scanned at once, in which case the output
+            has the columns seq_id, motif, match, start, and end.
             """
         ),
     )
@@ -220,12 +335,14 @@ def main():
         "-m",
         "--motif",
         type=str,
-        required=True,
+        required=False,
+        default="",
         help="""
         String indicating the motif you're searching for. If an AA at a position doesn't
         matter, use a lowercase x. If it does matter, put an upercase AA single letter
         digit. If a position can have one of multiple possible AAs, use brackets... e.g.
-        [RK] indicates a position can either be R or K.
+        [RK] indicates a position can either be R or K. To repeat a position, follow it
+        with (n) or (n,m)... e.g. x(2,4) is a gap of two to four AAs.
 
         Make sure to wrap this in quotes when inputting.
         """,
@@ -237,7 +354,9 @@ def main():
         required=False,
         default="",
         help="""
-        Path to the structure file.
+        Path to the structure file. Can also be a directory of structures, a glob
+        (wrap it in quotes!), a file listing one structure path per line, or a
+        structure store (a directory ending in .store).
         """,
     )
     parser_struc_find_motif.add_argument(
@@ -247,7 +366,7 @@ def main():
         required=False,
         default="",
         help="""
-        Path to the fasta file.
+        Path to the fasta file, which can be gzipped and have many sequences.
         """,
     )
     parser_struc_find_motif.add_argument(
@@ -260,6 +379,51 @@ def main():
         A string with the AA sequence.
         """,
     )
+    parser_struc_find_motif.add_argument(
+        "-O",
+        "--overlapping",
+        type=arg_str2bool,
+        required=False,
+        default=False,
+        nargs="?",
+        const=True,
+        help="""
+        If specified, reports every match, including those that overlap an earlier
+        match of the same sequence (e.g. both AA in AAA for the motif xx).
+        """,
+    )
+    parser_struc_find_motif.add_argument(
+        "-M",
+        "--motif_file",
+        type=str,
+        required=False,
+        default="",
+        help="""
+        Path to a file with one motif per line (lines starting with # are skipped).
+        All motifs (and the --motif, if specified) are searched for at once.
+        """,
+    )
+    parser_struc_find_motif.add_argument(
+        "-o",
+        "--output_file",
+        type=str,
+        required=False,
+        default="-",
+        help="""
+        Path to the output file. Output is printed to the screen by default.
+        [Default: -]
+        """,
+    )
+    parser_struc_find_motif.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        required=False,
+        default=1,
+        help="""
+        Number of worker processes used to scan the sequences. [Default: 1]
+        """,
+    )
     parser_struc_find_motif.set_defaults(func=call_struc_find_motif)
 
     # -------------------------------------------------------------------------------- #
@@ -284,6 +448,13 @@ def main():
             - there_is_a_domain: yes or no. This checks that there is at least one
             stretech of continuous residues that have ordered pLDDTs. The required
             stretch size is args.check_for_domain_len
+
+            Multiple structures can be processed at once, in which case there is one
+            line per structure in the output file.
+
+            Optionally, every ordered and disordered stretch can be written to a
+            BED-like --stretch_file with the columns structure, start (0-indexed),
+            end (exclusive), state, length, and mean_plddt.
             """
         ),
     )
@@ -293,7 +464,11 @@ def main():
         type=str,
         required=True,
         help="""
-        Path to the structure file
+        Path to the structure file. Can also be a directory of structure files, a glob
+        (e.g. 'structures/*.pdb' - use quotes!), or a file listing one structure path
+        per line. Structures can be in pdb or mmCIF (.cif) format, and can be gzipped
+        (.gz). All structures in a structure store (a directory ending in .store) can
+        also be used.
         """,
     )
     parser_struc_disorder.add_argument(
@@ -349,6 +524,27 @@ def main():
         residues with at least this pLDDT. [Default: 50]
         """,
     )
+    parser_struc_disorder.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        required=False,
+        default=1,
+        help="""
+        Number of worker processes used to process the structures. [Default: 1]
+        """,
+    )
+    parser_struc_disorder.add_argument(
+        "-b",
+        "--stretch_file",
+        type=str,
+        required=False,
+        default="",
+        help="""
+        Path to an optional output file listing each ordered and disordered stretch of
+        every structure. Can be gzipped (.gz).
+        """,
+    )
     parser_struc_disorder.set_defaults(func=call_struc_disorder)
 
     # -------------------------------------------------------------------------------- #
@@ -366,6 +562,9 @@ def main():
             - number of residues that pass the pLDDT threshold
             - proportion of residues that pass the pLDDT threshold (this will be a
                 decimal between 0 and 1)
+
+            Multiple structures can be processed at once, in which case there is one
+            line per structure.
             """
         ),
     )
@@ -375,7 +574,11 @@ def main():
         type=str,
         required=True,
         help="""
-        Path to the structure file
+        Path to the structure file. Can also be a directory of structure files, a glob
+        (e.g. 'structures/*.pdb' - use quotes!), or a file listing one structure path
+        per line. Structures can be in pdb or mmCIF (.cif) format, and can be gzipped
+        (.gz). All structures in a structure store (a directory ending in .store) can
+        also be used.
         """,
     )
     parser_struc_qc.add_argument(
@@ -388,6 +591,26 @@ def main():
         value between 0 and 100.
         """,
     )
+    parser_struc_qc.add_argument(
+        "-o",
+        "--out_file",
+        type=str,
+        required=False,
+        default="-",
+        help="""
+        Path to the output file. By default, output is written to STDOUT. [Default: -]
+        """,
+    )
+    parser_struc_qc.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        required=False,
+        default=1,
+        help="""
+        Number of worker processes used to process the structures. [Default: 1]
+        """,
+    )
     parser_struc_qc.set_defaults(func=call_parser_struc_qc)
 
     # -------------------------------------------------------------------------------- #
@@ -470,6 +693,47 @@ def main():
         [Default: '__']
         """,
     )
+    parser_struc_detect_interaction.add_argument(
+        "-b",
+        "--clustering_backend",
+        type=str,
+        required=False,
+        default="networkx",
+        choices=["networkx", "sparse"],
+        help="""
+        How the PAE matrix is clustered. 'networkx' uses networkx's greedy modularity
+        communities. 'sparse' builds the PAE graph as a sparse matrix and clusters it
+        with the Louvain algorithm, which is much faster for large proteins but may
+        give somewhat different clusters. [Default: networkx]
+        """,
+    )
+    parser_struc_detect_interaction.add_argument(
+        "-C",
+        "--pae_cache",
+        type=arg_str2bool,
+        required=False,
+        default=False,
+        nargs="?",
+        const=True,
+        help="""
+        If specified, the PAE matrix is stored in a binary file next to the json file
+        ({json}.pae_cache.npz) the first time it is read. Later runs load it from
+        there instead of parsing the json file, as long as the json file is unchanged.
+        """,
+    )
+    parser_struc_detect_interaction.add_argument(
+        "-T",
+        "--pae_cache_dtype",
+        type=str,
+        required=False,
+        default="float64",
+        choices=["float64", "float32", "float16"],
+        help="""
+        The precision with which the PAE matrix is stored in and read from the PAE
+        cache. Lower precision takes less memory. Only used with --pae_cache.
+        [Default: float64]
+        """,
+    )
     parser_struc_detect_interaction.set_defaults(
         func=call_struc_detect_interaction_main
     )
@@ -990,6 +1254,33 @@ def main():
         These are the taxonomic levels to include in the output file.
         """,
     )
+    parser_aln_add_taxonomy.add_argument(
+        "-L",
+        "--lineage_cache",
+        type=str,
+        required=False,
+        default="",
+        help="""
+        Path to a persistent cache of taxonomic lineages (an sqlite file), which is
+        made if it doesn't exist. Lineages are looked up in the cache rather than the
+        ete3 database, and new lineages are added to it. The file can be shared by jobs
+        running at once. If not specified, lineages are only cached in memory for this
+        run. [Default: '']
+        """,
+    )
+    parser_aln_add_taxonomy.add_argument(
+        "-D",
+        "--taxonomy_database",
+        type=str,
+        required=False,
+        default="",
+        help="""
+        Path to the ete3 taxa.sqlite taxonomy database. If it doesn't exist, ete3 will
+        download it to this path. Can also be set with the SAT_TAXONOMY_DB environment
+        variable. If not specified, ete3's default (~/.etetoolkit/taxa.sqlite) is used.
+        [Default: '']
+        """,
+    )
     parser_aln_add_taxonomy.set_defaults(func=call_aln_add_taxonomy)
 
     # -------------------------------------------------------------------------------- #
@@ -1002,6 +1293,8 @@ def main():
             Simple subcommand that returns the amino-acid sequence of a specified
             structure (in pdb format). The AA sequence will be APPENDED to the outfile
             if specified, or printed to the screen if -o --out_file is not specified.
+            If multiple structures are specified, the output is a fasta where each
+            header is the structure file name without its suffix.
             """
         ),
     )
@@ -1011,7 +1304,11 @@ def main():
         type=str,
         required=True,
         help="""
-        Path to the structure file in pdb format.
+        Path to the structure file in pdb format. Can also be a directory of structure files, a glob
+        (e.g. 'structures/*.pdb' - use quotes!), or a file listing one structure path
+        per line. Structures can be in pdb or mmCIF (.cif) format, and can be gzipped
+        (.gz). All structures in a structure store (a directory ending in .store) can
+        also be used.
         """,
     )
     parser_struc_to_seq.add_argument(
@@ -1033,7 +1330,17 @@ def main():
         default="",
         help="""
         Header of the entry if writing to a fasta. Only required if -o --out_file is
-        specified.
+        specified for a single structure.
+        """,
+    )
+    parser_struc_to_seq.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        required=False,
+        default=1,
+        help="""
+        Number of worker processes used to process the structures. [Default: 1]
         """,
     )
     parser_struc_to_seq.set_defaults(func=call_struc_to_seq)
@@ -1050,6 +1357,8 @@ def main():
             to the screen. If --out_file is specified, the output file will be
             APPENDED to with the following:
             [basename input structure_file]\\t[plddt]\\n
+            If multiple structures are specified, a line in that format is printed or
+            appended for each of them.
             """
         ),
     )
@@ -1059,7 +1368,11 @@ def main():
         type=str,
         required=True,
         help="""
-        Path to the structure file in pdb format.
+        Path to the structure file in pdb format. Can also be a directory of structure files, a glob
+        (e.g. 'structures/*.pdb' - use quotes!), or a file listing one structure path
+        per line. Structures can be in pdb or mmCIF (.cif) format, and can be gzipped
+        (.gz). All structures in a structure store (a directory ending in .store) can
+        also be used.
         """,
     )
     parser_struc_to_plddt.add_argument(
@@ -1073,6 +1386,16 @@ def main():
         printed to the screen.
         """,
     )
+    parser_struc_to_plddt.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        required=False,
+        default=1,
+        help="""
+        Number of worker processes used to process the structures. [Default: 1]
+        """,
+    )
     parser_struc_to_plddt.set_defaults(func=call_struc_to_plddt)
 
     # -------------------------------------------------------------------------------- #
@@ -1144,7 +1467,8 @@ def main():
         help="""
         Path to the output fasta. If -n is specified, will put every fasta entry
         into a separate file and the entry in the -o switch will specify the
-        base path - should be a directory in this case.
+        base path - should be a directory in this case. If that directory ends in
+        .store, the fasta files are added to a store of tar archives instead.
         """,
     )
     parser_seq_chunk.add_argument(
@@ -1449,6 +1773,33 @@ def main():
         This is where in the delimited string the taxonID is located. [Default: -1]
         """,
     )
+    parser_aln_taxa_counts.add_argument(
+        "-L",
+        "--lineage_cache",
+        type=str,
+        required=False,
+        default="",
+        help="""
+        Path to a persistent cache of taxonomic lineages (an sqlite file), which is
+        made if it doesn't exist. Lineages are looked up in the cache rather than the
+        ete3 database, and new lineages are added to it. The file can be shared by jobs
+        running at once. If not specified, lineages are only cached in memory for this
+        run. [Default: '']
+        """,
+    )
+    parser_aln_taxa_counts.add_argument(
+        "-D",
+        "--taxonomy_database",
+        type=str,
+        required=False,
+        default="",
+        help="""
+        Path to the ete3 taxa.sqlite taxonomy database. If it doesn't exist, ete3 will
+        download it to this path. Can also be set with the SAT_TAXONOMY_DB environment
+        variable. If not specified, ete3's default (~/.etetoolkit/taxa.sqlite) is used.
+        [Default: '']
+        """,
+    )
     parser_aln_taxa_counts.set_defaults(func=call_parser_aln_taxa_counts_main)
 
     # -------------------------------------------------------------------------------- #
@@ -1592,7 +1943,8 @@ def main():
         required=True,
         help="""
         Path to the alignment file. It is OK if the first row is the header, as long as
-        the first column is 'query'.
+        the first column is 'query'. Can be gzipped (ending in .gz), or '-' to read
+        from stdin.
         """,
     )
     parser_aln_filter.add_argument(
@@ -1601,7 +1953,8 @@ def main():
         type=str,
         required=True,
         help="""
-        Path to the output alignment file.
+        Path to the output alignment file. Will be gzipped if it ends in .gz. Use '-'
+        to write to stdout.
         """,
     )
     parser_aln_filter.add_argument(
@@ -1663,6 +2016,51 @@ def main():
         alignment to be output.
         """,
     )
+    parser_aln_filter.add_argument(
+        "-s",
+        "--streaming",
+        type=arg_str2bool,
+        required=False,
+        default=False,
+        nargs="?",
+        const=True,
+        help="""
+        If specified, alignments are read, filtered, and written one query at a time
+        rather than reading the whole alignment file into memory. This requires all
+        alignments of a query to be on consecutive lines, as they are in foldseek
+        output.
+        """,
+    )
+    parser_aln_filter.add_argument(
+        "-F",
+        "--filters",
+        type=str,
+        required=False,
+        default="",
+        help="""
+        Comma-delimited string of additional filters every output alignment must pass,
+        such as 'evalue<=1e-3,alnlen>=50'. Supported operators are <=, >=, <, >, ==,
+        and !=. These are applied in addition to the min/max values of the
+        filter_field.
+        """,
+    )
+    parser_aln_filter.add_argument(
+        "-c",
+        "--columnar",
+        type=arg_str2bool,
+        required=False,
+        default=False,
+        nargs="?",
+        const=True,
+        help="""
+        If specified, alignments are loaded into a columnar table and filtered/sorted
+        one column at a time rather than one alignment at a time. This is much faster
+        for large alignment files. Numeric fields are written in python's number
+        format rather than as they are in the input (e.g. 5.558E-10 is written as
+        5.558e-10, 1.000 as 1.0, and a bits value of 347 as 347.0). Not compatible
+        with --streaming.
+        """,
+    )
     parser_aln_filter.set_defaults(func=call_aln_filter_main)
 
     # -------------------------------------------------------------------------------- #
@@ -2054,6 +2452,10 @@ def main():
             if any additional information is present in the tabular infile it will be
             appended to the output files - this is a good way to lable the files with
             information like taxonomyID, etc.
+
+            Entries are downloaded concurrently by --workers threads, and failed
+            requests are retried. Completed entries are recorded in a manifest, so
+            rerunning the same command skips them and only retries what is left.
             """
         ),
     )
@@ -2079,6 +2481,8 @@ def main():
         required=True,
         help="""
         Path to the output directory that will contain all output pdb and pae files.
+        If it ends in .store, the files are added to a structure store (a few large
+        tar archives with an index) instead of being written separately.
         """,
     )
     parser_struc_download.add_argument(
@@ -2105,6 +2509,60 @@ def main():
         present in the infile.
         """,
     )
+    parser_struc_download.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        required=False,
+        default=8,
+        help="""
+        Number of entries downloaded at once. [Default: 8]
+        """,
+    )
+    parser_struc_download.add_argument(
+        "-r",
+        "--rate_limit",
+        type=float,
+        required=False,
+        default=0,
+        help="""
+        Maximum number of requests started per second, across all workers. 0 means
+        there is no limit. [Default: 0]
+        """,
+    )
+    parser_struc_download.add_argument(
+        "-R",
+        "--retries",
+        type=int,
+        required=False,
+        default=5,
+        help="""
+        Number of times a failed request is retried, with exponential backoff between
+        attempts. [Default: 5]
+        """,
+    )
+    parser_struc_download.add_argument(
+        "-m",
+        "--manifest",
+        type=str,
+        required=False,
+        default="",
+        help="""
+        Path to the manifest of completed entries. Entries in the manifest are skipped.
+        [Default: output_dir/struc_download_manifest.tsv]
+        """,
+    )
+    parser_struc_download.add_argument(
+        "-u",
+        "--api_url",
+        type=str,
+        required=False,
+        default="https://alphafold.ebi.ac.uk/api/prediction",
+        help="""
+        Base url of the AF2 prediction api. [Default:
+        https://alphafold.ebi.ac.uk/api/prediction]
+        """,
+    )
     parser_struc_download.set_defaults(func=call_struc_download_main)
 
     # -------------------------------------------------------------------------------- #
@@ -2268,6 +2726,33 @@ def main():
         by the suffix of this argument.
         """,
     )
+    parser_plot_pae.add_argument(
+        "-C",
+        "--pae_cache",
+        type=arg_str2bool,
+        required=False,
+        default=False,
+        nargs="?",
+        const=True,
+        help="""
+        If specified, the PAE matrix is stored in a binary file next to the json file
+        ({json}.pae_cache.npz) the first time it is read. Later runs load it from
+        there instead of parsing the json file, as long as the json file is unchanged.
+        """,
+    )
+    parser_plot_pae.add_argument(
+        "-T",
+        "--pae_cache_dtype",
+        type=str,
+        required=False,
+        default="float64",
+        choices=["float64", "float32", "float16"],
+        help="""
+        The precision with which the PAE matrix is stored in and read from the PAE
+        cache. Lower precision takes less memory. Only used with --pae_cache.
+        [Default: float64]
+        """,
+    )
     parser_plot_pae.set_defaults(func=call_plot_pae_main)
 
     # ----------------------------------------------------------------------------------#
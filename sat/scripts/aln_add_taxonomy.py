@@ -1,11 +1,14 @@
 from .utils.misc import make_output_dir, talk_to_me
 from .utils.Foldseek_Dataset import Foldseek_Dataset
+from .utils.ete3_taxonomy import Lineage_cache, set_taxonomy_database
 
 
 def validate_and_format_args(args):
     # Format args
     args.taxonomy_levels = args.taxonomy_levels.split(",")
 
+    if args.taxonomy_database != "":
+        set_taxonomy_database(args.taxonomy_database)
     return args
 
 
@@ -25,9 +28,14 @@ def aln_add_taxonomy_main(args):
     out = "\t".join(data.input_alignment_fields + taxonomy_cols) + "\n"
 
     # Label with taxonomy and generate an output string
+    lineage_cache = Lineage_cache(args.lineage_cache, args.taxonomy_levels)
     data.add_taxon_to_alignments(
-        args.taxonomy_levels, args.taxonID_finder_delimiter, args.taxonID_finder_pos
+        args.taxonomy_levels,
+        args.taxonID_finder_delimiter,
+        args.taxonID_finder_pos,
+        lineage_cache,
     )
+    lineage_cache.save()
 
     # Note that query_taxon and target_taxon will yield a Taxon() object in the
     # alignment object, which will then be parsed for the canonical lineage.
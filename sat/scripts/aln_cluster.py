@@ -1,52 +1,27 @@
-from .utils.Foldseek_Dataset import Foldseek_Dataset
-from .utils.misc import talk_to_me, make_output_dir
+from .utils.alignments import read_alignment_header, stream_alignment_fields
+from .utils.misc import talk_to_me, make_output_dir, open_file
+from .utils.clusters import Union_find
 
 
 def aln_cluster_main(args):
 
-    talk_to_me("Parsing input alignment file")
-    data = Foldseek_Dataset()
-    data.parse_alignment(args.alignment_file, args.alignment_fields)
-
-    talk_to_me("Generating clusters")
-    clusters = []
-    seen_members = set()
-    for query, alignment_group in data.alignment_groups.items():
-        for alignment in alignment_group.alignments:
-            query = alignment.query
-            target = alignment.target
-
-            # Find current cluster for query and target. Will also set the defaults here
-            query_cluster = {query}
-            target_cluster = {target}
-            for cluster in clusters:
-                if query in cluster:
-                    query_cluster = cluster
-                if target in cluster:
-                    target_cluster = cluster
-                if query_cluster != {query} and target_cluster != {target}:
-                    break
-
-            # If they're alread in the same cluster, we're done here
-            if query_cluster == target_cluster:
+    # Alignments are read one line at a time and only the clusters are kept, so memory
+    # scales with the number of members rather than the number of alignments
+    talk_to_me("Parsing input alignment file and generating clusters")
+    union_find = Union_find()
+    with open_file(args.alignment_file) as infile:
+        alignment_fields = read_alignment_header(infile, args.alignment_fields)
+        pairs = stream_alignment_fields(infile, alignment_fields, ["query", "target"])
+        for query, target in pairs:
+
+            # Self alignments alone don't put a member into a cluster
+            if query == target:
                 continue
 
-            # Need to merge their clusters
-            merged_cluster = query_cluster.union(target_cluster)
-
-            # If the query cluster or the target cluster is in the clusters, need to
-            # remove it
-            if query_cluster in clusters:
-                clusters.remove(query_cluster)
-            if target_cluster in clusters:
-                clusters.remove(target_cluster)
-
-            # Then replace it with the merged cluster
-            clusters.append(merged_cluster)
+            union_find.union(query, target)
 
-            # Keep track of all seen members
-            seen_members.add(query)
-            seen_members.add(target)
+    seen_members = set(union_find.members)
+    clusters = union_find.get_clusters()
 
     # If there is an all_inputs file: For those inputs that don't have an alignment,
     # add them as a single-member cluster.
@@ -1,41 +1,131 @@
+from .utils.Alignment_table import Alignment_table
 from .utils.Foldseek_Dataset import Foldseek_Dataset
-from .utils.misc import talk_to_me, make_output_dir
+from .utils.alignments import (
+    parse_filter_predicates,
+    read_alignment_header,
+    stream_alignment_groups,
+)
+from .utils.misc import talk_to_me, make_output_dir, open_file
 
 
 def validate_and_format_args(args):
     # Format args
-    if args.alignment_fields != "":
+    if args.alignment_fields != "" and not isinstance(args.alignment_fields, list):
         args.alignment_fields = args.alignment_fields.split(",")
+    if isinstance(args.filters, str):
+        args.filters = parse_filter_predicates(args.filters)
+
+    # Check args
+    if args.streaming and args.columnar:
+        msg = "Only one of --streaming and --columnar can be specified."
+        raise ValueError(msg)
     return args
 
 
+def filter_alignment_group(aln_group, args):
+    """
+    Filters the alignment group in place, keeping alignments within the specified
+    min/max values of the filter_field that pass all additional filters, and then
+    only the top N alignments.
+    """
+    aln_group.aln_filter(
+        args.filter_field, args.max_val_filter_field, args.min_val_filter_field
+    )
+    aln_group.filter_by_predicates(args.filters)
+    aln_group.keep_top_N_alignments(args.filter_field, args.N)
+
+
+def aln_filter_streaming(args):
+    """
+    Reads, filters, and writes one query's alignments at a time. This requires the
+    alignments of each query to be on consecutive lines, as they are in foldseek
+    output.
+    """
+    with open_file(args.alignment_file) as infile:
+
+        # Check the header before the output file is made, so a bad input doesn't
+        # leave behind an empty output file
+        input_fields = read_alignment_header(infile, args.alignment_fields)
+
+        with open_file(args.output_file, "w") as outfile:
+            outfile.write("\t".join(input_fields) + "\n")
+
+            for aln_group in stream_alignment_groups(infile, input_fields):
+                filter_alignment_group(aln_group, args)
+                for aln in aln_group.alignments:
+                    outfile.write(aln.write_output(input_fields))
+
+
+def aln_filter_columnar(args):
+    """
+    Loads the alignments into an Alignment_table, and filters and sorts them one
+    column at a time.
+    """
+    data = Alignment_table()
+    data.parse_alignment(args.alignment_file, args.alignment_fields)
+
+    if args.alignment_fields == "":
+        output_fields = data.input_alignment_fields
+    else:
+        output_fields = args.alignment_fields
+
+    if args.max_val_filter_field < args.min_val_filter_field:
+        msg = (
+            f"max_val can't be higher than min_val! "
+            f"max_val: {args.max_val_filter_field}, "
+            f"min_val:{args.min_val_filter_field}"
+        )
+        raise ValueError(msg)
+    predicates = [
+        (args.filter_field, ">=", args.min_val_filter_field),
+        (args.filter_field, "<=", args.max_val_filter_field),
+    ]
+    data = data.filter(predicates + args.filters)
+    data = data.keep_top_N_alignments(args.filter_field, args.N)
+
+    with open_file(args.output_file, "w") as outfile:
+        outfile.write("\t".join(output_fields) + "\n")
+        data.write_out_alignments(outfile, output_fields)
+
+
 def aln_filter_main(args):
     args = validate_and_format_args(args)
 
-    talk_to_me("Reading in alignments.")
+    # If writing to stdout, don't clutter the output with progress messages
+    verbose = args.output_file != "-"
+    if verbose:
+        make_output_dir(args.output_file)
+
+    if args.streaming:
+        if verbose:
+            talk_to_me("Filtering alignments one query at a time.")
+        aln_filter_streaming(args)
+        return
+
+    if args.columnar:
+        if verbose:
+            talk_to_me("Reading, filtering, and writing alignments by column.")
+        aln_filter_columnar(args)
+        return
+
+    if verbose:
+        talk_to_me("Reading in alignments.")
     data = Foldseek_Dataset()
     data.parse_alignment(args.alignment_file, args.alignment_fields)
 
     if args.alignment_fields == "":
         output_fields = data.input_alignment_fields
-        out = "\t".join(data.input_alignment_fields) + "\n"
     else:
         output_fields = args.alignment_fields
-        out = "\t".join(args.alignment_fields) + "\n"
 
-    talk_to_me("Filtering and generating output string.")
-    for _, aln_group in data.alignment_groups.items():
-        aln_group.aln_filter(
-            args.filter_field, args.max_val_filter_field, args.min_val_filter_field
-        )
-        aln_group.keep_top_N_alignments(args.filter_field, args.N)
-        for aln in aln_group.alignments:
-            out += aln.write_output(output_fields)
-
-    talk_to_me("Writing output file.")
-    make_output_dir(args.output_file)
-    with open(args.output_file, "w") as outfile:
-        outfile.write(out)
+    if verbose:
+        talk_to_me("Filtering and writing output file.")
+    with open_file(args.output_file, "w") as outfile:
+        outfile.write("\t".join(output_fields) + "\n")
+        for _, aln_group in data.alignment_groups.items():
+            filter_alignment_group(aln_group, args)
+            for aln in aln_group.alignments:
+                outfile.write(aln.write_output(output_fields))
 
 
 if __name__ == "__main__":
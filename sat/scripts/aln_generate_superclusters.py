@@ -1,5 +1,7 @@
+from collections import Counter
+
 from .utils.misc import talk_to_me, make_output_dir
-from .utils.Foldseek_Dataset import Foldseek_Dataset
+from .utils.Alignment_table import Alignment_table
 from .utils.clusters import Cluster_information
 
 
@@ -72,8 +74,8 @@ class Super_cluster:
 
 def get_alignment_dict(alignments):
     """
-    Takes in a foldseek dataset and returns a dictionary of structure
-    query:set of targets
+    Takes in a foldseek dataset (or an Alignment_table) and returns a dictionary of
+    structure query:set of targets
     """
     alignment_dict = dict()
     for _, alignment_group in alignments.alignment_groups.items():
@@ -111,75 +113,108 @@ def get_percentage_of_members_with_alignments(
     return c1_p
 
 
-def get_cluster_linkages(cluster_dict, alignment_dict, linkage_threshold):
+def get_cluster_pair_counts(alignment_dict, cluster_member_to_rep):
+    """
+    Walks the alignments once and counts, for every pair of clusters, the number of
+    members of the first cluster that have at least one alignment to a member of the
+    second cluster.
+
+    Input:
+    - alignment_dict - dictionary of structure query:{set of targets}
+    - cluster_member_to_rep - dictionary of structure cluster_member:cluster_rep
+
+    Output:
+    - pair_counts - Counter of structure (rep1, rep2):count, where count is the number
+      of members of rep1's cluster with an alignment to a member of rep2's cluster. Note
+      that rep1 can equal rep2. Queries and targets that aren't in a cluster are
+      ignored.
+    """
+    pair_counts = Counter()
+    for query, targets in alignment_dict.items():
+        rep1 = cluster_member_to_rep.get(query)
+        if rep1 is None:
+            continue
+
+        # A member only counts once per target cluster, no matter how many members of
+        # that cluster it aligns to.
+        target_reps = set()
+        for target in targets:
+            rep2 = cluster_member_to_rep.get(target)
+            if rep2 is not None:
+                target_reps.add(rep2)
+
+        for rep2 in target_reps:
+            pair_counts[(rep1, rep2)] += 1
+
+    return pair_counts
+
+
+def get_cluster_linkages(
+    cluster_dict, alignment_dict, linkage_threshold, cluster_member_to_rep=None
+):
     """
     This function identifies, for every cluster, the clusters it is linked to.
     Two clusters are considered linked if at least linkage_threshold fraction of members
     of at least one of the clusters have an alignment against targets in the other
     cluster.
 
+    Rather than comparing every pair of clusters, this counts cross-cluster alignments
+    in a single pass over the alignments (see get_cluster_pair_counts), so the cost
+    scales with the number of alignments rather than the number of clusters squared.
+    Only cluster pairs with at least one cross-cluster alignment can be linked - unless
+    linkage_threshold is <= 0, in which case every pair of clusters is linked.
+
     Input:
     - cluster_dict - dictionary of structure cluster_rep:{set of cluster members}
     - alignment_dict - dictionary of structure query:{set of targets} for every query
       in the alignment
+    - cluster_member_to_rep - dictionary of structure cluster_member:cluster_rep. If
+      not provided, it is generated from cluster_dict.
 
     Output:
     - cluster_linkages - dictionary of structure cluster_rep:{set of cluster_reps it is
     linked to}.
     """
+    if cluster_member_to_rep is None:
+        cluster_member_to_rep = dict()
+        for rep, members in cluster_dict.items():
+            for member in members:
+                cluster_member_to_rep[member] = rep
+
+    cluster_linkages = {rep: set() for rep in cluster_dict}
 
-    cluster_linkages = dict()
-    compared_clusters = set()
+    # Every pair of clusters (including a cluster with itself) passes a threshold of 0
+    if linkage_threshold <= 0:
+        all_reps = set(cluster_dict)
+        for rep in cluster_linkages:
+            cluster_linkages[rep] = set(all_reps)
+        return cluster_linkages
+
+    pair_counts = get_cluster_pair_counts(alignment_dict, cluster_member_to_rep)
 
     # For a counter report
-    total_comparisons = len(cluster_dict) * len(cluster_dict)
-    current_count = 0
+    total_pairs = len(pair_counts)
     previous_progress_report = 0
 
-    for rep1, cluster_members1 in cluster_dict.items():
-        for rep2, cluster_members2 in cluster_dict.items():
+    for i, ((rep1, rep2), c1_count) in enumerate(pair_counts.items()):
 
-            current_count += 1
+        # Here, are determining the fraction of members of cluster 1 that have at
+        # least one alignment against members of cluster2, and then the reverse.
+        c1_p = c1_count / len(cluster_dict[rep1])
+        c2_p = pair_counts.get((rep2, rep1), 0) / len(cluster_dict[rep2])
 
-            # Don't repeat effort
-            comparison = frozenset([rep1, rep2])
-            if comparison in compared_clusters:
-                continue
-            else:
-                compared_clusters.add(comparison)
-
-            # Initialize items in cluster_linkages if necessary
-            if rep1 not in cluster_linkages:
-                cluster_linkages[rep1] = set()
-            if rep2 not in cluster_linkages:
-                cluster_linkages[rep2] = set()
-
-            # Here, are determining the percentage of members of cluster 1 that have at
-            # least one alignment against members of cluster2. Am using set intersection
-            # which should be faster. Then do the reverse.
-            c1_p = get_percentage_of_members_with_alignments(
-                cluster_members1, cluster_members2, alignment_dict
-            )
-            c2_p = get_percentage_of_members_with_alignments(
-                cluster_members2, cluster_members1, alignment_dict
-            )
-
-            # If cluster 1 or cluster 2 has the sufficient fraction of members with
-            # cross-cluster alignments, they're considered linked.
-            if c1_p >= linkage_threshold or c2_p >= linkage_threshold:
-                cluster_linkages[rep1].add(rep2)
-                cluster_linkages[rep2].add(rep1)
-
-            comparison_progress = (current_count / total_comparisons) * 100
-            comparison_progress = round(comparison_progress, 0)
-            if (
-                comparison_progress % 1 == 0
-                and comparison_progress > previous_progress_report
-            ):
-                msg = "get_cluster_linkages - have completed: "
-                msg += f"{comparison_progress}% of comparisons..."
-                print(msg)
-                previous_progress_report = comparison_progress
+        # If cluster 1 or cluster 2 has the sufficient fraction of members with
+        # cross-cluster alignments, they're considered linked.
+        if c1_p >= linkage_threshold or c2_p >= linkage_threshold:
+            cluster_linkages[rep1].add(rep2)
+            cluster_linkages[rep2].add(rep1)
+
+        comparison_progress = round(((i + 1) / total_pairs) * 100, 0)
+        if comparison_progress > previous_progress_report:
+            msg = "get_cluster_linkages - have completed: "
+            msg += f"{comparison_progress}% of comparisons..."
+            print(msg)
+            previous_progress_report = comparison_progress
 
     return cluster_linkages
 
@@ -210,6 +245,71 @@ def all_are_linked(s1, s2, cluster_linkages):
     return True
 
 
+class Supercluster_index:
+    """
+    Holds the superclusters being built by get_superclusters, indexed so that no step
+    requires scanning every supercluster.
+
+    Slots:
+    - superclusters: dictionary of structure sc_key:{set of cluster reps}. It is
+      ordered by when each supercluster was created, and merged superclusters are
+      (re)created at the end.
+    - member_to_key: dictionary of structure cluster_rep:sc_key
+    - common_linkages: dictionary of structure sc_key:{set of cluster_reps linked to
+      every member of the supercluster}. This is the intersection of the linkages of
+      all members, and is kept up to date as superclusters merge.
+    """
+
+    def __init__(self, cluster_linkages):
+        self.cluster_linkages = cluster_linkages
+        self.superclusters = dict()
+        self.member_to_key = dict()
+        self.common_linkages = dict()
+        self.next_key = 0
+
+    def _add(self, members, common_linkages):
+        key = self.next_key
+        self.next_key += 1
+        self.superclusters[key] = members
+        self.common_linkages[key] = common_linkages
+        for member in members:
+            self.member_to_key[member] = key
+        return key
+
+    def get_key(self, cluster):
+        """
+        Returns the key of the supercluster holding cluster. If cluster isn't in a
+        supercluster yet, a new supercluster containing only cluster is made.
+        """
+        key = self.member_to_key.get(cluster)
+        if key is None:
+            key = self._add(set([cluster]), set(self.cluster_linkages[cluster]))
+        return key
+
+    def all_are_linked(self, key1, key2):
+        """
+        Equivalent to all_are_linked(s1, s2, cluster_linkages) for the superclusters
+        at key1 and key2, but uses the cached linkage intersections so the cost is
+        proportional to the size of the superclusters rather than their product.
+        """
+        if key1 == key2:
+            return True
+        s1 = self.superclusters[key1]
+        s2 = self.superclusters[key2]
+        return s2.issubset(self.common_linkages[key1]) and s1.issubset(
+            self.common_linkages[key2]
+        )
+
+    def merge(self, key1, key2):
+        """
+        Merges the superclusters at key1 and key2 into a new supercluster.
+        """
+        members = self.superclusters.pop(key1).union(self.superclusters.pop(key2))
+        common_linkages = self.common_linkages.pop(key1)
+        common_linkages.intersection_update(self.common_linkages.pop(key2))
+        return self._add(members, common_linkages)
+
+
 def get_superclusters(cluster_linkages):
     """
     Takes in linked_clusters, which is a dictionary of format
@@ -217,9 +317,14 @@ def get_superclusters(cluster_linkages):
 
     Returns superclusters, which is a list of sets, where each set is the members
     of the supercluster.
+
+    Clusters are visited in order and each linked pair of clusters has their
+    superclusters merged if every member of one supercluster is linked to every member
+    of the other (see all_are_linked). The superclusters are held in a
+    Supercluster_index so that merges don't require rescanning the superclusters.
     """
 
-    scs = []
+    scs = Supercluster_index(cluster_linkages)
     progress = 0
     total = len(cluster_linkages)
     for c1, linked_clusters in cluster_linkages.items():
@@ -229,38 +334,20 @@ def get_superclusters(cluster_linkages):
             print(f"get_superclusters - progress: {progress}/{total}")
 
         if linked_clusters == set():
-            c1_sc = set([c1])
-            for sc in scs:
-                if c1 in sc:
-                    c1_sc = sc
-            if c1_sc == set([c1]):
-                scs.append(c1_sc)
-                continue
+            scs.get_key(c1)
+            continue
 
         for c2 in linked_clusters:
-            c1_sc = set([c1])
-            c2_sc = set([c2])
-            for sc in scs:
-                if c1 in sc:
-                    c1_sc = sc
-                if c2 in sc:
-                    c2_sc = sc
-                if c1_sc != set([c1]) and c2_sc != set([c2]):
-                    break
-
-            if c1_sc == set([c1]) and c1_sc not in scs:
-                scs.append(c1_sc)
-            if c2_sc == set([c2]) and c2_sc not in scs:
-                scs.append(c2_sc)
-
-            if all_are_linked(c1_sc, c2_sc, cluster_linkages):
-                merged_sc = c1_sc.union(c2_sc)
-                if c1_sc == c2_sc:
-                    continue
-                scs.remove(c1_sc)
-                scs.remove(c2_sc)
-                scs.append(merged_sc)
-    return scs
+            c1_key = scs.get_key(c1)
+            c2_key = scs.get_key(c2)
+
+            if c1_key == c2_key:
+                continue
+
+            if scs.all_are_linked(c1_key, c2_key):
+                scs.merge(c1_key, c2_key)
+
+    return list(scs.superclusters.values())
 
 
 def generate_output(ordered_scs, cluster_rep_to_members, all_members):
@@ -313,13 +400,17 @@ def aln_generate_superclusters_main(args):
     cluster_info.parse_cluster_file(args.cluster_file, args.cluster_file_fields)
 
     talk_to_me("Parsing alignment")
-    data = Foldseek_Dataset()
+    data = Alignment_table()
     data.parse_alignment(args.alignment_file, args.alignment_fields)
     alignment_dict = get_alignment_dict(data)
+    del data
 
     talk_to_me("Determining linked clusters and grouping to superclusters.")
     cluster_linkages = get_cluster_linkages(
-        cluster_info.cluster_rep_to_members, alignment_dict, args.linkage_threshold
+        cluster_info.cluster_rep_to_members,
+        alignment_dict,
+        args.linkage_threshold,
+        cluster_info.cluster_member_to_rep,
     )
     superclusters = get_superclusters(cluster_linkages)
 
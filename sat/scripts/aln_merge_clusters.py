@@ -1,6 +1,6 @@
 from .utils.Foldseek_Dataset import Foldseek_Dataset
 from .utils.misc import talk_to_me, make_output_dir
-from .utils.clusters import Cluster_information
+from .utils.clusters import Cluster_information, Union_find
 from .aln_generate_superclusters import Super_cluster
 
 
@@ -40,13 +40,14 @@ def get_superclusters_no_reciprocal(cluster_linkages):
     the cluster representatives.
 
     Returns superclusters, which is a list of sets, where each set is the members
-    of the supercluster.
+    of the supercluster. Superclusters are ordered by their first appearance in
+    cluster_linkages.
 
     Note that this function puts all reps that are linked into the same supercluster -
     it doesn't check for linkage/alignments between cluster members.
     """
 
-    scs = []
+    scs = Union_find()
     progress = 0
     total = len(cluster_linkages)
     for c1, linked_clusters in cluster_linkages.items():
@@ -55,38 +56,11 @@ def get_superclusters_no_reciprocal(cluster_linkages):
         if progress % 100 == 0:
             print(f"get_superclusters - progress: {progress}/{total}")
 
-        if linked_clusters == set():
-            c1_sc = set([c1])
-            for sc in scs:
-                if c1 in sc:
-                    c1_sc = sc
-            if c1_sc == set([c1]):
-                scs.append(c1_sc)
-                continue
-
+        scs.add(c1)
         for c2 in linked_clusters:
-            c1_sc = set([c1])
-            c2_sc = set([c2])
-            for sc in scs:
-                if c1 in sc:
-                    c1_sc = sc
-                if c2 in sc:
-                    c2_sc = sc
-                if c1_sc != set([c1]) and c2_sc != set([c2]):
-                    break
-
-            if c1_sc == set([c1]) and c1_sc not in scs:
-                scs.append(c1_sc)
-            if c2_sc == set([c2]) and c2_sc not in scs:
-                scs.append(c2_sc)
-
-            merged_sc = c1_sc.union(c2_sc)
-            if c1_sc == c2_sc:
-                continue
-            scs.remove(c1_sc)
-            scs.remove(c2_sc)
-            scs.append(merged_sc)
-    return scs
+            scs.union(c1, c2)
+
+    return scs.get_clusters()
 
 
 def generate_output(ordered_scs, cluster_information):
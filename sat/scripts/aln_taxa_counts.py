@@ -1,11 +1,18 @@
 from .utils.Foldseek_Dataset import Foldseek_Dataset
 from .utils.misc import make_output_dir, talk_to_me
 from .utils.clusters import Cluster_information
-from .utils.ete3_taxonomy import taxon_list_to_lineage_counts, Taxon
+from .utils.ete3_taxonomy import (
+    taxon_list_to_lineage_counts,
+    Taxon,
+    Lineage_cache,
+    set_taxonomy_database,
+)
 
 
 def format_args(args):
     args.taxonomy_levels = args.taxonomy_levels.split(",")
+    if args.taxonomy_database != "":
+        set_taxonomy_database(args.taxonomy_database)
     return args
 
 
@@ -63,13 +70,15 @@ def aln_taxa_counts_main(args):
         clusters, args.taxonID_finder_delimiter, args.taxonID_finder_pos
     )
 
+    lineage_cache = Lineage_cache(args.lineage_cache, args.taxonomy_levels)
+
     # If there is an alignment file, will all the target taxonIDs to the cluster_ID of
     # each query cluster_ID.
     if args.alignment_file != "":
         talk_to_me("Parsing alignment file")
         data = Foldseek_Dataset()
         data.parse_alignment(args.alignment_file, args.alignment_fields)
-        data.add_taxon_to_alignments(args.taxonomy_levels)
+        data.add_taxon_to_alignments(args.taxonomy_levels, lineage_cache=lineage_cache)
 
         # Find each query's cluster_ID, and then add each target taxonID to the
         # cluster_ID_to_taxonIDs
@@ -81,6 +90,11 @@ def aln_taxa_counts_main(args):
     # Convert the structure from cluster_ID:set of taxonIDs TO
     # cluster_ID:set of Taxon objects.
     talk_to_me("Generating Taxon objects")
+    lineage_cache.add_taxonIDs(
+        taxonID
+        for taxonID_list in cluster_rep_to_taxonIDs.values()
+        for taxonID in taxonID_list
+    )
     taxonID_to_taxon = dict()
     cluster_rep_to_taxons = dict()
     for cluster_rep, taxonID_list in cluster_rep_to_taxonIDs.items():
@@ -88,7 +102,9 @@ def aln_taxa_counts_main(args):
             if taxonID in taxonID_to_taxon:
                 taxon_object = taxonID_to_taxon[taxonID]
             else:
-                taxon_object = Taxon(taxonID, args.taxonomy_levels)
+                taxon_object = Taxon(
+                    taxonID, args.taxonomy_levels, lineage_cache=lineage_cache
+                )
                 taxonID_to_taxon[taxonID] = taxon_object
 
             if cluster_rep not in cluster_rep_to_taxons:
@@ -96,6 +112,8 @@ def aln_taxa_counts_main(args):
 
             cluster_rep_to_taxons[cluster_rep].add(taxon_object)
 
+    lineage_cache.save()
+
     # Generate the output
     talk_to_me("Generating output")
     out = [
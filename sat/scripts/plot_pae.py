@@ -4,7 +4,9 @@ from .utils.misc import make_output_dir, talk_to_me
 
 def plot_pae_main(args):
     talk_to_me("Parsing json file.")
-    pae = parse_json_file(args.scores)[0]
+    pae = parse_json_file(
+        args.scores, cache=args.pae_cache, cache_dtype=args.pae_cache_dtype
+    )[0]
     plt = visualize_PAE(pae)
 
     talk_to_me("Writing image")
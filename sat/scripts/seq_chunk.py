@@ -1,7 +1,7 @@
 # ------------------------------------------------------------------------------------ #
 # Import dependencies
 # ------------------------------------------------------------------------------------ #
-from .utils.misc import read_fasta_to_memory, make_output_dir, talk_to_me
+from .utils.misc import read_fasta_to_memory, make_output_dir, open_file, talk_to_me
 
 
 # ------------------------------------------------------------------------------------ #
@@ -71,7 +71,7 @@ def seq_chunk_main(args):
         make_output_dir(args.out_fasta, is_dir=True)
         for header, seq in out_fasta_dict.items():
             outfile = args.out_fasta + header + ".fasta"
-            with open(outfile, "w") as outfile:
+            with open_file(outfile, "w") as outfile:
                 out = ">{}\n{}\n".format(header, seq)
                 outfile.write(out)
 
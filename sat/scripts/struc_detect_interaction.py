@@ -1,7 +1,8 @@
 import os
 import numpy as np
+from Bio.PDB import NeighborSearch
 
-from .struc_get_domains import parse_json_file, domains_from_pae_matrix_networkx
+from .struc_get_domains import parse_json_file, domains_from_pae_matrix
 from .utils.structure import pdb_to_structure_object
 from .utils.misc import talk_to_me, make_output_dir
 
@@ -85,27 +86,43 @@ def atoms_interact(
     return False
 
 
-def find_interacting_residues(chain_1, chain_2):
+def find_interacting_residues(
+    chain_1,
+    chain_2,
+    vdw_radii={"H": 1.2, "C": 1.7, "N": 1.55, "O": 1.52, "S": 1.8},
+):
     """
-    chain_1 and chain_2 are biopython chain objects. This function runs the
-    atoms_interact() function on every pair of atoms in each residue of each chain. If
-    one residue of one chain has an atom that interacts with one atom of one residue in
+    chain_1 and chain_2 are biopython chain objects. This function finds every pair of
+    atoms, one from each chain, that interact according to atoms_interact(). If one
+    residue of one chain has an atom that interacts with one atom of one residue in
     the other chain, those two residues are considered interacting.
 
     The output is a set of tuples, where each tuple is two biopython residue objects.
     The first is the reisdue from chain 1 and the second is the residue from chain 2
     that is interacting with that residue.
 
-    Because this iterates over every pair of atoms, this can take some time (10s of
-    seconds for a small protein pair, probably 1min + for larger proteins).
+    Rather than testing every pair of atoms, the atoms of chain_2 are indexed in a
+    KD-tree (biopython's NeighborSearch). For each atom of chain_1, only the atoms of
+    chain_2 within the largest possible interaction distance are tested with
+    atoms_interact().
     """
     # a set to hold the interacting residue pairs
     interacting_residues = set()
 
-    # for each pair of atoms, one from chain A and the other from chain B
+    atoms_2 = list(chain_2.get_atoms())
+    if atoms_2 == []:
+        return interacting_residues
+    neighbor_search = NeighborSearch(atoms_2)
+
+    # The largest van der Waals radius of any atom in chain 2. A small margin is added
+    # to the search radius so floating point differences can't drop a pair -
+    # atoms_interact() makes the final call.
+    max_vdw_2 = max(vdw_radii.get(atom.element, 0) for atom in atoms_2)
+
     for atom_a in chain_1.get_atoms():
-        for atom_b in chain_2.get_atoms():
-            if atoms_interact(atom_a, atom_b):
+        radius = vdw_radii.get(atom_a.element, 0) + max_vdw_2 + 0.5 + 1e-3
+        for atom_b in neighbor_search.search(atom_a.coord, radius):
+            if atoms_interact(atom_a, atom_b, vdw_radii):
                 interacting_residues.add((atom_a.get_parent(), atom_b.get_parent()))
 
     return interacting_residues
@@ -146,11 +163,15 @@ def struc_detect_interaction_main(args):
     chain_1_residue_count = len(list(chain_1.get_residues()))
     chain_2 = struc[0][chains[1]]
     chain_2_residue_count = len(list(chain_2.get_residues()))
-    pae = parse_json_file(args.pae)[0]
+    pae = parse_json_file(
+        args.pae, cache=args.pae_cache, cache_dtype=args.pae_cache_dtype
+    )[0]
 
     # Determine if there is a cross-chain cluster
     talk_to_me("Detecting cross-chain clusters...")
-    domains = domains_from_pae_matrix_networkx(pae, pae_cutoff=5)
+    domains = domains_from_pae_matrix(
+        pae, pae_cutoff=5, backend=args.clustering_backend
+    )
     cross_chain_cluster = False
     for domain in domains:
         # Classification gives a dictionary with keys "A"/"B", with values being
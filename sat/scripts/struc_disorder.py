@@ -1,7 +1,49 @@
+import functools
 import os
+from contextlib import ExitStack
 
-from .utils.structure import pdb_to_structure_object, structure_to_pLDDT
-from .utils.misc import make_output_dir, talk_to_me
+import numpy as np
+
+from .utils.structure import pdb_to_residue_table, structure_to_pLDDT
+from .utils.misc import (
+    get_structure_paths,
+    make_output_dir,
+    open_file,
+    process_map,
+    talk_to_me,
+)
+
+
+STRETCH_FIELDS = ["structure", "start", "end", "state", "length", "mean_plddt"]
+
+
+def find_stretches(mask, n_sequential):
+    """
+    mask is a boolean array of residue-wise values. Returns two numpy arrays with the
+    starts and ends of each stretch of at least n_sequential consecutive True values.
+    Positions are 0-indexed and ends are exclusive, so the length of each stretch is
+    end - start.
+    """
+    mask = np.asarray(mask, dtype=bool)
+
+    # Stretches start where the padded mask goes from False to True, and end where it
+    # goes from True to False
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], mask.view(np.int8), [0]])))
+    starts = edges[::2]
+    ends = edges[1::2]
+
+    keep = ends - starts >= n_sequential
+    return starts[keep], ends[keep]
+
+
+def stretches_to_positions(starts, ends):
+    """
+    Converts the starts and ends from find_stretches to a list of lists, where each
+    sublist contains the 0-indexed positions of a stretch.
+    """
+    return [
+        list(range(start, end)) for start, end in zip(starts.tolist(), ends.tolist())
+    ]
 
 
 def find_disorder(plddts, cutoff, n_sequential):
@@ -13,23 +55,8 @@ def find_disorder(plddts, cutoff, n_sequential):
     A residue is considered disordered if it is in a stretch of at least n_sequential
     residues that have a pLDDT of <= cutoff.
     """
-
-    stretches = []
-    current_stretch = []
-
-    for i, value in enumerate(plddts):
-        if value <= cutoff:
-            current_stretch.append(i)
-        else:
-            if len(current_stretch) >= n_sequential:
-                stretches.append(current_stretch)
-            current_stretch = []
-
-    # Check for a valid stretch at the end of the list
-    if len(current_stretch) >= n_sequential:
-        stretches.append(current_stretch)
-
-    return stretches
+    starts, ends = find_stretches(np.asarray(plddts) <= cutoff, n_sequential)
+    return stretches_to_positions(starts, ends)
 
 
 def find_order(plddts, cutoff, n_sequential):
@@ -41,54 +68,57 @@ def find_order(plddts, cutoff, n_sequential):
     A residue is considered ordered if it is in a stretch of at least n_sequential
     residues that have a pLDDT of >= cutoff.
     """
-    stretches = []
-    current_stretch = []
-
-    for i, value in enumerate(plddts):
-        if value >= cutoff:
-            current_stretch.append(i)
-        else:
-            if len(current_stretch) >= n_sequential:
-                stretches.append(current_stretch)
-            current_stretch = []
+    starts, ends = find_stretches(np.asarray(plddts) >= cutoff, n_sequential)
+    return stretches_to_positions(starts, ends)
 
-    # Check for a valid stretch at the end of the list
-    if len(current_stretch) >= n_sequential:
-        stretches.append(current_stretch)
 
-    return stretches
+def get_stretch_lines(name, plddts, starts, ends, states):
+    """
+    Returns one line of the stretch table (see STRETCH_FIELDS) for each stretch, in
+    order of their start. states holds the state of each stretch (e.g. ordered). Like
+    a BED file, start is 0-indexed and end is exclusive.
+    """
+    order = np.argsort(starts, kind="stable")
+    starts = starts[order]
+    ends = ends[order]
+    states = [states[i] for i in order.tolist()]
+
+    sums = np.concatenate([[0], np.cumsum(plddts)])
+    lengths = ends - starts
+    means = (sums[ends] - sums[starts]) / lengths
+    return [
+        f"{name}\t{start}\t{end}\t{state}\t{length}\t{mean:.2f}\n"
+        for start, end, state, length, mean in zip(
+            starts.tolist(), ends.tolist(), states, lengths.tolist(), means.tolist()
+        )
+    ]
 
 
-def struc_disorder_main(args):
-    # Parse the structure
-    talk_to_me("Parsing structure file.")
-    struc = pdb_to_structure_object(args.structure_file)
-    plddts = structure_to_pLDDT(struc, format="l")
+def struc_disorder_stretches(
+    structure_file, order_cutoff, n_sequential, check_for_domain_len
+):
+    """
+    Returns the output line for a single structure file (see struc_disorder_main), and
+    the lines of the stretch table with every ordered and disordered stretch.
+    """
+    struc = pdb_to_residue_table(structure_file)
+    plddts = np.asarray(structure_to_pLDDT(struc, format="l"), dtype=np.float64)
+    file_basename = os.path.basename(structure_file)
 
-    talk_to_me("Counting order and disorder.")
-    ordered_stretches = find_order(
-        plddts, cutoff=args.order_cutoff, n_sequential=args.n_sequential
+    order_starts, order_ends = find_stretches(plddts >= order_cutoff, n_sequential)
+    disorder_starts, disorder_ends = find_stretches(
+        plddts <= order_cutoff, n_sequential
     )
-    ordered_residues = [item for sublist in ordered_stretches for item in sublist]
-    total_ordered = len(ordered_residues)
+    order_lengths = order_ends - order_starts
 
-    disordered_stretches = find_disorder(
-        plddts, cutoff=args.order_cutoff, n_sequential=args.n_sequential
-    )
-    disordered_residues = [item for sublist in disordered_stretches for item in sublist]
-    total_disordered = len(disordered_residues)
-    intermediate = len(plddts) - total_ordered - total_disordered
+    total_ordered = int(order_lengths.sum())
+    total_disordered = int((disorder_ends - disorder_starts).sum())
     total = len(plddts)
+    intermediate = total - total_ordered - total_disordered
 
     # Check if there is at least one ordered stretch that is at least
-    # args.check_for_domain_len in size
-    there_is_a_domain = "no"
-    for stretch in ordered_stretches:
-        if len(stretch) >= args.check_for_domain_len:
-            there_is_a_domain = "yes"
-            break
-
-    file_basename = os.path.basename(args.structure_file)
+    # check_for_domain_len in size
+    there_is_a_domain = "yes" if np.any(order_lengths >= check_for_domain_len) else "no"
 
     out = [
         file_basename,
@@ -101,6 +131,52 @@ def struc_disorder_main(args):
     out = [str(x) for x in out]
     out = "\t".join(out) + "\n"
 
+    stretch_lines = get_stretch_lines(
+        file_basename,
+        plddts,
+        np.concatenate([order_starts, disorder_starts]),
+        np.concatenate([order_ends, disorder_ends]),
+        ["ordered"] * len(order_starts) + ["disordered"] * len(disorder_starts),
+    )
+    return out, stretch_lines
+
+
+def struc_disorder(structure_file, order_cutoff, n_sequential, check_for_domain_len):
+    """
+    Returns the output line for a single structure file - see struc_disorder_main.
+    """
+    out, _ = struc_disorder_stretches(
+        structure_file, order_cutoff, n_sequential, check_for_domain_len
+    )
+    return out
+
+
+def struc_disorder_main(args):
+    structure_paths = get_structure_paths(args.structure_file)
+
+    talk_to_me("Counting order and disorder.")
+    results = process_map(
+        functools.partial(
+            struc_disorder_stretches,
+            order_cutoff=args.order_cutoff,
+            n_sequential=args.n_sequential,
+            check_for_domain_len=args.check_for_domain_len,
+        ),
+        structure_paths,
+        args.workers,
+    )
+
+    # Write each structure's line (and stretches) as soon as it is processed, so
+    # results for many structures aren't held in memory
     make_output_dir(args.out_file)
-    with open(args.out_file, "w") as outfile:
-        outfile.write(out)
+    with open(args.out_file, "w") as outfile, ExitStack() as stack:
+        stretch_outfile = None
+        if args.stretch_file != "":
+            make_output_dir(args.stretch_file)
+            stretch_outfile = stack.enter_context(open_file(args.stretch_file, "w"))
+            stretch_outfile.write("\t".join(STRETCH_FIELDS) + "\n")
+
+        for out, stretch_lines in results:
+            outfile.write(out)
+            if stretch_outfile is not None:
+                stretch_outfile.writelines(stretch_lines)
@@ -1,15 +1,60 @@
-from urllib.request import urlopen, urlretrieve, HTTPError
-import json
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import functools
 import os
+import tempfile
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter, Retry
 
 from .utils.misc import make_output_dir, talk_to_me
+from .utils.store import path_exists, split_store_path, write_bytes
+
+
+AF2_API_URL = "https://alphafold.ebi.ac.uk/api/prediction"
+REQUEST_TIMEOUT = 60
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+MANIFEST_NAME = "struc_download_manifest.tsv"
 
 
 def format_and_validate_args(args):
-    args.infile_columns = args.infile_columns.split(",")
+    if not isinstance(args.infile_columns, list):
+        args.infile_columns = args.infile_columns.split(",")
+    if args.workers < 1:
+        msg = f"workers must be at least 1. You entered {args.workers}."
+        raise ValueError(msg)
     return args
 
 
+# ------------------------------------------------------------------------------------ #
+# Classes
+# ------------------------------------------------------------------------------------ #
+class Rate_limiter:
+    """
+    Spaces out requests so that at most rate requests per second are started, across
+    all threads. A rate of 0 means there is no limit.
+    """
+
+    def __init__(self, rate=0):
+        self.interval = 1 / rate if rate > 0 else 0
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """
+        Blocks until the next request is allowed to start.
+        """
+        if self.interval == 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
 class AF2_downloader:
     """
     Class for downloading from alphafold2
@@ -55,23 +100,35 @@ class AF2_downloader:
     def __repr__(self):
         return self.uniprotID
 
-    def query_af2_api(self):
+    def query_af2_api(self, session=None, api_url=AF2_API_URL, rate_limiter=None):
         """
         Reads in json format from the AF2 api. This will include paths to the pdb and
-        PAE files.
+        PAE files. If the uniprotID isn't in the database, data is set to an empty
+        string.
         """
-        base = "https://alphafold.ebi.ac.uk/api/prediction"
-        try:
-            with urlopen(f"{base}/{self.uniprotID}") as url:
-                data = json.load(url)[0]
-                self.data = data
-        except HTTPError:
+        if session is None:
+            session = get_session()
+        if rate_limiter is not None:
+            rate_limiter.wait()
+
+        response = session.get(f"{api_url}/{self.uniprotID}", timeout=REQUEST_TIMEOUT)
+        if response.status_code == 404:
             msg = (
                 f"Can't find {self.uniprotID} in the AF2 database. Odds are that this "
                 "uniprotID is old."
             )
             print(msg)
             self.data = ""
+            return
+        response.raise_for_status()
+
+        # The api returns a list with one record per prediction
+        data = response.json()
+        if not isinstance(data, list) or data == [] or not isinstance(data[0], dict):
+            print(f"The AF2 database has no predictions for {self.uniprotID}.")
+            self.data = ""
+            return
+        self.data = data[0]
 
     def format_outfile_path(
         self, url, output_dir, additional_field_delimiter, infile_columns
@@ -95,57 +152,218 @@ class AF2_downloader:
         # get final output path
         return f"{output_dir}/{basename}.{file_extension}"
 
-    def download_pdb(self, output_dir, additional_field_delimiter, infile_columns):
+    def download_file(
+        self,
+        url_field,
+        output_dir,
+        additional_field_delimiter,
+        infile_columns,
+        session=None,
+        rate_limiter=None,
+    ):
+        """
+        Downloads the file at the url_field (e.g. pdbUrl) of the AF2 api data to the
+        output_dir. The file is first written to a temporary file in output_dir, and
+        only renamed to its final path once it is complete, so an interrupted download
+        never leaves a partial file behind. Files that are already present are not
+        downloaded again. If output_dir is an Archive_store, the file is added to the
+        store.
+
+        Returns True if the file is present, and False if it can't be found (including
+        if the api data has no url_field).
+        """
         if self.data == "":
-            return
-        url = self.data["pdbUrl"]
+            return False
+        url = self.data.get(url_field)
+        if not url:
+            print(f"The AF2 database has no {url_field} for {self.uniprotID}.")
+            return False
         destination = self.format_outfile_path(
             url, output_dir, additional_field_delimiter, infile_columns
         )
-        try:
-            urlretrieve(url, destination)
-        except HTTPError:
-            msg = f"Can't find {url}, which was provided for {self.uniprotID}"
-            print(msg)
-            return
+        if path_exists(destination):
+            return True
 
-    def download_pae(self, output_dir, additional_field_delimiter, infile_columns):
-        if self.data == "":
-            return
-        url = self.data["paeDocUrl"]
-        destination = self.format_outfile_path(
-            url, output_dir, additional_field_delimiter, infile_columns
+        if session is None:
+            session = get_session()
+        if rate_limiter is not None:
+            rate_limiter.wait()
+
+        with session.get(url, timeout=REQUEST_TIMEOUT, stream=True) as response:
+            if response.status_code == 404:
+                msg = f"Can't find {url}, which was provided for {self.uniprotID}"
+                print(msg)
+                return False
+            response.raise_for_status()
+
+            # Files in an Archive_store are only added once they are complete
+            if split_store_path(destination, "w") is not None:
+                write_bytes(destination, response.content)
+                return True
+
+            temp_file = tempfile.NamedTemporaryFile(
+                dir=output_dir, suffix=".tmp", delete=False
+            )
+            try:
+                with temp_file:
+                    for chunk in response.iter_content(chunk_size=1024 * 1024):
+                        temp_file.write(chunk)
+                os.replace(temp_file.name, destination)
+            except BaseException:
+                os.remove(temp_file.name)
+                raise
+        return True
+
+    def download_pdb(
+        self, output_dir, additional_field_delimiter, infile_columns, **kwargs
+    ):
+        return self.download_file(
+            "pdbUrl", output_dir, additional_field_delimiter, infile_columns, **kwargs
         )
-        try:
-            urlretrieve(url, destination)
-        except HTTPError:
-            msg = f"Can't find {url}, which was provided for {self.uniprotID}"
-            print(msg)
-            return
+
+    def download_pae(
+        self, output_dir, additional_field_delimiter, infile_columns, **kwargs
+    ):
+        return self.download_file(
+            "paeDocUrl",
+            output_dir,
+            additional_field_delimiter,
+            infile_columns,
+            **kwargs,
+        )
+
+
+# ------------------------------------------------------------------------------------ #
+# Functions
+# ------------------------------------------------------------------------------------ #
+def get_session(pool_size=10, retries=5, backoff_factor=0.5):
+    """
+    Returns a requests Session that keeps up to pool_size connections per host alive,
+    and retries failed requests (connection errors and the RETRY_STATUSES) up to
+    retries times with exponential backoff. The session can be shared by threads.
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=["GET"],
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def read_manifest(manifest_path):
+    """
+    Returns the set of infile lines that are recorded in the manifest, which are the
+    entries that were completed by a previous run.
+    """
+    completed = set()
+    if not os.path.exists(manifest_path):
+        return completed
+    with open(manifest_path) as infile:
+        for line in infile:
+            entry = line.rstrip("\n").rsplit("\t", 1)[0]
+            completed.add(entry)
+    return completed
+
+
+def download_entry(line, args, session, rate_limiter):
+    """
+    Queries the AF2 api for the entry in the (split) infile line and downloads its
+    pdb and PAE files. Returns the status of the entry:
+    - downloaded: both files are present in the output_dir.
+    - not_found: the entry or one of its files isn't in the AF2 database.
+    - failed: a request failed even after retrying. The entry can be retried later.
+    """
+    AF2 = AF2_downloader(line, args.infile_columns)
+    kwargs = dict(session=session, rate_limiter=rate_limiter)
+    try:
+        AF2.query_af2_api(api_url=args.api_url, **kwargs)
+        if AF2.data == "":
+            return "not_found"
+        found_pdb = AF2.download_pdb(
+            args.output_dir,
+            args.additional_field_delimiter,
+            args.infile_columns,
+            **kwargs,
+        )
+        found_pae = AF2.download_pae(
+            args.output_dir,
+            args.additional_field_delimiter,
+            args.infile_columns,
+            **kwargs,
+        )
+    except requests.RequestException as error:
+        print(f"Failed to download {AF2.uniprotID}: {error}")
+        return "failed"
+
+    if found_pdb and found_pae:
+        return "downloaded"
+    return "not_found"
 
 
 def struc_download_main(args):
     args = format_and_validate_args(args)
     make_output_dir(args.output_dir, is_dir=True)
+
+    # Entries recorded in the manifest were completed by a previous run
+    manifest_path = args.manifest
+    if manifest_path == "":
+        manifest_path = f"{args.output_dir}/{MANIFEST_NAME}"
+    completed = read_manifest(manifest_path)
+    if len(completed) > 0:
+        talk_to_me(f"Skipping {len(completed)} entries completed by a previous run.")
+
+    session = get_session(args.workers, args.retries)
+    rate_limiter = Rate_limiter(args.rate_limit)
+    process_entry = functools.partial(
+        download_entry, args=args, session=session, rate_limiter=rate_limiter
+    )
+
     talk_to_me("Starting script.")
+    counts = dict(downloaded=0, not_found=0, failed=0)
+    entry_of_future = dict()
+    with open(args.infile) as infile, open(manifest_path, "a") as manifest:
 
-    progress = 0
-    with open(args.infile) as infile:
-        for line in infile:
-            line = line.rstrip("\n").split("\t")
-            AF2 = AF2_downloader(line, args.infile_columns)
-            AF2.query_af2_api()
-            AF2.download_pdb(
-                args.output_dir, args.additional_field_delimiter, args.infile_columns
-            )
-            AF2.download_pae(
-                args.output_dir, args.additional_field_delimiter, args.infile_columns
-            )
-            progress += 1
-            if progress % 10 == 0:
-                print(progress)
+        def record(futures):
+            for future in futures:
+                entry = entry_of_future.pop(future)
+                status = future.result()
+                counts[status] += 1
+                if status != "failed":
+                    manifest.write(f"{entry}\t{status}\n")
+                    manifest.flush()
+
+                progress = sum(counts.values())
+                if progress % 1000 == 0:
+                    talk_to_me(f"Processed {progress} entries.")
+
+        # Only a few entries per worker are submitted ahead of those being completed,
+        # so the infile is never held in memory at once
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            for entry in infile:
+                entry = entry.rstrip("\n")
+                if entry == "" or entry in completed:
+                    continue
+                if len(entry_of_future) >= args.workers * 4:
+                    done, _ = wait(entry_of_future, return_when=FIRST_COMPLETED)
+                    record(done)
+                future = executor.submit(process_entry, entry.split("\t"))
+                entry_of_future[future] = entry
+            record(list(entry_of_future))
 
-    talk_to_me("Download complete.")
+    talk_to_me(
+        f"Download complete. Downloaded: {counts['downloaded']}, not found: "
+        f"{counts['not_found']}, failed: {counts['failed']}."
+    )
+    if counts["failed"] > 0:
+        talk_to_me("Rerun with the same output_dir to retry the failed entries.")
 
 
 if __name__ == "__main__":
@@ -1,155 +1,227 @@
+import os
 import re
-import itertools
+from functools import lru_cache, partial
+from itertools import chain, islice
 
-from .utils.structure import pdb_to_structure_object, struc_to_seq
-from .utils.misc import read_fasta_to_memory
+from Bio import SeqIO
+
+from .utils.structure import pdb_to_residue_table, struc_to_seq
+from .utils.misc import get_structure_paths, open_file, process_map
+
+
+# The amino acids that an x in a motif matches
+WILDCARD_AAS = "ARNDBCEQZGHILKMFPSTWYV"
+
+
+# ------------------------------------------------------------------------------------ #
+# Classes
+# ------------------------------------------------------------------------------------ #
+class Motif_scanner:
+    """
+    Finds the matches of many motifs in a sequence in one pass. All motifs are
+    combined into a single regular expression (a lookahead with one alternative per
+    motif), which finds every position where at least one motif matches. Only at those
+    positions is each motif checked. The matches of each motif are the same as those
+    of find_motif_matches.
+    """
+
+    def __init__(self, motifs, overlapping=False, AAs=WILDCARD_AAS):
+        self.motifs = list(motifs)
+        self.overlapping = overlapping
+        patterns = [get_motif_pattern(motif, AAs) for motif in self.motifs]
+        self.compiled_motifs = [re.compile(pattern) for pattern in patterns]
+        combined = "|".join(f"(?:{pattern})" for pattern in patterns)
+        self.combined = re.compile(f"(?={combined})")
+
+    def scan(self, seq):
+        """
+        Returns a list of (motif, match, start, end) of every motif in seq, ordered by
+        start and then by the order of the motifs. start and end are 1-indexed.
+        """
+        matches = []
+        last_ends = [dict() for _ in self.motifs]
+        for result in self.combined.finditer(seq):
+            start = result.start()
+            for i, compiled_motif in enumerate(self.compiled_motifs):
+                motif_result = compiled_motif.match(seq, start)
+                if motif_result is None:
+                    continue
+                match = motif_result[0]
+                end = start + len(match)
+                if not self.overlapping:
+                    if start < last_ends[i].get(match, 0):
+                        continue
+                    last_ends[i][match] = end
+                matches.append((self.motifs[i], match, start + 1, end))
+        return matches
 
 
 # ------------------------------------------------------------------------------------ #
 # Functions
 # ------------------------------------------------------------------------------------ #
-def generate_motif_options(motif, AAs="ARNDBCEQZGHILKMFPSTWYV"):
-    in_options = False
-    pos = 0
-    pos_options = dict()
-    for c in motif:
+def parse_motif(motif, AAs=WILDCARD_AAS):
+    """
+    Parses a motif into a list of (options, min_count, max_count) elements, where
+    options is a string with the amino acids allowed at a position, and the position
+    is repeated min_count to max_count times. In the motif:
+    - x (or X) is any of the AAs
+    - [...] is any of the amino acids within the brackets
+    - any other character is that amino acid
+    - (n) or (n,m) after a position repeats it n, or n to m, times. e.g. x(2,4) is a
+      gap of two to four amino acids.
+    """
+    elements = []
+    i = 0
+    while i < len(motif):
+        c = motif[i]
         if c == "[":
-            in_options = True
-            pos += 1
-            continue
-
-        if c == "]":
-            in_options = False
-            continue
-
-        if in_options:
-            c = c.upper()
-            if pos not in pos_options:
-                pos_options[pos] = set()
-            pos_options[pos].add(c)
-
-        if not in_options:
-            pos += 1
-            if pos not in pos_options:
-                pos_options[pos] = set()
-            if c.lower() != "x":
-                c = c.upper()
-                pos_options[pos].add(c)
-            else:
-                for AA in AAs:
-                    pos_options[pos].add(AA)
+            end = motif.find("]", i)
+            if end == -1:
+                msg = f"The motif {motif} has a [ without a matching ]."
+                raise ValueError(msg)
+            options = motif[i + 1 : end].upper()
+            if options == "":
+                msg = f"The motif {motif} has empty brackets."
+                raise ValueError(msg)
+            i = end + 1
+        elif c == "]":
+            msg = f"The motif {motif} has a ] without a matching [."
+            raise ValueError(msg)
+        elif c.lower() == "x":
+            options = AAs
+            i += 1
+        else:
+            options = c.upper()
+            i += 1
 
-    return pos_options
+        # Repeats of the position
+        min_count = max_count = 1
+        if i < len(motif) and motif[i] == "(":
+            end = motif.find(")", i)
+            counts = motif[i + 1 : end].split(",") if end != -1 else []
+            if not 1 <= len(counts) <= 2 or not all(n.isdigit() for n in counts):
+                msg = f"The motif {motif} has a malformed repeat - use (n) or (n,m)."
+                raise ValueError(msg)
+            min_count = int(counts[0])
+            max_count = int(counts[-1])
+            if min_count > max_count:
+                msg = f"The motif {motif} has a repeat with n > m."
+                raise ValueError(msg)
+            i = end + 1
 
+        elements.append(("".join(sorted(set(options))), min_count, max_count))
 
-def generate_all_possible_motifs(pos_options):
-    if len(pos_options) > 10:
-        msg = "Max of 10 spaces in a motif! Sorry"
+    if sum(min_count for _, min_count, _ in elements) == 0:
+        msg = f"The motif {motif} must match at least one amino acid."
         raise ValueError(msg)
 
-    if len(pos_options) == 1:
-        options = set(itertools.product(pos_options[1]))
-    elif len(pos_options) == 2:
-        options = set(itertools.product(pos_options[1], pos_options[2]))
-    elif len(pos_options) == 3:
-        options = set(itertools.product(pos_options[1], pos_options[2], pos_options[3]))
-    elif len(pos_options) == 4:
-        options = set(
-            itertools.product(
-                pos_options[1], pos_options[2], pos_options[3], pos_options[4]
-            )
-        )
-    elif len(pos_options) == 5:
-        options = set(
-            itertools.product(
-                pos_options[1],
-                pos_options[2],
-                pos_options[3],
-                pos_options[4],
-                pos_options[5],
-            )
-        )
-    elif len(pos_options) == 6:
-        options = set(
-            itertools.product(
-                pos_options[1],
-                pos_options[2],
-                pos_options[3],
-                pos_options[4],
-                pos_options[5],
-                pos_options[6],
-            )
-        )
-    elif len(pos_options) == 7:
-        options = set(
-            itertools.product(
-                pos_options[1],
-                pos_options[2],
-                pos_options[3],
-                pos_options[4],
-                pos_options[5],
-                pos_options[6],
-                pos_options[7],
-            )
-        )
-    elif len(pos_options) == 8:
-        options = set(
-            itertools.product(
-                pos_options[1],
-                pos_options[2],
-                pos_options[3],
-                pos_options[4],
-                pos_options[5],
-                pos_options[6],
-                pos_options[7],
-                pos_options[8],
-            )
-        )
-    elif len(pos_options) == 9:
-        options = set(
-            itertools.product(
-                pos_options[1],
-                pos_options[2],
-                pos_options[3],
-                pos_options[4],
-                pos_options[5],
-                pos_options[6],
-                pos_options[7],
-                pos_options[8],
-                pos_options[9],
-            )
-        )
-    elif len(pos_options) == 10:
-        options = set(
-            itertools.product(
-                pos_options[1],
-                pos_options[2],
-                pos_options[3],
-                pos_options[4],
-                pos_options[5],
-                pos_options[6],
-                pos_options[7],
-                pos_options[8],
-                pos_options[9],
-                pos_options[10],
-            )
-        )
-
-    options = set("".join(i) for i in options)
-    return options
-
-
-def get_match(option, seq):
-    out = ""
-    if re.search(option, seq) is not None:
-        for result in re.finditer(option, seq):
-            out_result = [result[0], result.start() + 1, result.end()]
-            out_result = [str(i) for i in out_result]
-            out_result = "\t".join(out_result) + "\n"
-            out += out_result
-        return out
-    else:
-        return ""
+    return elements
+
+
+def get_motif_pattern(motif, AAs=WILDCARD_AAS):
+    """
+    Returns a regular expression for the motif (see parse_motif), with a character
+    class for each position.
+    """
+    pattern = ""
+    for options, min_count, max_count in parse_motif(motif, AAs):
+        if len(options) == 1:
+            pattern += re.escape(options)
+        else:
+            pattern += "[" + "".join(re.escape(c) for c in options) + "]"
+        if min_count != 1 or max_count != 1:
+            if min_count == max_count:
+                pattern += f"{{{min_count}}}"
+            else:
+                pattern += f"{{{min_count},{max_count}}}"
+    return pattern
+
+
+def compile_motif(motif, AAs=WILDCARD_AAS):
+    """
+    Compiles the motif (see parse_motif) into a single regular expression with a
+    character class for each position. The expression is wrapped in a lookahead, so
+    re.finditer finds a match at every position the motif matches, including matches
+    that overlap. The matched sequence is group 1.
+    """
+    return re.compile(f"(?=({get_motif_pattern(motif, AAs)}))")
+
+
+def find_motif_matches(compiled_motif, seq, overlapping=False):
+    """
+    Returns a list of (match, start, end) of the compiled motif (from compile_motif)
+    in seq, ordered by start. start and end are 1-indexed.
+
+    Unless overlapping is True, a match is skipped if it overlaps an earlier match of
+    the same sequence, which is how re.finditer treats the sequence on its own. e.g.
+    'xx' has one match of 'AA' in 'AAA', but an overlapping match also finds the second
+    one. Matches of different sequences are always kept, even if they overlap.
+    """
+    matches = []
+    last_ends = dict()
+    for result in compiled_motif.finditer(seq):
+        match = result[1]
+        start = result.start()
+        end = start + len(match)
+        if not overlapping:
+            if start < last_ends.get(match, 0):
+                continue
+            last_ends[match] = end
+        matches.append((match, start + 1, end))
+    return matches
+
+
+@lru_cache(maxsize=None)
+def get_motif_scanner(motifs, overlapping=False):
+    """
+    Returns the Motif_scanner of a tuple of motifs, so that each worker process only
+    compiles the motifs once.
+    """
+    return Motif_scanner(motifs, overlapping)
+
+
+def scan_sequence(record, motifs, overlapping=False):
+    """
+    record is a (seq_id, seq) tuple. Returns a list of
+    (seq_id, motif, match, start, end) of every motif match in seq.
+    """
+    seq_id, seq = record
+    scanner = get_motif_scanner(tuple(motifs), overlapping)
+    return [(seq_id,) + match for match in scanner.scan(seq.upper())]
+
+
+def scan_structure(structure_path, motifs, overlapping=False):
+    """
+    Like scan_sequence, but scans the sequence of a structure file. The seq_id is the
+    basename of the file.
+    """
+    seq = struc_to_seq(pdb_to_residue_table(structure_path))
+    return scan_sequence((os.path.basename(structure_path), seq), motifs, overlapping)
+
+
+def read_motif_file(motif_file):
+    """
+    Returns the motifs in motif_file, which has one motif per line. Empty lines and
+    lines starting with # are skipped.
+    """
+    motifs = []
+    with open_file(motif_file) as infile:
+        for line in infile:
+            line = line.strip()
+            if line == "" or line.startswith("#"):
+                continue
+            motifs.append(line)
+    return motifs
+
+
+def stream_fasta(fasta):
+    """
+    Yields a (seq_id, seq) tuple for each sequence in the fasta file, which can be
+    gzipped.
+    """
+    with open_file(fasta) as infile:
+        for seq_record in SeqIO.parse(infile, "fasta"):
+            yield seq_record.id, str(seq_record.seq)
 
 
 # ------------------------------------------------------------------------------------ #
@@ -161,35 +233,58 @@ def struc_find_motif_main(args):
         msg += " Call the -h flag for help and instructions."
         raise ValueError(msg)
 
-    # Parse seq
-    if args.fasta != "":
-        fasta = read_fasta_to_memory(args.fasta)
-        seq = ""
-        for _, fasta_seq in fasta.items():
-            if seq != "":
-                msg = "There is more than one sequence in the fasta file - stop that."
-                raise ValueError(msg)
-            else:
-                seq = fasta_seq
-
-    if args.structure != "":
-        structure = pdb_to_structure_object(args.structure)
-        seq = struc_to_seq(structure)
+    motifs = []
+    if args.motif != "":
+        motifs.append(args.motif)
+    if args.motif_file != "":
+        motifs += read_motif_file(args.motif_file)
+    if motifs == []:
+        msg = "You must enter a motif and/or a motif file."
+        raise ValueError(msg)
 
+    # The sequences, as (seq_id, seq) records or structure paths
+    structure_paths = None
     if args.seq != "":
-        seq = args.seq
+        records = [("seq", args.seq)]
+    elif args.structure != "":
+        structure_paths = get_structure_paths(args.structure)
+        records = None
+    else:
+        # Read up to two sequences, to know if there is more than one
+        fasta_records = stream_fasta(args.fasta)
+        records = list(islice(fasta_records, 2))
+        if len(records) > 1:
+            records = chain(records, fasta_records)
 
-    seq = seq.upper()
+    # A single motif in a single sequence is written in the original format
+    if args.motif_file == "" and structure_paths and len(structure_paths) == 1:
+        records = [("seq", struc_to_seq(pdb_to_residue_table(structure_paths[0])))]
+        structure_paths = None
+    if args.motif_file == "" and isinstance(records, list) and len(records) == 1:
+        seq = records[0][1].upper()
+        compiled_motif = compile_motif(args.motif)
 
-    pos_options = generate_motif_options(args.motif)
-    options = generate_all_possible_motifs(pos_options)
+        out = ["match", "start", "end"]
+        out = "\t".join(out) + "\n"
+        for match in find_motif_matches(compiled_motif, seq, args.overlapping):
+            out += "\t".join(str(i) for i in match) + "\n"
+        with open_file(args.output_file, "w") as outfile:
+            print(out, file=outfile)
+        return
+
+    # Otherwise, all motifs are scanned in every sequence and written to one table
+    if structure_paths is not None:
+        function = partial(scan_structure, motifs=motifs, overlapping=args.overlapping)
+        items = structure_paths
+    else:
+        function = partial(scan_sequence, motifs=motifs, overlapping=args.overlapping)
+        items = records
 
-    out = ["match", "start", "end"]
-    out = "\t".join(out) + "\n"
-    for option in options:
-        if option in seq:
-            out += get_match(option, seq)
-    print(out)
+    with open_file(args.output_file, "w") as outfile:
+        outfile.write("\t".join(["seq_id", "motif", "match", "start", "end"]) + "\n")
+        for matches in process_map(function, items, args.workers):
+            for match in matches:
+                outfile.write("\t".join(str(i) for i in match) + "\n")
 
 
 if __name__ == "__main__":
@@ -6,26 +6,53 @@ import json
 import numpy as np
 import networkx as nx
 from networkx.algorithms import community
-from itertools import groupby
-import matplotlib.pyplot as plt
+from scipy import sparse
 import os
 
-from .utils.misc import make_output_dir, talk_to_me
-from .utils.structure import pdb_to_structure_object, write_structure_subset
+from .utils.domains import (
+    cluster_to_indices,
+    get_block_pae,
+    get_domain_stats,
+    sequential_mean,
+    write_domain_report,
+)
+from .utils.misc import (
+    make_output_dir,
+    open_file,
+    strip_structure_suffix,
+    talk_to_me,
+)
+from .utils.store import split_store_path
+from .utils.structure import (
+    pdb_to_structure_object,
+    write_structure_subsets,
+    write_structure_subsets_as_models,
+)
 
 # ------------------------------------------------------------------------------------ #
 # Functions
 # ------------------------------------------------------------------------------------ #
 
 
-def parse_json_file(pae_json_file):
+PAE_CACHE_VERSION = 1
+PAE_CACHE_DTYPES = ("float64", "float32", "float16")
+
+
+def parse_json_file(pae_json_file, cache=False, cache_dtype="float64"):
     """
     This function was adapted from
     https://github.com/tristanic/pae_to_domains/blob/main/pae_to_domains.py
     which is under the MIT license.
+
+    If cache is True, the PAE matrix and pLDDT array are read from (or, if missing or
+    out of date, written to) a binary sidecar file - see parse_json_file_cached. Files
+    in an Archive_store are never cached.
     """
+    if cache and split_store_path(pae_json_file) is None:
+        return parse_json_file_cached(pae_json_file, cache_dtype)
+
     # Returns json information as a dictionary
-    with open(pae_json_file, "rt") as f:
+    with open_file(pae_json_file) as f:
         data = json.load(f)
 
     # Colabfold format only
@@ -39,6 +66,66 @@ def parse_json_file(pae_json_file):
     return pae_matrix, plddt_array
 
 
+def get_pae_cache_path(pae_json_file):
+    """
+    Returns the path of the binary PAE cache of a json file, which sits next to it.
+    """
+    return pae_json_file + ".pae_cache.npz"
+
+
+def get_pae_cache_signature(pae_json_file):
+    """
+    Returns the size and modification time of the json file, along with the cache
+    version. A cache is only used if its signature matches.
+    """
+    stat = os.stat(pae_json_file)
+    return np.array([stat.st_size, stat.st_mtime_ns, PAE_CACHE_VERSION], dtype=np.int64)
+
+
+def parse_json_file_cached(pae_json_file, cache_dtype="float64"):
+    """
+    Like parse_json_file, but the PAE matrix and pLDDT array are stored in an
+    uncompressed .npz file next to the json file (see get_pae_cache_path). Later calls
+    load the arrays from there without parsing the json file, as long as the json
+    file hasn't changed and the cache was made with the same cache_dtype.
+
+    cache_dtype is one of PAE_CACHE_DTYPES. The PAE matrix is returned with this dtype
+    whether it was read from the cache or not, so results don't depend on whether the
+    cache existed. float32 and float16 halve or quarter the memory taken by the matrix.
+    Likewise, the pLDDTs are always returned as a list of floats.
+    """
+    if cache_dtype not in PAE_CACHE_DTYPES:
+        msg = f"cache_dtype must be one of {PAE_CACHE_DTYPES}, not {cache_dtype}."
+        raise ValueError(msg)
+
+    cache_path = get_pae_cache_path(pae_json_file)
+    signature = get_pae_cache_signature(pae_json_file)
+
+    if os.path.isfile(cache_path):
+        with np.load(cache_path) as data:
+            if (
+                np.array_equal(data["signature"], signature)
+                and data["pae"].dtype == cache_dtype
+            ):
+                return data["pae"], data["plddt"].tolist()
+
+    pae_matrix, plddt_array = parse_json_file(pae_json_file)
+    pae_matrix = pae_matrix.astype(cache_dtype)
+    plddt_array = np.array(plddt_array, dtype=np.float64)
+
+    # Write to a temporary file first, so a cache that is being written is never read
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp.npz"
+    np.savez(
+        tmp_path,
+        pae=pae_matrix,
+        plddt=plddt_array,
+        signature=signature,
+    )
+    os.replace(tmp_path, cache_path)
+
+    return pae_matrix, plddt_array.tolist()
+
+
 def domains_from_pae_matrix_networkx(
     pae_matrix, pae_power=1, pae_cutoff=5, graph_resolution=1
 ):
@@ -80,6 +167,179 @@ def domains_from_pae_matrix_networkx(
     return clusters
 
 
+def pae_matrix_to_sparse_graph(pae_matrix, pae_power=1, pae_cutoff=5):
+    """
+    Builds the same weighted graph as domains_from_pae_matrix_networkx, but as a
+    symmetric scipy.sparse CSR matrix rather than a networkx graph. There is an edge
+    between residues i and j if pae_matrix[i, j] < pae_cutoff or
+    pae_matrix[j, i] < pae_cutoff, weighted by 1/pae**pae_power. As with networkx,
+    which keeps the weight of the last edge added, the weight of pae_matrix[j, i] is
+    used (for j > i) if both are below the cutoff.
+
+    Self-loops (the diagonal) are stored with twice their weight, so that the sum of
+    row i is the degree of residue i as networkx defines it.
+    """
+    size = pae_matrix.shape[0]
+    rows, cols = np.nonzero(pae_matrix < pae_cutoff)
+    weights = 1 / pae_matrix[rows, cols] ** pae_power
+
+    # Put every edge in the upper triangle. Edges from the lower triangle take
+    # precedence, so are added after removing upper triangle edges they overlap with.
+    upper = rows < cols
+    lower = rows > cols
+    upper_edges = sparse.csr_matrix(
+        (weights[upper], (rows[upper], cols[upper])), shape=(size, size)
+    )
+    lower_edges = sparse.csr_matrix(
+        (weights[lower], (cols[lower], rows[lower])), shape=(size, size)
+    )
+    lower_pattern = lower_edges.copy()
+    lower_pattern.data = np.ones_like(lower_pattern.data)
+    edges = upper_edges - upper_edges.multiply(lower_pattern) + lower_edges
+
+    diagonal = rows == cols
+    self_loops = sparse.csr_matrix(
+        (2 * weights[diagonal], (rows[diagonal], cols[diagonal])), shape=(size, size)
+    )
+    graph = edges + edges.T + self_loops
+    graph.eliminate_zeros()
+    return graph.tocsr()
+
+
+def louvain_local_moving(graph, resolution=1):
+    """
+    One level of the Louvain algorithm. graph is a symmetric CSR matrix, where the
+    sum of row i is the degree of node i. Each node, in order, is moved to the
+    neighboring community that most increases modularity, until no node moves.
+
+    Returns an array with the community of each node (numbered from 0, in order of
+    the community's lowest node), and whether any node was moved.
+    """
+    size = graph.shape[0]
+    degrees = np.asarray(graph.sum(axis=1)).ravel()
+    two_m = degrees.sum()
+    communities = np.arange(size)
+    if two_m == 0:
+        return communities, False
+
+    # Total degree of each community
+    community_degrees = degrees.copy()
+    indptr, indices, data = graph.indptr, graph.indices, graph.data
+
+    improved = False
+    while True:
+        moves = 0
+        for node in range(size):
+            neighbors = indices[indptr[node] : indptr[node + 1]]
+            weights = data[indptr[node] : indptr[node + 1]]
+            not_self = neighbors != node
+            neighbors = neighbors[not_self]
+            weights = weights[not_self]
+
+            # Take the node out of its community
+            current = communities[node]
+            community_degrees[current] -= degrees[node]
+            if len(neighbors) == 0:
+                community_degrees[current] += degrees[node]
+                continue
+
+            # Weight of the edges from the node to each neighboring community
+            candidates, inverse = np.unique(communities[neighbors], return_inverse=True)
+            links = np.bincount(inverse, weights=weights)
+
+            # The modularity gain of joining each community, up to a constant factor
+            scale = resolution * degrees[node] / two_m
+            gains = links - scale * community_degrees[candidates]
+            current_i = np.searchsorted(candidates, current)
+            if current_i < len(candidates) and candidates[current_i] == current:
+                current_gain = gains[current_i]
+            else:
+                current_gain = -scale * community_degrees[current]
+
+            best = np.argmax(gains)
+            if gains[best] > current_gain + 1e-12 * two_m:
+                communities[node] = candidates[best]
+                moves += 1
+            community_degrees[communities[node]] += degrees[node]
+
+        if moves == 0:
+            break
+        improved = True
+
+    _, communities = np.unique(communities, return_inverse=True)
+    return communities, improved
+
+
+def louvain_communities(graph, resolution=1):
+    """
+    Partitions the nodes of graph (see louvain_local_moving) into communities with the
+    Louvain algorithm. Nodes are moved between communities until modularity can't be
+    improved, then each community is collapsed into a single node, and this is
+    repeated until nothing changes. This is deterministic - nodes are always visited in
+    order.
+
+    Returns a list of frozensets of node indices, from largest to smallest.
+    """
+    node_communities = np.arange(graph.shape[0])
+    while True:
+        communities, improved = louvain_local_moving(graph, resolution)
+        if not improved:
+            break
+        node_communities = communities[node_communities]
+
+        # Collapse each community into a single node
+        n_communities = communities.max() + 1
+        membership = sparse.csr_matrix(
+            (np.ones(len(communities)), (np.arange(len(communities)), communities)),
+            shape=(len(communities), n_communities),
+        )
+        graph = (membership.T @ graph @ membership).tocsr()
+
+    clusters = dict()
+    for node, cluster in enumerate(node_communities.tolist()):
+        if cluster not in clusters:
+            clusters[cluster] = []
+        clusters[cluster].append(node)
+    clusters = [frozenset(nodes) for nodes in clusters.values()]
+    return sorted(clusters, key=len, reverse=True)
+
+
+def domains_from_pae_matrix_sparse(
+    pae_matrix, pae_power=1, pae_cutoff=5, graph_resolution=1
+):
+    """
+    A faster alternative to domains_from_pae_matrix_networkx, with the same arguments
+    and output format. The PAE graph is built directly as a scipy.sparse matrix, and
+    is clustered with the Louvain algorithm rather than networkx's greedy modularity
+    communities. Both maximize modularity, but may give somewhat different clusters.
+    """
+    graph = pae_matrix_to_sparse_graph(pae_matrix, pae_power, pae_cutoff)
+    return louvain_communities(graph, graph_resolution)
+
+
+def domains_from_pae_matrix(
+    pae_matrix, pae_power=1, pae_cutoff=5, graph_resolution=1, backend="networkx"
+):
+    """
+    Clusters the PAE matrix into domains with the specified backend - either
+    'networkx' (domains_from_pae_matrix_networkx) or 'sparse'
+    (domains_from_pae_matrix_sparse).
+    """
+    if backend == "networkx":
+        function = domains_from_pae_matrix_networkx
+    elif backend == "sparse":
+        function = domains_from_pae_matrix_sparse
+    else:
+        msg = f"backend must be networkx or sparse. You entered {backend}."
+        raise ValueError(msg)
+    return function(
+        pae_matrix,
+        pae_power=pae_power,
+        pae_cutoff=pae_cutoff,
+        graph_resolution=graph_resolution,
+    )
+
+
 def smooth_array(in_arr, threshold=5, n=20, block_replace=1):
     """
     This function takes in a 1 dimensional array of values, where lower values are
@@ -95,47 +355,55 @@ def smooth_array(in_arr, threshold=5, n=20, block_replace=1):
     - all pae regions below threshold (including the converted, formerly-above-threshold
       regions) are converted to block_replace.
     """
-    status = in_arr < threshold
-
-    # (bool, count). Note that grouped_status is essentially 1-indexed.
-    grouped_status = [(k, sum(1 for i in g)) for k, g in groupby(status)]
-
-    pos_to_smooth = set()  # set with indices of positions to smooth
-    i = 0
-    for (status, length) in grouped_status:
-
-        i += length
-
-        # If the stretch is at the start, won't correct a False but will correct a
-        # true.
-        if i - length == 0 and not status:
-            continue
-
-        # If the stretch is at the end, won't correct a False but will correct a
-        # true.
-        if i == len(in_arr) and not status:
-            continue
+    return smooth_pae_matrix(
+        in_arr, threshold=threshold, n=n, block_replace=block_replace, axis=0
+    )
 
-        # If true or if false but under length, will smooth it
-        if status:
-            pos_to_smooth.update(range(i - length, i))
-        elif length < n and not status:
-            pos_to_smooth.update(range(i - length, i))
 
-    out_arr = []
-    for i, val in enumerate(in_arr):
-        if i in pos_to_smooth:
-            out_arr.append(block_replace)
-        else:
-            out_arr.append(val)
-    out_arr = np.array(out_arr)
-    return out_arr
+def smooth_pae_matrix(pae_matrix, threshold=5, n=20, block_replace=1, axis=1):
+    """
+    Applies smooth_array to every 1D slice of pae_matrix along axis, all at once.
+    axis=0 smooths each column and axis=1 smooths each row, giving the same values as
+    np.apply_along_axis(smooth_array, axis, pae_matrix). Unlike apply_along_axis, a
+    float matrix stays float even if its first slice is entirely smoothed.
+
+    Rather than walking each slice, the 'bad' runs (values >= threshold) are found
+    with np.diff on the padded boolean mask. Bad runs that touch neither end of their
+    slice and are shorter than n are smoothed, as are all good values.
+    """
+    pae_matrix = np.asarray(pae_matrix)
+    arr = np.moveaxis(pae_matrix, axis, -1)
+    length = arr.shape[-1]
+    bad = ~(arr < threshold)
+
+    # Bad runs start where the padded mask goes 0->1, and end where it goes 1->0.
+    # Within each slice the runs are in order, so the nth start pairs with the nth end.
+    padding = [(0, 0)] * (bad.ndim - 1) + [(1, 1)]
+    edges = np.diff(np.pad(bad, padding).astype(np.int8), axis=-1)
+    starts = np.nonzero(edges == 1)
+    ends = np.nonzero(edges == -1)
+    run_starts = starts[-1]
+    run_ends = ends[-1]
+    to_smooth = (run_starts > 0) & (run_ends < length) & (run_ends - run_starts < n)
+
+    # Mark the smoothed bad runs with +1 at their start and -1 after their end, such
+    # that the cumulative sum is 1 within the runs.
+    delta = np.zeros(arr.shape[:-1] + (length + 1,), dtype=np.int8)
+    delta[starts[:-1] + (run_starts,)] = to_smooth
+    delta[ends[:-1] + (run_ends,)] = -to_smooth.astype(np.int8)
+    smooth_bad = np.cumsum(delta, axis=-1, dtype=np.int8)[..., :length] > 0
+
+    out_arr = np.where(~bad | smooth_bad, block_replace, arr)
+    return np.moveaxis(out_arr, -1, axis)
 
 
 def visualize_PAE(pae_matrix):
     """
     Given a PAE matrix, returns a matplotlib heatmap of the residues.
     """
+    # Imported here because matplotlib is slow to import
+    import matplotlib.pyplot as plt
+
     im = plt.imshow(np.asarray(pae_matrix))
 
     # Create colorbar
@@ -159,37 +427,19 @@ def filter_clusters(clusters, plddt_array, min_length, min_avg_plddt):
 
     plddt_array is a numpy array wich the plddt at each residue.
     """
+    plddt_array = np.asarray(plddt_array)
 
     filtered_clusters = []
     for cluster in clusters:
 
         # Length filter
-        cluster_length = len(cluster)
-        if cluster_length < min_length:
+        if len(cluster) < min_length:
             continue
 
         # pLDDT filter
-        plddt_sum = 0
-        num_residues = 0
-        for pos in cluster:
-
-            # Because the positions in clusters are 1-indexed but I am subsetting a
-            # vector, need to -1 to convert it to 0-indexed.
-            plddt = plddt_array[pos - 1]
-            plddt_sum += plddt
-            num_residues += 1
-
-        pLDDT_avg = plddt_sum / num_residues
-        if pLDDT_avg < min_avg_plddt:
+        if get_avg_plddt(cluster, plddt_array) < min_avg_plddt:
             continue
 
-        # Sanity check
-        if num_residues != cluster_length:
-            msg = "Something went wrong - number of residues parsed for plddt"
-            msg += " is not the same length as the cluster. Cluser in question is"
-            msg += f"{cluster}"
-            raise ValueError(msg)
-
         filtered_clusters.append(cluster)
 
     return filtered_clusters
@@ -207,34 +457,21 @@ def plddt_trim_clusters(clusters, plddt_array, min_avg_plddt):
     Remember, the positions in clusters are 1-indexed! So need to -1 to get 0 index
     when looking up in the plddt_array.
     """
+    plddt_array = np.asarray(plddt_array)
+
     out_clusters = []
     for cluster in clusters:
-        cluster = list(cluster)
-        to_trim = []
-
-        # Working from the start, add positions to the to_trim until there is a residue
-        # that has sufficiently high plddt.
-        for pos in cluster:
-            i = pos - 1
-            plddt = plddt_array[i]
-            if plddt < min_avg_plddt:
-                to_trim.append(pos)
-            else:
-                break
-
-        # Working from the end, add positions to the to_trim until there is a residue
-        # that has sufficiently high plddt.
-        for pos in cluster[::-1]:
-            i = pos - 1
-            plddt = plddt_array[i]
-            if plddt < min_avg_plddt:
-                to_trim.append(pos)
-            else:
-                break
-
-        cluster = set(cluster) - set(to_trim)
-        cluster = frozenset(cluster)
-        out_clusters.append(cluster)
+        positions = cluster_to_indices(cluster, offset=0)
+        is_low = plddt_array[positions - 1] < min_avg_plddt
+
+        # Trim the low-plddt residues from the start and from the end, up to the first
+        # residue that has sufficiently high plddt.
+        high = np.flatnonzero(~is_low)
+        if len(high) == 0:
+            out_clusters.append(frozenset())
+            continue
+        keep = positions[high[0] : high[-1] + 1]
+        out_clusters.append(frozenset(keep.tolist()))
 
     return out_clusters
 
@@ -245,53 +482,46 @@ def get_avg_plddt(cluster, plddt_array):
     cluster is a frozenset of 1-indexed positions of the cluster. plddt_array is a numpy
     index of the plddts at all positions in the input structure.
     """
-
-    running_sum = 0
-    for i in cluster:
-
-        # i in 1-indexed, so need to adjust to 0 indexing
-        plddt = plddt_array[i - 1]
-        running_sum += plddt
-
-    return running_sum / len(cluster)
+    plddt_array = np.asarray(plddt_array)
+    return sequential_mean(plddt_array[cluster_to_indices(cluster)])
 
 
 def get_avg_pae(cluster, pae_matrix):
     """
     Returns the average pae between every pair of residues in the cluster.
-    cluster is a frozenset of 1-indexed positions of the cluster. pae_matrix is a 2d
+    cluster is a frozenset of positions of the cluster. pae_matrix is a 2d
     numpy array with the PAE for every pair of residues in the input structure.
-    """
-    running_sum = 0
-    n = 0
-    for r1 in cluster:
-        for r2 in cluster:
-            pae = pae_matrix[r1, r2]
-            running_sum += pae
-            n += 1
 
-    return running_sum / n
+    Note that the positions are used to index pae_matrix as they are. They are the
+    0-indexed positions from domains_from_pae_matrix, rather than the 1-indexed
+    positions of the residues written to the domain files.
+    """
+    indices = cluster_to_indices(cluster, offset=0)
+    return sequential_mean(get_block_pae(pae_matrix, indices, indices))
 
 
 def struc_get_domains_main(args):
 
     talk_to_me("Reading PAE json file.")
-    pae_matrix, plddt_array = parse_json_file(args.pae_path)
+    pae_matrix, plddt_array = parse_json_file(
+        args.pae_path, cache=args.pae_cache, cache_dtype=args.pae_cache_dtype
+    )
 
     talk_to_me("Parsing structure.")
     structure = pdb_to_structure_object(args.structure_file_path)
 
     if args.smooth_n != 0:
         talk_to_me("Smoothing out PAE matrix.")
-        pae_matrix = np.apply_along_axis(smooth_array, 0, pae_matrix, n=args.smooth_n)
-        pae_matrix = np.apply_along_axis(smooth_array, 1, pae_matrix, n=args.smooth_n)
+        pae_matrix = smooth_pae_matrix(pae_matrix, n=args.smooth_n, axis=0)
+        pae_matrix = smooth_pae_matrix(pae_matrix, n=args.smooth_n, axis=1)
 
     talk_to_me("Finding clusters from PAE matrix.")
-    clusters = domains_from_pae_matrix_networkx(
+    clusters = domains_from_pae_matrix(
         pae_matrix,
         pae_power=args.pae_power,
         pae_cutoff=args.pae_cutoff,
         graph_resolution=args.graph_resolution,
+        backend=args.clustering_backend,
     )
 
     talk_to_me("Trimming cluster coordinates to remove low-pLDDT-ends.")
@@ -335,25 +565,41 @@ def struc_get_domains_main(args):
         make_output_dir(args.plddt_report, is_dir=False)
     if args.pae_report != "":
         make_output_dir(args.pae_report, is_dir=False)
+    if args.domain_report != "":
+        make_output_dir(args.domain_report, is_dir=False)
 
-    basename = os.path.basename(args.structure_file_path).rstrip(".pdb")
-    i = 0
-    for cluster in clusters:
-        i += 1
-        outfile_name = f"{basename}_domain-{i}.pdb"
-        write_structure_subset(structure, cluster, f"{args.output_dir}/{outfile_name}")
-
-        if args.plddt_report != "":
-            avg_plddt = get_avg_plddt(cluster, plddt_array)
-            with open(args.plddt_report, "a") as outfile:
-                out = f"{outfile_name}\t{avg_plddt}\n"
-                outfile.write(out)
-
-        if args.pae_report != "":
-            avg_pae = get_avg_pae(cluster, pae_matrix)
-            with open(args.pae_report, "a") as outfile:
-                out = f"{outfile_name}\t{avg_pae}\n"
-                outfile.write(out)
+    basename = strip_structure_suffix(args.structure_file_path)
+    outfile_names = [f"{basename}_domain-{i}.pdb" for i in range(1, len(clusters) + 1)]
+
+    # All domains are written in a single pass through the structure
+    if args.single_file:
+        write_structure_subsets_as_models(
+            structure, clusters, f"{args.output_dir}/{basename}_domains.pdb"
+        )
+    else:
+        write_structure_subsets(
+            structure,
+            clusters,
+            [f"{args.output_dir}/{outfile_name}" for outfile_name in outfile_names],
+        )
+
+    if args.plddt_report != "":
+        with open(args.plddt_report, "a") as outfile:
+            for outfile_name, cluster in zip(outfile_names, clusters):
+                avg_plddt = get_avg_plddt(cluster, plddt_array)
+                outfile.write(f"{outfile_name}\t{avg_plddt}\n")
+
+    if args.pae_report != "":
+        with open(args.pae_report, "a") as outfile:
+            for outfile_name, cluster in zip(outfile_names, clusters):
+                avg_pae = get_avg_pae(cluster, pae_matrix)
+                outfile.write(f"{outfile_name}\t{avg_pae}\n")
+
+    if args.domain_report != "":
+        talk_to_me("Writing domain report.")
+        domains = [cluster_to_indices(cluster) for cluster in clusters]
+        stats = get_domain_stats(domains, pae_matrix, plddt_array)
+        write_domain_report(args.domain_report, outfile_names, stats)
 
 
 if __name__ == "__main__":
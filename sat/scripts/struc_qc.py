@@ -1,25 +1,47 @@
+import functools
 import os
 
-from .utils.structure import pdb_to_structure_object, structure_to_pLDDT
+from .utils.structure import pdb_to_residue_table, structure_to_pLDDT
+from .utils.misc import get_structure_paths, make_output_dir, open_file, process_map
 
 
-def struc_qc_main(args):
-    structure = pdb_to_structure_object(args.structure_file_path)
+def struc_qc(structure_file_path, plddt_cutoff):
+    """
+    Returns the output line for a single structure - its basename, number of residues,
+    number of residues with a pLDDT >= plddt_cutoff, and the proportion of residues
+    that pass.
+    """
+    structure = pdb_to_residue_table(structure_file_path)
     plddts = structure_to_pLDDT(structure, "l")
 
     total = 0
     passing = 0
     for r in plddts:
         total += 1
-        if r >= args.plddt_cutoff:
+        if r >= plddt_cutoff:
             passing += 1
 
-    structure_base = os.path.basename(args.structure_file_path)
+    structure_base = os.path.basename(structure_file_path)
 
     out = [structure_base, total, passing, round(passing / total, 2)]
     out = [str(i) for i in out]
     out = "\t".join(out)
-    print(out)
+    return out
+
+
+def struc_qc_main(args):
+    structure_paths = get_structure_paths(args.structure_file_path)
+    lines = process_map(
+        functools.partial(struc_qc, plddt_cutoff=args.plddt_cutoff),
+        structure_paths,
+        args.workers,
+    )
+
+    if args.out_file != "-":
+        make_output_dir(args.out_file)
+    with open_file(args.out_file, "w") as outfile:
+        for line in lines:
+            outfile.write(line + "\n")
 
 
 if __name__ == "__main__":
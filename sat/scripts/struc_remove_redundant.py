@@ -1,21 +1,122 @@
 # ------------------------------------------------------------------------------------ #
 # Import dependencies
 # ------------------------------------------------------------------------------------ #
-from .utils.misc import make_output_dir, talk_to_me
+from .utils.misc import STRUCTURE_SUFFIXES, make_output_dir, process_map, talk_to_me
+from .utils.store import (
+    is_store,
+    list_store_paths,
+    read_bytes,
+    split_store_path,
+    write_bytes,
+)
 from .utils.structure import (
+    is_mmcif,
+    pdb_to_residue_table,
     pdb_to_structure_object,
     struc_to_seq,
     structure_to_pLDDT,
     write_structure_to_pdb,
 )
 from glob import glob
+from itertools import combinations
 from statistics import fmean
 import os
+import shutil
+
+import numpy as np
+
+
+# ------------------------------------------------------------------------------------ #
+# Classes
+# ------------------------------------------------------------------------------------ #
+class Domain_record:
+    """
+    The little that struc_remove_redundant needs to know about a structure file: its
+    basename (id), path, sequence, and mean pLDDT. The structure itself isn't kept.
+    """
+
+    __slots__ = ["id", "path", "seq", "pLDDT"]
+
+    def __init__(self, id, path, seq, pLDDT):
+        self.id = id
+        self.path = path
+        self.seq = seq
+        self.pLDDT = pLDDT
 
 
 # ------------------------------------------------------------------------------------ #
 # Functions
 # ------------------------------------------------------------------------------------ #
+def get_domain_record(structure_path):
+    """
+    Reads the structure file and returns its Domain_record.
+    """
+    residue_table = pdb_to_residue_table(structure_path)
+    return Domain_record(
+        os.path.basename(structure_path),
+        structure_path,
+        struc_to_seq(residue_table),
+        fmean(structure_to_pLDDT(residue_table, "l")),
+    )
+
+
+def get_rewritten_name(file_basename):
+    """
+    Returns the name a structure is given when it is rewritten in pdb format. mmCIF
+    files (.cif or .cif.gz) are renamed to .pdb or .pdb.gz, and other names are kept.
+    """
+    if is_mmcif(file_basename):
+        return file_basename.replace(".cif", ".pdb")
+    return file_basename
+
+
+def write_domain(domain, output_dir, output_mode):
+    """
+    Writes the structure file of the domain to output_dir, keeping its basename.
+    output_mode is one of:
+    - rewrite: the structure is parsed and written in pdb format (gzipped if the name
+      ends in .gz). mmCIF files are renamed as in get_rewritten_name.
+    - copy: the file is copied, so the output is byte-identical to the input.
+    - hardlink: the file is hardlinked, or copied if it can't be hardlinked (e.g. it is
+      on a different filesystem).
+    """
+    if output_mode == "rewrite":
+        structure = pdb_to_structure_object(domain.path, domain.id)
+        outfile = f"{output_dir}/{get_rewritten_name(domain.id)}"
+        write_structure_to_pdb(structure, outfile)
+        return
+
+    outfile = f"{output_dir}/{domain.id}"
+
+    # Files in an Archive_store can't be linked, so are always copied
+    if (
+        split_store_path(domain.path) is not None
+        or split_store_path(outfile, "w") is not None
+    ):
+        if output_mode not in ["copy", "hardlink"]:
+            msg = f"output_mode must be rewrite, copy, or hardlink, not {output_mode}."
+            raise ValueError(msg)
+        write_bytes(outfile, read_bytes(domain.path))
+        return
+
+    if os.path.exists(outfile):
+        # Writing the input to itself would destroy it
+        if os.path.samefile(domain.path, outfile):
+            return
+        os.remove(outfile)
+
+    if output_mode == "copy":
+        shutil.copyfile(domain.path, outfile)
+    elif output_mode == "hardlink":
+        try:
+            os.link(domain.path, outfile)
+        except OSError:
+            shutil.copyfile(domain.path, outfile)
+    else:
+        msg = f"output_mode must be rewrite, copy, or hardlink, not {output_mode}."
+        raise ValueError(msg)
+
+
 def is_overlapping(seq1, seq2, end_overlap=15):
     """
     Determines if two strings, seq1 and seq2, either:
@@ -45,61 +146,195 @@ def is_overlapping(seq1, seq2, end_overlap=15):
     return False
 
 
+def get_kmer_index(seqs, k=8):
+    """
+    Builds a k-mer index of the sequences in seqs. Each distinct k-mer is given an
+    index, and k-mers are compared as integers (one byte per character), so k can be
+    at most 8. Returns:
+    - window_kmers: the k-mer index of every window of every sequence, in order. The
+      windows of seqs[i] are window_kmers[window_offsets[i]:window_offsets[i + 1]].
+    - window_offsets
+    - kmer_seq_ids, kmer_offsets: the indices of the sequences that contain k-mer g
+      are kmer_seq_ids[kmer_offsets[g]:kmer_offsets[g + 1]], each listed once.
+    """
+    if k > 8:
+        msg = f"k can be at most 8, not {k}."
+        raise ValueError(msg)
+
+    lengths = np.array([len(seq) for seq in seqs], dtype=np.int64)
+    seq_offsets = np.concatenate([[0], np.cumsum(lengths)])
+    n_windows = np.maximum(lengths - k + 1, 0)
+    window_offsets = np.concatenate([[0], np.cumsum(n_windows)])
+
+    # The start of each window in the concatenated sequences
+    window_ids = np.repeat(np.arange(len(seqs), dtype=np.int64), n_windows)
+    window_starts = (
+        np.arange(window_offsets[-1], dtype=np.int64)
+        - window_offsets[window_ids]
+        + seq_offsets[window_ids]
+    )
+
+    chars = np.frombuffer("".join(seqs).encode("ascii"), dtype=np.uint8)
+    window_codes = np.zeros(len(window_starts), dtype=np.uint64)
+    for i in range(k):
+        window_codes <<= np.uint64(8)
+        window_codes |= chars[window_starts + i]
+
+    # Sort the windows by k-mer, then by sequence
+    order = np.lexsort((window_ids, window_codes))
+    sorted_codes = window_codes[order]
+    sorted_ids = window_ids[order]
+    new_kmer = np.ones(len(order), dtype=bool)
+    new_kmer[1:] = sorted_codes[1:] != sorted_codes[:-1]
+    new_seq = new_kmer.copy()
+    new_seq[1:] |= sorted_ids[1:] != sorted_ids[:-1]
+
+    window_kmers = np.empty(len(order), dtype=np.int64)
+    window_kmers[order] = np.cumsum(new_kmer) - 1
+
+    # Offsets of each k-mer in the deduplicated kmer_seq_ids
+    kmer_seq_ids = sorted_ids[new_seq]
+    kmer_offsets = np.append(np.flatnonzero(new_kmer[new_seq]), len(kmer_seq_ids))
+
+    return window_kmers, window_offsets, kmer_seq_ids, kmer_offsets
+
+
+def find_overlapping_unique_pairs(seqs, end_overlap=15, k=8):
+    """
+    Returns the set of pairs (i, j), i < j, of indices of seqs for which
+    is_overlapping(seqs[i], seqs[j], end_overlap) is True. The sequences in seqs must
+    be distinct.
+
+    Two sequences overlap if either one, trimmed by end_overlap on both ends, is
+    found in the other (a sequence contained in the other is also found after it is
+    trimmed). So for each trimmed sequence, only the sequences that contain its rarest
+    k-mer can contain it, and only those are checked. Trimmed sequences shorter than
+    k are checked against every sequence.
+    """
+    window_kmers, window_offsets, kmer_seq_ids, kmer_offsets = get_kmer_index(seqs, k)
+    window_counts = np.diff(kmer_offsets)[window_kmers]
+
+    pairs = set()
+    for i, seq in enumerate(seqs):
+        trimmed = seq[end_overlap : len(seq) - end_overlap]
+
+        if len(trimmed) < k:
+            candidates = range(len(seqs))
+        else:
+            # The windows of seq that are within the trimmed sequence
+            start = window_offsets[i] + end_overlap
+            end = start + len(trimmed) - k + 1
+            kmer = window_kmers[start + np.argmin(window_counts[start:end])]
+            candidates = kmer_seq_ids[kmer_offsets[kmer] : kmer_offsets[kmer + 1]]
+            candidates = candidates.tolist()
+
+        for j in candidates:
+            if j != i and trimmed in seqs[j]:
+                pairs.add((min(i, j), max(i, j)))
+
+    return pairs
+
+
+def find_overlapping_pairs(seqs, end_overlap=15, k=8):
+    """
+    Returns a sorted list of every pair (i, j), i < j, of indices of seqs for which
+    is_overlapping(seqs[i], seqs[j], end_overlap) is True. This gives the same pairs
+    as calling is_overlapping on every pair, without comparing every pair.
+
+    Identical sequences are first bucketed together, as they always overlap. The
+    distinct sequences are then compared with find_overlapping_unique_pairs.
+    """
+    # Exact-hash bucketing of identical sequences. Members are in increasing order.
+    seq_to_unique = dict()
+    unique_seqs = []
+    members = []
+    for i, seq in enumerate(seqs):
+        u = seq_to_unique.get(seq)
+        if u is None:
+            u = len(unique_seqs)
+            seq_to_unique[seq] = u
+            unique_seqs.append(seq)
+            members.append([])
+        members[u].append(i)
+
+    pairs = []
+    for bucket in members:
+        pairs.extend(combinations(bucket, 2))
+    for u, v in find_overlapping_unique_pairs(unique_seqs, end_overlap, k):
+        for i in members[u]:
+            for j in members[v]:
+                pairs.append((min(i, j), max(i, j)))
+    pairs.sort()
+    return pairs
+
+
 # ------------------------------------------------------------------------------------ #
 # Main
 # ------------------------------------------------------------------------------------ #
 def struc_remove_redundant_main(args):
 
-    # Read in the domains
+    if args.output_mode != "none" and args.output_dir == "":
+        msg = "output_dir must be specified unless output_mode is none."
+        raise ValueError(msg)
+
+    # Read in the sequence and pLDDT of each domain
     talk_to_me("Reading in structures.")
-    domains = []
-    for structure_path in glob(args.input_structure_glob):
-        file_basename = os.path.basename(structure_path)
-        domain = pdb_to_structure_object(structure_path, file_basename)
-        domain.seq = struc_to_seq(domain)
-        domain.pLDDT = fmean(structure_to_pLDDT(domain, "l"))
-        domains.append(domain)
+    if is_store(args.input_structure_glob):
+        structure_paths = list_store_paths(
+            args.input_structure_glob, STRUCTURE_SUFFIXES
+        )
+    else:
+        structure_paths = glob(args.input_structure_glob)
+    domains = list(
+        process_map(get_domain_record, structure_paths, workers=args.workers)
+    )
 
     # Determine if any domain overlaps and loses to another domain
     talk_to_me("Detecting overlap and filtering..")
     loosers = set()
-    for i in range(len(domains)):
+    for i, j in find_overlapping_pairs([domain.seq for domain in domains]):
         domain1 = domains[i]
-        for domain2 in domains[i + 1 :]:
-            if is_overlapping(domain1.seq, domain2.seq):
-                if len(domain1.seq) > len(domain2.seq):
-                    loosers.add(domain2)
-                    continue
-                elif len(domain2.seq) > len(domain1.seq):
-                    loosers.add(domain1)
-                    continue
-                if domain1.pLDDT > domain2.pLDDT:
-                    loosers.add(domain1)
-                    continue
-                elif domain2.pLDDT > domain1.pLDDT:
-                    loosers.add(domain2)
-                    continue
-
-                # Final case - if length and pLDDT are the same, need to make sure that
-                # just one of them is added to the loosers.
-                if (
-                    len(domain1.seq) == len(domain2.seq)
-                    and domain2.pLDDT == domain1.pLDDT
-                ):
-                    if domain1 in loosers:
-                        continue
-                    elif domain2 in loosers:
-                        continue
-                    else:
-                        loosers.add(domain1)
+        domain2 = domains[j]
+        if len(domain1.seq) > len(domain2.seq):
+            loosers.add(domain2)
+            continue
+        elif len(domain2.seq) > len(domain1.seq):
+            loosers.add(domain1)
+            continue
+        if domain1.pLDDT > domain2.pLDDT:
+            loosers.add(domain1)
+            continue
+        elif domain2.pLDDT > domain1.pLDDT:
+            loosers.add(domain2)
+            continue
+
+        # Final case - if length and pLDDT are the same, need to make sure that
+        # just one of them is added to the loosers.
+        if len(domain1.seq) == len(domain2.seq) and domain2.pLDDT == domain1.pLDDT:
+            if domain1 in loosers:
+                continue
+            elif domain2 in loosers:
+                continue
+            else:
+                loosers.add(domain1)
 
     filtered_domains = [domain for domain in domains if domain not in loosers]
 
+    if args.survivor_list != "":
+        talk_to_me("Writing survivor list.")
+        make_output_dir(args.survivor_list)
+        with open(args.survivor_list, "w") as outfile:
+            for domain in filtered_domains:
+                outfile.write(f"{domain.path}\n")
+
+    if args.output_mode == "none":
+        return
+
     # Write to output to the same basename
     talk_to_me("Writing output structures.")
     make_output_dir(args.output_dir, is_dir=True)
     for domain in filtered_domains:
-        write_structure_to_pdb(domain, f"{args.output_dir}/{domain.id}")
+        write_domain(domain, args.output_dir, args.output_mode)
 
 
 if __name__ == "__main__":
@@ -1,11 +1,15 @@
+import functools
 import os
 
-from .utils.structure import pdb_to_structure_object, structure_to_pLDDT
-from .utils.misc import make_output_dir
+from .utils.structure import pdb_to_residue_table, structure_to_pLDDT
+from .utils.misc import get_structure_paths, make_output_dir, process_map
 
 
-def struc_to_plddt_main(args):
-    structure = pdb_to_structure_object(args.structure_file)
+def struc_to_plddt(structure_file):
+    """
+    Returns the average pLDDT of a structure, rounded to two decimals.
+    """
+    structure = pdb_to_residue_table(structure_file)
     plddts = structure_to_pLDDT(structure)
 
     count = 0
@@ -14,13 +18,27 @@ def struc_to_plddt_main(args):
         count += 1
         plddt_sum += plddt
     plddt = round(plddt_sum / count, ndigits=2)
+    return plddt
+
+
+def struc_to_plddt_main(args):
+    structure_paths = get_structure_paths(args.structure_file)
+    plddts = process_map(struc_to_plddt, structure_paths, args.workers)
+
+    # A single structure without an output file just has its pLDDT printed
+    if args.out_file == "" and len(structure_paths) == 1:
+        print(next(plddts))
+        return
+
+    out = []
+    for structure_file, plddt in zip(structure_paths, plddts):
+        base = os.path.basename(structure_file)
+        out.append(f"{base}\t{plddt}\n")
 
     # Save or print
     if args.out_file == "":
-        print(plddt)
+        print("".join(out), end="")
     else:
         make_output_dir(args.out_file)
-        base = os.path.basename(args.structure_file)
-        out = f"{base}\t{plddt}\n"
         with open(args.out_file, "a") as outfile:
-            outfile.write(out)
+            outfile.writelines(out)
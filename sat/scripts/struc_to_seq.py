@@ -1,15 +1,31 @@
-from .utils.structure import pdb_to_structure_object, struc_to_seq
-from .utils.misc import make_output_dir
+from .utils.structure import pdb_to_residue_table, struc_to_seq
+from .utils.misc import (
+    get_structure_paths,
+    make_output_dir,
+    process_map,
+    strip_structure_suffix,
+)
+
+
+def structure_file_to_seq(structure_file):
+    """
+    Returns the amino acid sequence of the structure file.
+    """
+    structure = pdb_to_residue_table(structure_file)
+    return struc_to_seq(structure)
 
 
 def struc_to_seq_main(args):
-    structure = pdb_to_structure_object(args.structure_file, args.header)
-    seq = struc_to_seq(structure)
+    structure_paths = get_structure_paths(args.structure_file)
+    seqs = process_map(structure_file_to_seq, structure_paths, args.workers)
 
-    # Save or print
-    if args.out_file == "":
-        print(seq)
-    else:
+    # A single structure is printed as just the sequence, or appended to the out_file
+    # with the specified header
+    if len(structure_paths) == 1:
+        seq = next(seqs)
+        if args.out_file == "":
+            print(seq)
+            return
         if args.header == "":
             msg = "If --out_file is specified, you must fill in --header."
             raise ValueError(msg)
@@ -17,3 +33,23 @@ def struc_to_seq_main(args):
         with open(args.out_file, "a") as outfile:
             out = f">{args.header}\n{seq}\n"
             outfile.write(out)
+        return
+
+    # Multiple structures are output as a fasta, with each header being the structure
+    # file basename without its suffix
+    if args.header != "":
+        msg = "--header can only be used with a single structure. With multiple "
+        msg += "structures, each header is the structure file name."
+        raise ValueError(msg)
+    out = []
+    for structure_file, seq in zip(structure_paths, seqs):
+        header = strip_structure_suffix(structure_file)
+        out.append(f">{header}\n{seq}\n")
+
+    # Save or print
+    if args.out_file == "":
+        print("".join(out), end="")
+    else:
+        make_output_dir(args.out_file)
+        with open(args.out_file, "a") as outfile:
+            outfile.writelines(out)
@@ -0,0 +1,340 @@
+from array import array
+from collections.abc import Mapping
+
+import numpy as np
+
+from .misc import open_file
+from .alignments import (
+    Alignment_group,
+    Alignment_object,
+    FOLDSEEK_FIELD_TYPES,
+    PREDICATE_OPERATORS,
+    parse_filter_predicates,
+)
+
+
+# ------------------------------------------------------------------------------------ #
+# Classes
+# ------------------------------------------------------------------------------------ #
+class Alignment_table:
+    """
+    A columnar alternative to Foldseek_Dataset for large alignment files. Rather than
+    one Alignment_object per line, each column is stored as a single array:
+    - Numeric columns (see FOLDSEEK_FIELD_TYPES) are stored as float64 or int32 numpy
+      arrays, so they can be filtered and sorted in a vectorized way.
+    - All other columns (query, target, ...) are stored as int32 codes into a shared
+      vocabulary of strings (the .strings slot). Because the vocabulary is shared, the
+      codes of the query and target columns can be compared to one another.
+
+    Rows are ordered such that all alignments with the same query are contiguous, and
+    queries are in the order they first appear in the input file. The alignments of
+    query group i are rows group_offsets[i]:group_offsets[i + 1].
+
+    The .alignment_groups slot behaves like the Foldseek_Dataset dictionary of
+    query:Alignment_group, but the Alignment_group and Alignment_objects are only
+    generated when they are accessed. Note that the Alignment_objects hold numeric
+    columns as floats/ints rather than the strings present in the input file.
+    """
+
+    def parse_alignment(
+        self, alignment_file_path, alignment_fields="", field_types=FOLDSEEK_FIELD_TYPES
+    ):
+        """
+        Given an input path, parses the alignment file into columns.
+
+        As with Foldseek_Dataset.parse_alignment, if alignment_fields is not provided
+        the first line of the file must be a header starting with 'query'. The fields
+        are stored in the input_alignment_fields slot.
+
+        field_types is a dictionary of field:type (float or int) for numeric fields.
+        """
+        # Format alignment fields from comma-delimited string to list if neceesary
+        if alignment_fields != "" and not isinstance(alignment_fields, list):
+            alignment_fields = alignment_fields.split(",")
+
+        with open_file(alignment_file_path) as infile:
+
+            # Check if the first line is a header - if so, and alignment_fields is
+            # an empty string, use those as the alignment_fields
+            if alignment_fields == "":
+                for line in infile:
+                    if line.startswith("query"):
+                        alignment_fields = line.rstrip("\n").split("\t")
+                        break
+                    else:
+                        msg = "alignment_fields has not been passed to parse_alignment,"
+                        msg += " which is only allowed when the first line has headers!"
+                        msg += " (e.g. first line should start with 'query')"
+                        raise ValueError(msg)
+
+            # Record alignment fields for later use
+            self.input_alignment_fields = alignment_fields
+
+            if "query" not in alignment_fields:
+                msg = f"Cannot find the query field in {alignment_fields}!"
+                raise ValueError(msg)
+            query_i = alignment_fields.index("query")
+
+            # The arrays each column will be stored in while parsing
+            columns = []
+            for field in alignment_fields:
+                field_type = field_types.get(field, str)
+                if field_type is float:
+                    columns.append(array("d"))
+                else:
+                    columns.append(array("i"))
+            converters = [field_types.get(field, str) for field in alignment_fields]
+
+            vocabulary = dict()
+            query_code_to_group = dict()
+            row_groups = array("i")
+
+            for line in infile:
+                # It's okay if there is a header, but need to remove it
+                if line.startswith("query"):
+                    continue
+
+                line = line.rstrip("\n").split("\t")
+
+                if len(line) != len(alignment_fields):
+                    msg = "The line and alignment_fields don't have the same "
+                    msg += "number of entries!"
+                    msg += f"Current line is: {line}.\n"
+                    msg += f"Alignment fields are: {alignment_fields}"
+                    raise ValueError(msg)
+
+                for field, converter, column, val in zip(
+                    alignment_fields, converters, columns, line
+                ):
+                    if converter is str:
+                        code = vocabulary.get(val)
+                        if code is None:
+                            code = len(vocabulary)
+                            vocabulary[val] = code
+                        column.append(code)
+                        continue
+                    try:
+                        column.append(converter(val))
+                    except ValueError:
+                        msg = f"Detected a value in the field {field} which can't be "
+                        msg += f"converted to {converter.__name__}. The val is {val}."
+                        raise ValueError(msg)
+
+                query_code = columns[query_i][-1]
+                group = query_code_to_group.get(query_code)
+                if group is None:
+                    group = len(query_code_to_group)
+                    query_code_to_group[query_code] = group
+                row_groups.append(group)
+
+        self.strings = list(vocabulary)
+        self.string_fields = set(
+            field
+            for field, converter in zip(alignment_fields, converters)
+            if converter is str
+        )
+        self.columns = dict()
+        for field, column in zip(alignment_fields, columns):
+            dtype = np.float64 if column.typecode == "d" else np.int32
+            self.columns[field] = np.frombuffer(column, dtype=dtype)
+
+        self._set_groups(
+            np.frombuffer(row_groups, dtype=np.int32),
+            np.fromiter(query_code_to_group, dtype=np.int32),
+        )
+
+    def _set_groups(self, row_groups, group_query_codes):
+        """
+        row_groups holds the query group of each row, and group_query_codes the query
+        code of each group. Reorders rows (if necessary) so each query group is
+        contiguous and sets the group_offsets slot.
+        """
+        if len(row_groups) > 1 and np.any(np.diff(row_groups) < 0):
+            order = np.argsort(row_groups, kind="stable")
+            row_groups = row_groups[order]
+            for field, column in self.columns.items():
+                self.columns[field] = column[order]
+
+        self.row_groups = row_groups
+        self.group_query_codes = group_query_codes
+        counts = np.bincount(row_groups, minlength=len(group_query_codes))
+        self.group_offsets = np.concatenate([[0], np.cumsum(counts)])
+        self.query_to_group = {
+            self.strings[code]: i for i, code in enumerate(group_query_codes.tolist())
+        }
+        self.alignment_groups = Lazy_alignment_groups(self)
+
+    def __len__(self):
+        return len(self.row_groups)
+
+    def count_alignments(self):
+        """
+        Returns an interger indicating the number of alignments in this table
+        """
+        return len(self)
+
+    def get_column(self, field):
+        """
+        Returns the values of field for every row as a numpy array. String columns are
+        decoded to an array of strings.
+        """
+        if field not in self.columns:
+            msg = f"Cannot find the field {field} in the alignments."
+            raise ValueError(msg)
+        column = self.columns[field]
+        if self.is_string_field(field):
+            return np.array(self.strings, dtype=object)[column]
+        return column
+
+    def is_string_field(self, field):
+        return field in self.string_fields
+
+    def subset(self, rows):
+        """
+        Returns a new Alignment_table holding only the specified rows. rows can be a
+        boolean mask (e.g. table.columns["evalue"] <= 1e-3) or an array of row indices.
+        For a mask, row order is preserved. For row indices, the rows of each query
+        group are kept in the order given. Query groups left without alignments are
+        dropped.
+        """
+        rows = np.asarray(rows)
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+
+        subset = Alignment_table()
+        subset.input_alignment_fields = self.input_alignment_fields
+        subset.strings = self.strings
+        subset.string_fields = self.string_fields
+        subset.columns = {field: column[rows] for field, column in self.columns.items()}
+
+        # Renumber the query groups that still have alignments
+        old_row_groups = self.row_groups[rows]
+        kept_groups, row_groups = np.unique(old_row_groups, return_inverse=True)
+        subset._set_groups(
+            row_groups.astype(np.int32), self.group_query_codes[kept_groups]
+        )
+        return subset
+
+    def filter(self, predicates):
+        """
+        Returns a new Alignment_table with only the alignments that pass every
+        predicate. predicates is a comma-delimited string such as
+        'evalue<=1e-3,alntmscore>=0.5', or a list of (field, operator, value) tuples
+        from parse_filter_predicates. Each predicate is evaluated on the whole column
+        at once.
+        """
+        if isinstance(predicates, str):
+            predicates = parse_filter_predicates(predicates)
+
+        mask = np.ones(len(self), dtype=bool)
+        for field, op, value in predicates:
+            if field not in self.columns:
+                msg = f"Cannot find the field {field} in the alignments."
+                raise ValueError(msg)
+            if self.is_string_field(field):
+                msg = f"Can only filter on numeric fields, and {field} isn't numeric."
+                raise ValueError(msg)
+            mask &= PREDICATE_OPERATORS[op](self.columns[field], value)
+        return self.subset(mask)
+
+    def keep_top_N_alignments(self, field, N):
+        """
+        Returns a new Alignment_table that keeps, for each query, the N alignments with
+        the highest value in field. Within each query the alignments are ordered from
+        highest to lowest value, with ties kept in their original order - the same as
+        Alignment_group.keep_top_N_alignments.
+
+        If N is set to 0, the table is returned unchanged, with alignments left in
+        their original order.
+        """
+        if self.is_string_field(field):
+            msg = f"Can only sort on numeric fields, and {field} isn't numeric."
+            raise ValueError(msg)
+
+        if N == 0:
+            return self
+
+        # Sort by group, then by descending value. lexsort is stable, so ties keep
+        # their original order.
+        order = np.lexsort((-self.columns[field], self.row_groups))
+
+        # Rank of each row within its group, given the sort above
+        groups = self.row_groups[order]
+        rank = np.arange(len(order)) - self.group_offsets[groups]
+        return self.subset(order[rank < N])
+
+    def write_out_alignments(self, outfile, alignment_fields):
+        """
+        Writes the alignment_fields (in the correct order!) of every alignment to the
+        open file outfile, delimited by \\t. Fields that aren't in the table are written
+        as empty strings.
+
+        Unlike Alignment_object.write_output, which writes the text of the input file,
+        numeric fields are written from their stored values in python's number format.
+        For example, 5.558E-10 is written as 5.558e-10, and a bits value of 347 (a float
+        field) as 347.0.
+        """
+        chunk_size = 100000
+        for start in range(0, len(self), chunk_size):
+            end = min(start + chunk_size, len(self))
+            values = []
+            for field in alignment_fields:
+                if field not in self.columns:
+                    values.append([""] * (end - start))
+                    continue
+                column = self.columns[field][start:end].tolist()
+                if self.is_string_field(field):
+                    column = [self.strings[code] for code in column]
+                else:
+                    column = [str(val) for val in column]
+                values.append(column)
+            outfile.writelines("\t".join(row) + "\n" for row in zip(*values))
+
+    def get_alignment_group(self, query):
+        """
+        Builds the Alignment_group, filled with Alignment_objects, for the query.
+        """
+        group = self.query_to_group[query]
+        start = self.group_offsets[group]
+        end = self.group_offsets[group + 1]
+
+        fields = self.input_alignment_fields
+        values = []
+        for field in fields:
+            column = self.columns[field][start:end].tolist()
+            if self.is_string_field(field):
+                column = [self.strings[code] for code in column]
+            values.append(column)
+
+        alignment_group = Alignment_group(query)
+        for row in zip(*values):
+            alignment_group.add_alignment(Alignment_object(list(row), fields))
+        return alignment_group
+
+
+class Lazy_alignment_groups(Mapping):
+    """
+    A read-only dictionary of query:Alignment_group for an Alignment_table. The
+    Alignment_group of a query is generated each time it is accessed, so only the
+    alignment groups currently in use are held in memory.
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    def __getitem__(self, query):
+        return self.table.get_alignment_group(query)
+
+    def __contains__(self, query):
+        return query in self.table.query_to_group
+
+    def __iter__(self):
+        return iter(self.table.query_to_group)
+
+    def __len__(self):
+        return len(self.table.query_to_group)
+
+
+if __name__ == "__main__":
+    msg = "This script has utilities and functions. Don't call it directly!"
+    raise ValueError(msg)
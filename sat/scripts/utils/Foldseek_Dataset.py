@@ -1,7 +1,7 @@
 from .alignments import Alignment_group, Alignment_object
-from .misc import talk_to_me
+from .misc import talk_to_me, open_file
 from .clusters import Cluster
-from .ete3_taxonomy import Taxon
+from .ete3_taxonomy import Taxon, Lineage_cache
 
 
 # ------------------------------------------------------------------------------------ #
@@ -45,13 +45,15 @@ class Foldseek_Dataset:
         present and alignment_fields is not provided, it will use the header as the
         alignment fields and will store the alignment_fields list in the
         Foldseek_Dataset object's input_alignment_fields attribute.
+
+        The alignment file can be gzipped (ending in .gz), or '-' to read stdin.
         """
         # Format alignment fields from comma-delimited string to list if neceesary
         if alignment_fields != "" and not isinstance(alignment_fields, list):
             alignment_fields = alignment_fields.split(",")
 
         alignments_dict = dict()
-        with open(alignment_file_path) as infile:
+        with open_file(alignment_file_path) as infile:
 
             # Check if the first line is a header - if so, and alignment_fields is
             # an empty string, use those as the alignment_fields
@@ -234,26 +236,42 @@ class Foldseek_Dataset:
 
         return out
 
-    def add_taxon_to_alignments(self, taxonomy_levels, delimiter="__", pos=-1):
+    def add_taxon_to_alignments(
+        self, taxonomy_levels, delimiter="__", pos=-1, lineage_cache=None
+    ):
         """
         Iterates through all alignment_groups and all alignment_objects and adds the
         query and target taxonIDs as a Taxon object in the query_taxonID and
         target_taxonID slots of the alignment_objects.
-        """
 
-        # Keep track of Taxa I've already made
-        seen_taxa = dict()
+        If lineage_cache (a Lineage_cache for the taxonomy_levels) is provided, the
+        lineages of the Taxon objects are looked up there.
+        """
+        if lineage_cache is None:
+            lineage_cache = Lineage_cache(None, taxonomy_levels)
 
+        # Find all taxonIDs first, so their lineages can be fetched in bulk
+        taxonIDs = set()
         for query, alignment_group in self.alignment_groups.items():
             for alignment in alignment_group.alignments:
                 alignment.add_query_taxonID(delimiter=delimiter, pos=pos)
                 alignment.add_target_taxonID(delimiter=delimiter, pos=pos)
+                taxonIDs.add(alignment.query_taxonID)
+                taxonIDs.add(alignment.target_taxonID)
+        lineage_cache.add_taxonIDs(taxonIDs)
 
+        # Keep track of Taxa I've already made
+        seen_taxa = dict()
+
+        for query, alignment_group in self.alignment_groups.items():
+            for alignment in alignment_group.alignments:
                 if alignment.query_taxonID in seen_taxa:
                     alignment.query_taxon = seen_taxa[alignment.query_taxonID]
                 else:
                     alignment.query_taxon = Taxon(
-                        alignment.query_taxonID, taxonomy_levels
+                        alignment.query_taxonID,
+                        taxonomy_levels,
+                        lineage_cache=lineage_cache,
                     )
                     seen_taxa[alignment.query_taxonID] = alignment.query_taxon
 
@@ -261,7 +279,9 @@ class Foldseek_Dataset:
                     alignment.target_taxon = seen_taxa[alignment.target_taxonID]
                 else:
                     alignment.target_taxon = Taxon(
-                        alignment.target_taxonID, taxonomy_levels
+                        alignment.target_taxonID,
+                        taxonomy_levels,
+                        lineage_cache=lineage_cache,
                     )
                     seen_taxa[alignment.target_taxonID] = alignment.target_taxon
 
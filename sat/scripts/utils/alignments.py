@@ -2,8 +2,48 @@ from .structure import pdb_to_structure_object, structure_to_pLDDT, struc_to_seq
 from .ete3_taxonomy import Taxon
 
 from collections import Counter
+import heapq
+import operator
+import re
 import numpy as np
-import matplotlib.pyplot as plt
+
+
+# Types of the known foldseek/mmseqs output columns. Any column that isn't listed here
+# is kept as a string.
+FOLDSEEK_FIELD_TYPES = {
+    "fident": float,
+    "pident": float,
+    "evalue": float,
+    "bits": float,
+    "prob": float,
+    "lddt": float,
+    "alntmscore": float,
+    "qtmscore": float,
+    "ttmscore": float,
+    "rmsd": float,
+    "qcov": float,
+    "tcov": float,
+    "alnlen": int,
+    "mismatch": int,
+    "gapopen": int,
+    "qstart": int,
+    "qend": int,
+    "tstart": int,
+    "tend": int,
+    "qlen": int,
+    "tlen": int,
+}
+
+# Comparison operators that can be used in filter predicates. These work on both
+# single values and numpy arrays.
+PREDICATE_OPERATORS = {
+    "<=": operator.le,
+    ">=": operator.ge,
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    ">": operator.gt,
+}
 
 
 # ------------------------------------------------------------------------------------ #
@@ -113,6 +153,9 @@ class Alignment_group:
             msg += "in the object!"
             raise ValueError(msg)
 
+        # Imported here because matplotlib is slow to import
+        import matplotlib.pyplot as plt
+
         fig, ax = plt.subplots()
         if "alignment_coverage" in self.__dict__:
             ax.plot(self.alignment_coverage, label="Alignment Coverage")
@@ -154,20 +197,11 @@ class Alignment_group:
                 msg += " Something is wrong!"
                 raise ValueError(msg)
 
-            # Handle scientific notation and convert to float
-            # Update the field as well
+            # Convert strings to the field's type (or float if the field is unknown)
+            # Update the field as well, so this only happens once per alignment
             if isinstance(val, str):
-                try:
-                    val = float(val.replace("E", "e"))
-                except ValueError:
-                    msg = (
-                        f"Detected a string in the field {filter_field} which can't be "
-                        f"converted to a string. The val is {val}."
-                    )
-                    raise ValueError(msg)
-
-            # Override the object with the formatted field
-            alignment.__dict__[filter_field] = val
+                val = convert_field_value(filter_field, val, default_type=float)
+                alignment.__dict__[filter_field] = val
 
             if val <= max_val and val >= min_val:
                 filtered_alignments.append(alignment)
@@ -193,8 +227,44 @@ class Alignment_group:
             msg += " Something is wrong!"
             raise ValueError(msg)
 
-        self.alignments.sort(key=lambda x: x.__dict__[filter_field], reverse=True)
-        self.alignments = self.alignments[:N]
+        # Known numeric fields are compared as numbers even if they're still strings
+        def sort_key(alignment):
+            val = alignment.__dict__[filter_field]
+            if isinstance(val, str) and filter_field in FOLDSEEK_FIELD_TYPES:
+                val = convert_field_value(filter_field, val)
+            return val
+
+        # heapq.nlargest is equivalent to a stable reverse sort followed by [:N], but
+        # doesn't need to sort the whole list when N is small
+        if N < len(self.alignments):
+            self.alignments = heapq.nlargest(N, self.alignments, key=sort_key)
+        else:
+            self.alignments.sort(key=sort_key, reverse=True)
+
+    def filter_by_predicates(self, predicates):
+        """
+        Keeps only the alignments that pass every predicate. predicates is a list of
+        (field, operator, value) tuples, as generated by parse_filter_predicates.
+        Fields that are converted to numbers are updated in the alignment objects.
+
+        This function acts IN PLACE.
+        """
+        for field, op, value in predicates:
+            compare = PREDICATE_OPERATORS[op]
+            filtered_alignments = []
+            for alignment in self.alignments:
+                try:
+                    val = alignment.__dict__[field]
+                except KeyError:
+                    msg = f"Cannot find the field {field} in the alingments."
+                    msg += " Something is wrong!"
+                    raise ValueError(msg)
+                if isinstance(val, str):
+                    val = convert_field_value(field, val, default_type=float)
+                    alignment.__dict__[field] = val
+                if compare(val, value):
+                    filtered_alignments.append(alignment)
+            self.alignments = filtered_alignments
 
 
 class Alignment_object:
@@ -312,6 +382,145 @@ class Alignment_object:
 # ------------------------------------------------------------------------------------ #
 # Functions
 # ------------------------------------------------------------------------------------ #
+def convert_field_value(field, val, default_type=None):
+    """
+    Converts the string val to the type of field listed in FOLDSEEK_FIELD_TYPES. If the
+    field isn't listed, it is converted with default_type, or returned as is if
+    default_type is None.
+    """
+    field_type = FOLDSEEK_FIELD_TYPES.get(field, default_type)
+    if field_type is None:
+        return val
+    try:
+        return field_type(val)
+    except ValueError:
+        msg = (
+            f"Detected a value in the field {field} which can't be converted to "
+            f"{field_type.__name__}. The val is {val}."
+        )
+        raise ValueError(msg)
+
+
+def parse_filter_predicates(predicates):
+    """
+    Parses a comma-delimited string (or list) of predicates such as
+    'evalue<=1e-3,alntmscore>=0.5' into a list of (field, operator, value) tuples -
+    e.g. [('evalue', '<=', 0.001), ('alntmscore', '>=', 0.5)]. Values are floats, and
+    the operator can be any key of PREDICATE_OPERATORS.
+    """
+    if predicates == "" or predicates == []:
+        return []
+    if not isinstance(predicates, list):
+        predicates = predicates.split(",")
+
+    ops = "|".join(re.escape(op) for op in PREDICATE_OPERATORS)
+    pattern = re.compile(rf"^\s*(\w+)\s*({ops})\s*(\S+)\s*$")
+
+    parsed = []
+    for predicate in predicates:
+        match = pattern.match(predicate)
+        if match is None:
+            msg = f"Cannot parse the filter predicate '{predicate}'. Predicates should"
+            msg += f" look like field<=value, using one of {list(PREDICATE_OPERATORS)}."
+            raise ValueError(msg)
+        field, op, value = match.groups()
+        try:
+            value = float(value)
+        except ValueError:
+            msg = f"The value in the filter predicate '{predicate}' must be a number."
+            raise ValueError(msg)
+        parsed.append((field, op, value))
+    return parsed
+
+
+def read_alignment_header(infile, alignment_fields=""):
+    """
+    Returns the alignment fields of an open alignment file as a list. If
+    alignment_fields is a comma-delimited string or list, it is used. If it is an
+    empty string, the first line of infile must be a header starting with 'query',
+    and that line is consumed.
+    """
+    if alignment_fields != "":
+        if not isinstance(alignment_fields, list):
+            alignment_fields = alignment_fields.split(",")
+        return alignment_fields
+
+    line = infile.readline()
+    if not line.startswith("query"):
+        msg = "alignment_fields has not been passed to read_alignment_header,"
+        msg += " which is only allowed when the first line has headers!"
+        msg += " (e.g. first line should start with 'query')"
+        raise ValueError(msg)
+    return line.rstrip("\n").split("\t")
+
+
+def stream_alignment_groups(infile, alignment_fields):
+    """
+    Given an open alignment file, yields one Alignment_group at a time so that only
+    the alignments of one query are held in memory.
+
+    Alignments are grouped by consecutive lines with the same query, which is how
+    foldseek writes its output. If a query's alignments aren't contiguous in the file,
+    that query will be yielded as multiple Alignment_groups.
+    """
+    alignment_group = None
+    for line in infile:
+        # It's okay if there is a header, but need to remove it
+        if line.startswith("query"):
+            continue
+
+        line = line.rstrip("\n").split("\t")
+
+        if len(line) != len(alignment_fields):
+            msg = "The line and alignment_fields don't have the same "
+            msg += "number of entries!"
+            msg += f"Current line is: {line}.\n"
+            msg += f"Alignment fields are: {alignment_fields}"
+            raise ValueError(msg)
+
+        alignment = Alignment_object(line, alignment_fields)
+
+        if alignment_group is None or alignment.query != alignment_group.query:
+            if alignment_group is not None:
+                yield alignment_group
+            alignment_group = Alignment_group(alignment.query)
+        alignment_group.add_alignment(alignment)
+
+    if alignment_group is not None:
+        yield alignment_group
+
+
+def stream_alignment_fields(infile, alignment_fields, fields):
+    """
+    Given an open alignment file, yields a tuple of the string values of fields for
+    each alignment, one line at a time. This is lighter than stream_alignment_groups
+    when only a few fields are needed, as no Alignment_objects are made.
+    """
+    positions = []
+    for field in fields:
+        if field not in alignment_fields:
+            msg = f"Cannot find the field {field} in the alignment fields!"
+            msg += f" Alignment fields are: {alignment_fields}"
+            raise ValueError(msg)
+        positions.append(alignment_fields.index(field))
+
+    for line in infile:
+        # It's okay if there is a header, but need to remove it
+        if line.startswith("query"):
+            continue
+
+        line = line.rstrip("\n").split("\t")
+
+        if len(line) != len(alignment_fields):
+            msg = "The line and alignment_fields don't have the same "
+            msg += "number of entries!"
+            msg += f"Current line is: {line}.\n"
+            msg += f"Alignment fields are: {alignment_fields}"
+            raise ValueError(msg)
+
+        yield tuple(line[position] for position in positions)
+
+
 def parse_alignment(alignment_file_path, alignment_fields):
     """
     Given an input path, parses the alignment file into a dictionary of
@@ -2,6 +2,8 @@
 
 # from .ete3_taxonomy import taxon_list_to_lineage_counts
 
+from array import array
+
 from .misc import talk_to_me
 
 
@@ -228,6 +230,102 @@ class Cluster_information:
         self.cluster_rep_to_ID = cluster_rep_to_ID
 
 
+class Union_find:
+    """
+    A disjoint-set (union-find) structure for connected-component clustering. Members
+    can be any hashable (typically the string names of structures), and are interned
+    to integer IDs upon being added. Parent pointers and component sizes are stored in
+    compact integer arrays, so memory scales with the number of distinct members rather
+    than the number of links between them.
+
+    find() uses path compression and union() uses union by size, so a series of
+    unions/finds runs in effectively linear time.
+
+    Typical usage:
+    uf = Union_find()
+    for query, target in pairs:
+        uf.union(query, target)
+    clusters = uf.get_clusters()
+    """
+
+    def __init__(self):
+        self.member_to_id = dict()
+        self.members = []
+        self.parent = array("q")
+        self.size = array("q")
+
+    def __len__(self):
+        return len(self.members)
+
+    def __contains__(self, member):
+        return member in self.member_to_id
+
+    def add(self, member):
+        """
+        Adds the member as a cluster of one if it isn't already present. Returns the
+        integer ID of the member.
+        """
+        member_id = self.member_to_id.get(member)
+        if member_id is None:
+            member_id = len(self.members)
+            self.member_to_id[member] = member_id
+            self.members.append(member)
+            self.parent.append(member_id)
+            self.size.append(1)
+        return member_id
+
+    def _find_root(self, member_id):
+        """
+        Returns the integer ID of the root of member_id's cluster, compressing the path
+        along the way.
+        """
+        parent = self.parent
+        root = member_id
+        while parent[root] != root:
+            root = parent[root]
+        while parent[member_id] != root:
+            parent[member_id], member_id = root, parent[member_id]
+        return root
+
+    def find(self, member):
+        """
+        Returns the member that is the root of the cluster containing member. Two
+        members are in the same cluster if they have the same root.
+        """
+        return self.members[self._find_root(self.member_to_id[member])]
+
+    def union(self, member1, member2):
+        """
+        Merges the clusters containing member1 and member2, adding either member if
+        it is not yet present.
+        """
+        root1 = self._find_root(self.add(member1))
+        root2 = self._find_root(self.add(member2))
+        if root1 == root2:
+            return
+
+        # Attach the smaller cluster to the larger one
+        if self.size[root1] < self.size[root2]:
+            root1, root2 = root2, root1
+        self.parent[root2] = root1
+        self.size[root1] += self.size[root2]
+
+    def get_clusters(self):
+        """
+        Returns a list of sets, where each set holds the members of a cluster. Clusters
+        are ordered by the first time any of their members was added.
+        """
+        root_to_cluster = dict()
+        for member_id, member in enumerate(self.members):
+            root = self._find_root(member_id)
+            if root not in root_to_cluster:
+                root_to_cluster[root] = set()
+            root_to_cluster[root].add(member)
+
+        # Dictionaries are ordered, and each cluster was initialized by its first member
+        return list(root_to_cluster.values())
+
+
 class Cluster:
     """
     The purpose of this class is to store a lsit of cluster_member() objects. This
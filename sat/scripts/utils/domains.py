@@ -0,0 +1,112 @@
+import numpy as np
+
+from .misc import open_file
+
+
+# The per-domain columns of the domain report, in order. The report then has one
+# mean_pae_to_{domain} column for each domain.
+DOMAIN_REPORT_FIELDS = [
+    "domain",
+    "length",
+    "start",
+    "end",
+    "mean_plddt",
+    "median_plddt",
+    "min_plddt",
+    "mean_pae",
+    "median_pae",
+]
+
+
+# ------------------------------------------------------------------------------------ #
+# Functions
+# ------------------------------------------------------------------------------------ #
+def cluster_to_indices(cluster, offset=1):
+    """
+    Returns the positions in cluster (a frozenset or other iterable) as a numpy array
+    of 0-indexed positions, keeping the order in which the cluster is iterated.
+    offset is subtracted from every position - the default of 1 converts 1-indexed
+    positions, and an offset of 0 keeps them as they are.
+    """
+    return np.fromiter(cluster, dtype=np.int64, count=len(cluster)) - offset
+
+
+def sequential_mean(values):
+    """
+    Returns the mean of the values, summing them from first to last as a python loop
+    would. np.mean sums in a pairwise manner, which can differ in the last digits.
+    """
+    values = np.ravel(values)
+    return np.cumsum(values)[-1] / len(values)
+
+
+def get_block_pae(pae_matrix, indices_1, indices_2):
+    """
+    Returns the block of the PAE matrix with rows indices_1 and columns indices_2.
+    Both are arrays of 0-indexed positions.
+    """
+    return pae_matrix[np.ix_(indices_1, indices_2)]
+
+
+def get_inter_domain_pae(domains, pae_matrix):
+    """
+    domains is a list of arrays with the 0-indexed positions of each domain. Returns a
+    len(domains) x len(domains) array, where [i, j] is the mean PAE of the positions in
+    domain j when aligned on domain i (i.e. the mean of the block with the rows of
+    domain i and the columns of domain j). The diagonal is the mean intra-domain PAE.
+    """
+    inter_domain_pae = np.empty((len(domains), len(domains)), dtype=np.float64)
+    for i, indices_1 in enumerate(domains):
+        for j, indices_2 in enumerate(domains):
+            block = get_block_pae(pae_matrix, indices_1, indices_2)
+            inter_domain_pae[i, j] = sequential_mean(block)
+    return inter_domain_pae
+
+
+def get_domain_stats(domains, pae_matrix, plddt_array):
+    """
+    domains is a list of arrays with the 0-indexed positions of each domain. Returns a
+    dictionary of the DOMAIN_REPORT_FIELDS (other than domain) to an array with the
+    value for each domain. start and end are the first and last positions, 1-indexed.
+    The dictionary also holds the inter_domain_pae array from get_inter_domain_pae.
+    """
+    plddt_array = np.asarray(plddt_array, dtype=np.float64)
+    pae_matrix = np.asarray(pae_matrix)
+
+    stats = dict()
+    stats["length"] = np.array([len(indices) for indices in domains])
+    stats["start"] = np.array([indices.min() + 1 for indices in domains])
+    stats["end"] = np.array([indices.max() + 1 for indices in domains])
+
+    plddts = [plddt_array[indices] for indices in domains]
+    stats["mean_plddt"] = np.array([sequential_mean(plddt) for plddt in plddts])
+    stats["median_plddt"] = np.array([np.median(plddt) for plddt in plddts])
+    stats["min_plddt"] = np.array([plddt.min() for plddt in plddts])
+
+    stats["inter_domain_pae"] = get_inter_domain_pae(domains, pae_matrix)
+    stats["mean_pae"] = np.diagonal(stats["inter_domain_pae"]).copy()
+    stats["median_pae"] = np.array(
+        [np.median(get_block_pae(pae_matrix, indices, indices)) for indices in domains]
+    )
+    return stats
+
+
+def write_domain_report(outfile_path, domain_names, stats):
+    """
+    Writes the stats from get_domain_stats to a tab-delimited file with a header. Each
+    line is one domain, with the DOMAIN_REPORT_FIELDS followed by the mean PAE to each
+    domain (the rows of the inter-domain PAE matrix).
+    """
+    header = DOMAIN_REPORT_FIELDS + [f"mean_pae_to_{name}" for name in domain_names]
+    with open_file(outfile_path, "w") as outfile:
+        outfile.write("\t".join(header) + "\n")
+        for i, name in enumerate(domain_names):
+            line = [name]
+            line += [str(stats[field][i]) for field in DOMAIN_REPORT_FIELDS[1:]]
+            line += [str(pae) for pae in stats["inter_domain_pae"][i]]
+            outfile.write("\t".join(line) + "\n")
+
+
+if __name__ == "__main__":
+    msg = "This script has utilities and functions. Don't call it directly!"
+    raise ValueError(msg)
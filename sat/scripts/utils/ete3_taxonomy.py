@@ -1,18 +1,80 @@
-from ete3 import NCBITaxa
 from collections import Counter
+import os
+import sqlite3
 
 
-ncbi = NCBITaxa()
+# The ete3 NCBITaxa object is only made the first time it is needed (see get_ncbi),
+# as importing ete3 and opening the database is slow and most subcommands never use
+# it. The database location can be set with the SAT_TAXONOMY_DB environment variable
+# or with set_taxonomy_database.
+_ncbi = None
+_taxonomy_database = os.environ.get("SAT_TAXONOMY_DB", "")
+
+# Bump this if the way lineages are computed changes, so old caches are rebuilt
+LINEAGE_CACHE_VERSION = "1"
+
+# Seconds to wait for other jobs writing to a lineage cache file
+LINEAGE_CACHE_TIMEOUT = 300
+
+
+def set_taxonomy_database(path):
+    """
+    Sets the path of the ete3 taxa.sqlite database. If the database doesn't exist
+    there, ete3 will download it upon first use. This must be called before the
+    database is first used.
+    """
+    global _taxonomy_database
+    if _ncbi is not None and path != _taxonomy_database:
+        msg = "The taxonomy database has already been opened, so its path can't be "
+        msg += "changed!"
+        raise ValueError(msg)
+    _taxonomy_database = path
+
+
+def get_taxonomy_database():
+    """
+    Returns the path of the ete3 taxa.sqlite database, which is the ete3 default
+    (~/.etetoolkit/taxa.sqlite) unless it has been set.
+    """
+    if _taxonomy_database != "":
+        return _taxonomy_database
+    return os.path.join(os.environ.get("HOME", "/"), ".etetoolkit", "taxa.sqlite")
+
+
+def get_ncbi():
+    """
+    Returns the ete3 NCBITaxa object, making it the first time this is called.
+    """
+    global _ncbi
+    if _ncbi is None:
+        from ete3 import NCBITaxa
+
+        if _taxonomy_database == "":
+            _ncbi = NCBITaxa()
+        else:
+            _ncbi = NCBITaxa(dbfile=_taxonomy_database)
+    return _ncbi
 
 
 class Taxon:
-    def __init__(self, taxonID, taxonomy_levels="", populate_class=True, is_name=False):
+    def __init__(
+        self,
+        taxonID,
+        taxonomy_levels="",
+        populate_class=True,
+        is_name=False,
+        lineage_cache=None,
+    ):
         """
         If populate_class is true, will add the following slots to the object:
         - lineage
         - canonical_lineage
 
         taxonomy_levels should be a list of taxonomy levels.
+
+        lineage_cache is an optional Lineage_cache. If provided, the lineages are
+        looked up there (and only computed from the ete3 database on a cache miss).
+        The lineage_cache must have been made for the same taxonomy_levels.
         """
         if not is_name:
             self.taxonID = taxonID
@@ -25,6 +87,13 @@ class Taxon:
                 msg = "If you want to prepopulate the Taxon object, you need to provide"
                 msg += " the taxonomy_levels upon instantiation!"
                 raise ValueError(msg)
+            if lineage_cache is not None:
+                if lineage_cache.taxonomy_levels != taxonomy_levels:
+                    msg = f"The lineage_cache is for the taxonomy levels "
+                    msg += f"{lineage_cache.taxonomy_levels}, not {taxonomy_levels}!"
+                    raise ValueError(msg)
+                self.lineage, self.canonical_lineage = lineage_cache.get(self.taxonID)
+                return
             self.lineage = self.get_lineage(self.taxonID)
             self.canonical_lineage = self.get_cannonical_lineage(
                 self.taxonID, taxonomy_levels
@@ -43,12 +112,12 @@ class Taxon:
         will return X.
         """
         try:
-            return ncbi.get_name_translator([name])[name][0]
+            return get_ncbi().get_name_translator([name])[name][0]
         except KeyError:
             # Try to repair by stripping any numbers from the end of the name
             name = name.rstrip("0123456789").rstrip(" ")
             try:
-                return ncbi.get_name_translator([name])[name][0]
+                return get_ncbi().get_name_translator([name])[name][0]
             except KeyError:
                 return "X"
 
@@ -56,7 +125,7 @@ class Taxon:
         """
         Given a single taxonID, returns the taxonomic level.
         """
-        level = list(ncbi.get_rank([taxonID]).values())
+        level = list(get_ncbi().get_rank([taxonID]).values())
 
         # Unknown taxonID would yield [], which can't be indexed by [0] to get the
         # string
@@ -70,7 +139,7 @@ class Taxon:
         """
         Given a single taxonID, returns the name of the taxon.
         """
-        name = list(ncbi.get_taxid_translator([taxonID]).values())
+        name = list(get_ncbi().get_taxid_translator([taxonID]).values())
 
         # Unknown taxonID would yield [], which can't be indexed by [0] to get the
         # string
@@ -87,7 +156,7 @@ class Taxon:
         Given a taxonID, returns a list of all taxonIDs in its lineage.
         """
         try:
-            return ncbi.get_lineage(taxonID)
+            return get_ncbi().get_lineage(taxonID)
         except ValueError:
             print("Cannot find taxonID " + str(taxonID))
             return None
@@ -133,38 +202,313 @@ class Taxon:
             return ["" for _ in desired_levels]
         levels = [self.get_level(taxonID) for taxonID in lineage]
 
-        # Override species as terminal if specified. If species is the last level
-        # requested but isn't the last level of the lineage, replace the species taxonID
-        # with the terminal taxonID
-        if terminal_as_species is True and "species" in levels:
-            if desired_levels[-1] == "species":
-                species_i = levels.index("species")
-                if species_i + 1 < len(levels):
-                    lineage[species_i] = lineage[-1]
-
-        # Make lookup dict for easy conversion of level to taxonID
-        taxonID_lookup = dict(zip(levels, lineage))
+        cannonical_taxonIDs = select_cannonical_taxonIDs(
+            lineage, levels, desired_levels, terminal_as_species
+        )
 
+        # Get the taxon names. If the level isn't here, it is unknown
         cannonical_lineage = []
-        # Iterate over each of the levels in prefix dictionary
-        for level in desired_levels:
+        for taxonID in cannonical_taxonIDs:
+            if taxonID is None:
+                cannonical_lineage.append("")
+            else:
+                cannonical_lineage.append(self.get_name(taxonID))
 
-            if level not in desired_levels:
-                continue
+        return cannonical_lineage
 
-            # If the level isn't here, it is unknown
-            if level not in taxonID_lookup:
-                cannonical_lineage.append("")
-                continue
 
-            # Get the taxon name
-            taxonID = taxonID_lookup[level]
-            name = self.get_name(taxonID)
+class Lineage_cache:
+    """
+    A persistent, on-disk cache of taxonID --> (lineage, canonical_lineage) for a set
+    of taxonomy_levels. Computing a canonical lineage takes several queries of the
+    ete3 database per taxon, while the cache turns it into a dictionary lookup.
 
-            # Report it out with the lineage
-            cannonical_lineage.append(name)
+    The cache is stored in an sqlite file at cache_path. All cached lineages for the
+    taxonomy_levels are loaded upon instantiation. Lineages missing from the cache are
+    computed with get_cannonical_lineages, and are written to the cache file by save().
+    The cache file can be shared by jobs running at once. If it can't be read or
+    written (e.g. it stays locked by another job), a warning is printed and lineages
+    are only cached in memory from then on.
 
-        return cannonical_lineage
+    The cache records the ete3 database it was built from (and LINEAGE_CACHE_VERSION).
+    If the ete3 database is updated, the cached lineages are discarded.
+
+    If cache_path is None or an empty string, lineages are only cached in memory.
+    """
+
+    def __init__(self, cache_path="", taxonomy_levels="", terminal_as_species=True):
+        if taxonomy_levels == "" or not isinstance(taxonomy_levels, list):
+            msg = "taxonomy_levels must be provided to the Lineage_cache as a list!"
+            raise ValueError(msg)
+
+        if cache_path == "":
+            cache_path = None
+        self.cache_path = cache_path
+        self.taxonomy_levels = taxonomy_levels
+        self.terminal_as_species = terminal_as_species
+
+        # The key for these levels in the cache file
+        self.levels_key = ",".join(taxonomy_levels)
+        if not terminal_as_species:
+            self.levels_key += ";no_terminal_as_species"
+
+        self.lineages = dict()
+        self.new_lineages = dict()
+        self.load()
+
+    def get_database_signature(self):
+        """
+        Returns a string identifying the ete3 database and the cache version.
+        """
+        # Make sure the database exists (ete3 downloads it upon first use)
+        if not os.path.exists(get_taxonomy_database()):
+            get_ncbi()
+        stat = os.stat(get_taxonomy_database())
+        return f"{LINEAGE_CACHE_VERSION}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    def connect(self):
+        """
+        Opens the cache file, making its tables and discarding stale lineages if
+        necessary.
+        """
+        if os.path.dirname(self.cache_path) != "":
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+
+        # Other jobs may be using the cache, so wait for their writes to finish. In WAL
+        # mode, reads don't block (and aren't blocked by) a write.
+        connection = sqlite3.connect(
+            self.cache_path, timeout=LINEAGE_CACHE_TIMEOUT, isolation_level=None
+        )
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value TEXT)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS lineages (levels TEXT, taxonID TEXT, "
+                "lineage TEXT, canonical_lineage TEXT, PRIMARY KEY (levels, taxonID))"
+            )
+
+            # Check the signature inside a write transaction, so only one job
+            # discards stale lineages
+            signature = self.get_database_signature()
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                "SELECT value FROM metadata WHERE key = 'signature'"
+            ).fetchone()
+            if row is None or row[0] != signature:
+                connection.execute("DELETE FROM lineages")
+                connection.execute(
+                    "INSERT OR REPLACE INTO metadata VALUES ('signature', ?)",
+                    (signature,),
+                )
+            connection.execute("COMMIT")
+        except sqlite3.Error:
+            connection.close()
+            raise
+        return connection
+
+    def disable(self, error):
+        """
+        Stops using the cache file after error, so lineages are only cached in memory.
+        """
+        print(
+            f"Cannot use the lineage cache {self.cache_path} ({error}). Lineages will "
+            "only be cached in memory."
+        )
+        self.cache_path = None
+
+    def load(self):
+        """
+        Loads all lineages for the taxonomy_levels from the cache file.
+        """
+        if self.cache_path is None:
+            return
+        try:
+            connection = self.connect()
+            try:
+                rows = connection.execute(
+                    "SELECT taxonID, lineage, canonical_lineage FROM lineages "
+                    "WHERE levels = ?",
+                    (self.levels_key,),
+                ).fetchall()
+            finally:
+                connection.close()
+        except sqlite3.Error as error:
+            self.disable(error)
+            return
+
+        for taxonID, lineage, canonical_lineage in rows:
+            if lineage is not None:
+                lineage = [int(i) for i in lineage.split(",")]
+            canonical_lineage = canonical_lineage.split("\t")
+            self.lineages[taxonID] = (lineage, canonical_lineage)
+
+    def save(self):
+        """
+        Writes lineages that were computed since the last save to the cache file.
+        """
+        if self.cache_path is None or self.new_lineages == dict():
+            return
+
+        rows = []
+        for taxonID, (lineage, canonical_lineage) in self.new_lineages.items():
+            if lineage is not None:
+                lineage = ",".join(str(i) for i in lineage)
+            rows.append(
+                (self.levels_key, taxonID, lineage, "\t".join(canonical_lineage))
+            )
+
+        try:
+            connection = self.connect()
+            try:
+                connection.execute("BEGIN IMMEDIATE")
+                connection.executemany(
+                    "INSERT OR REPLACE INTO lineages VALUES (?, ?, ?, ?)", rows
+                )
+                connection.execute("COMMIT")
+            finally:
+                connection.close()
+        except sqlite3.Error as error:
+            self.disable(error)
+        self.new_lineages = dict()
+
+    def __len__(self):
+        return len(self.lineages)
+
+    def __contains__(self, taxonID):
+        return str(taxonID) in self.lineages
+
+    def add_taxonIDs(self, taxonIDs):
+        """
+        Computes the lineages of all taxonIDs that aren't already in the cache with
+        get_cannonical_lineages, which batches the queries of the ete3 database. Call
+        this with every taxonID in a dataset before looking them up one at a time.
+        """
+        missing = set(str(taxonID) for taxonID in taxonIDs) - self.lineages.keys()
+        if missing == set():
+            return
+        lineages = get_cannonical_lineages(
+            missing, self.taxonomy_levels, self.terminal_as_species
+        )
+        self.lineages.update(lineages)
+        self.new_lineages.update(lineages)
+
+    def get(self, taxonID):
+        """
+        Returns a tuple of (lineage, canonical_lineage) for the taxonID, computing it
+        from the ete3 database if it isn't in the cache. Returned lists are copies, so
+        they can be safely modified.
+        """
+        key = str(taxonID)
+        if key not in self.lineages:
+            self.add_taxonIDs([taxonID])
+
+        lineage, canonical_lineage = self.lineages[key]
+        if lineage is not None:
+            lineage = list(lineage)
+        return lineage, list(canonical_lineage)
+
+
+def select_cannonical_taxonIDs(
+    lineage, levels, desired_levels, terminal_as_species=True
+):
+    """
+    lineage is a list of taxonIDs, and levels is a list of the rank of each of them.
+    Returns a list with the taxonID at each of the desired_levels, or None if the
+    lineage doesn't have that level. See Taxon.get_cannonical_lineage for a
+    description of terminal_as_species.
+    """
+    lineage = list(lineage)
+
+    # Override species as terminal if specified. If species is the last level
+    # requested but isn't the last level of the lineage, replace the species taxonID
+    # with the terminal taxonID
+    if terminal_as_species is True and "species" in levels:
+        if desired_levels[-1] == "species":
+            species_i = levels.index("species")
+            if species_i + 1 < len(levels):
+                lineage[species_i] = lineage[-1]
+
+    # Make lookup dict for easy conversion of level to taxonID
+    taxonID_lookup = dict(zip(levels, lineage))
+    return [taxonID_lookup.get(level) for level in desired_levels]
+
+
+def get_cannonical_lineages(taxonIDs, desired_levels, terminal_as_species=True):
+    """
+    The bulk version of Taxon.get_lineage and Taxon.get_cannonical_lineage. Rather than
+    querying the ete3 database for every taxon in every lineage, this fetches the
+    lineages of all taxonIDs and then the ranks and names of all of their ancestors in
+    a few batched queries.
+
+    Returns a dictionary of taxonID:(lineage, canonical_lineage), keyed by the
+    taxonIDs as they were provided. As with Taxon, lineage is None for taxonIDs that
+    can't be found, and their canonical_lineage is all empty strings.
+    """
+    chunk_size = 10000
+
+    # Convert to integers. Anything that can't be converted can't be found.
+    taxonID_to_int = dict()
+    for taxonID in set(taxonIDs):
+        if not taxonID:
+            continue
+        try:
+            taxonID_to_int[taxonID] = int(taxonID)
+        except ValueError:
+            continue
+    int_taxonIDs = list(set(taxonID_to_int.values()))
+
+    # Fetch all lineages
+    lineages = dict()
+    for i in range(0, len(int_taxonIDs), chunk_size):
+        lineages.update(
+            get_ncbi().get_lineage_translator(int_taxonIDs[i : i + chunk_size])
+        )
+
+    # Any taxonIDs that weren't found may be obsolete, and merged into a new taxonID.
+    # get_lineage translates these one at a time, but there are usually few of them.
+    for taxonID in int_taxonIDs:
+        if taxonID in lineages:
+            continue
+        try:
+            lineages[taxonID] = get_ncbi().get_lineage(taxonID)
+        except ValueError:
+            continue
+
+    # Fetch the ranks and names of every taxon in any lineage
+    ancestors = list(
+        set(taxonID for lineage in lineages.values() for taxonID in lineage)
+    )
+    ranks = dict()
+    names = dict()
+    for i in range(0, len(ancestors), chunk_size):
+        chunk = ancestors[i : i + chunk_size]
+        ranks.update(get_ncbi().get_rank(chunk))
+        names.update(get_ncbi().get_taxid_translator(chunk))
+
+    results = dict()
+    for taxonID in set(taxonIDs):
+        lineage = lineages.get(taxonID_to_int.get(taxonID))
+        if lineage is None:
+            if taxonID:
+                print("Cannot find taxonID " + str(taxonID))
+            results[taxonID] = (None, ["" for _ in desired_levels])
+            continue
+
+        levels = [ranks.get(taxonID, "UNKNOWN") for taxonID in lineage]
+        cannonical_lineage = []
+        for cannonical_taxonID in select_cannonical_taxonIDs(
+            lineage, levels, desired_levels, terminal_as_species
+        ):
+            if cannonical_taxonID is None:
+                cannonical_lineage.append("")
+            else:
+                name = names.get(cannonical_taxonID, "UNKNOWN")
+                cannonical_lineage.append(name.replace(" ", "_"))
+        results[taxonID] = (list(lineage), cannonical_lineage)
+
+    return results
 
 
 def taxon_list_to_lineage_counts(taxon_objects, taxonomy_levels):
@@ -2,9 +2,30 @@ import pathlib
 import os
 import sys
 import gzip
+import contextlib
+import functools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+from itertools import islice
 from Bio import SeqIO
 import argparse
 
+from .store import (
+    STORE_SUFFIX,
+    is_new_store,
+    is_store,
+    list_store_paths,
+    make_store,
+    open_store_file,
+    path_exists,
+    split_store_path,
+)
+
+
+# Suffixes of the structure files found by get_structure_paths
+STRUCTURE_SUFFIXES = (".pdb", ".pdb.gz", ".cif", ".cif.gz")
+
 
 # ------------------------------------------------------------------------------------ #
 # Misc
@@ -45,6 +66,54 @@ def arg_str2bool(v):
         raise argparse.ArgumentTypeError("Boolean value expected.")
 
 
+def process_map(function, items, workers=1, chunksize=None):
+    """
+    Applies function to each of the items, yielding the results in the same order as
+    items. If workers is more than 1, items are processed by a pool of that many
+    worker processes - function must then be picklable (e.g. a module-level function
+    or a functools.partial of one).
+
+    items can be any iterable, including a generator. Items are sent to the workers
+    in chunks of chunksize, and only a few chunks per worker are read ahead of the
+    results being yielded, so a large stream of items is never held in memory at
+    once. If chunksize isn't given, it is chosen from the number of items (or is 100
+    if items has no length).
+    """
+    if workers < 1:
+        msg = f"workers must be at least 1. You entered {workers}."
+        raise ValueError(msg)
+
+    if workers == 1 or (hasattr(items, "__len__") and len(items) <= 1):
+        for item in items:
+            yield function(item)
+        return
+
+    # Send items in chunks so per-item overhead stays small for cheap functions
+    if chunksize is None:
+        if hasattr(items, "__len__"):
+            chunksize = max(1, min(100, len(items) // (workers * 4)))
+        else:
+            chunksize = 100
+
+    items = iter(items)
+    chunks = iter(lambda: list(islice(items, chunksize)), [])
+    process_chunk = functools.partial(_process_chunk, function)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = deque(
+            executor.submit(process_chunk, chunk)
+            for chunk in islice(chunks, workers * 4)
+        )
+        while futures:
+            results = futures.popleft().result()
+            for chunk in islice(chunks, 1):
+                futures.append(executor.submit(process_chunk, chunk))
+            yield from results
+
+
+def _process_chunk(function, chunk):
+    return [function(item) for item in chunk]
+
+
 def remove_pdb_and_fasta_suffix(name: str) -> str:
     """
     Removes .pdb or .fasta from a file name.
@@ -64,15 +133,103 @@ def make_output_dir(path, is_dir=False):
     """
     Finds the dirname of the path, and makes the directory if it doesn't exist.
     Notably, if the path is the a directory it skips the dirname finding and just makes
-    that directory
+    that directory. A missing or empty directory ending in .store is made as a new
+    Archive_store.
     """
     if not is_dir:
         out_dir = os.path.dirname(path)
         pathlib.Path(out_dir).mkdir(parents=True, exist_ok=True)
+    elif path.rstrip("/").endswith(STORE_SUFFIX) and is_new_store(path):
+        make_store(path)
     else:
         pathlib.Path(path).mkdir(parents=True, exist_ok=True)
 
 
+def open_file(path, mode="r"):
+    """
+    Opens path for reading (mode='r') or writing (mode='w'/'a') in text mode. If path
+    ends with .gz it is read/written with gzip. If path is '-', stdin or stdout is
+    used (and won't be closed when the returned file object is closed). Gzipped input
+    on stdin is detected and decompressed.
+
+    path can also be a file in an Archive_store (e.g. domains.store/protein.pdb), which
+    is read from the store, or added to it when the written file is closed. Writing
+    to a missing or empty directory ending in .store makes a new store.
+    """
+    if mode not in ["r", "w", "a"]:
+        msg = f"mode must be r, w, or a. You entered {mode}."
+        raise ValueError(msg)
+
+    if split_store_path(path, mode) is not None:
+        return open_store_file(path, mode)
+
+    if path == "-" and mode == "r":
+        if sys.stdin.buffer.peek(2)[:2] == b"\x1f\x8b":
+            return gzip.open(sys.stdin.buffer, "rt")
+        return contextlib.nullcontext(sys.stdin)
+    if path == "-":
+        return contextlib.nullcontext(sys.stdout)
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t")
+    return open(path, mode)
+
+
+def strip_structure_suffix(path):
+    """
+    Returns the basename of path without its structure suffix (one of
+    STRUCTURE_SUFFIXES), e.g. structures/protein.pdb.gz becomes protein.
+    """
+    basename = os.path.basename(path)
+    for suffix in STRUCTURE_SUFFIXES:
+        if basename.endswith(suffix):
+            return basename[: -len(suffix)]
+    return basename
+
+
+def get_structure_paths(path):
+    """
+    Returns a list of structure file paths from path, which can be:
+    - a structure file (ending in one of STRUCTURE_SUFFIXES)
+    - a directory, in which case all structure files in it are used
+    - a glob pattern, e.g. 'structures/*.pdb'
+    - a file listing one structure path per line
+    - an Archive_store (a directory ending in .store), in which case all structure
+      files in it are used
+
+    Paths from a directory or glob are sorted, so the order is deterministic. Paths
+    from a file list are kept in the listed order, and paths from a store are in the
+    order they are stored, so they are read sequentially.
+    """
+    if is_store(path):
+        return list_store_paths(path, STRUCTURE_SUFFIXES)
+    if os.path.isdir(path):
+        paths = [
+            os.path.join(path, name)
+            for name in os.listdir(path)
+            if name.endswith(STRUCTURE_SUFFIXES)
+        ]
+        return sorted(paths)
+    if path.endswith(STRUCTURE_SUFFIXES) and path_exists(path):
+        return [path]
+    if any(char in path for char in "*?["):
+        paths = sorted(glob(path, recursive=True))
+        if paths == []:
+            msg = f"No files match the glob {path}."
+            raise ValueError(msg)
+        return paths
+    if not os.path.exists(path):
+        msg = f"Cannot find the structure file, directory, or file list {path}."
+        raise ValueError(msg)
+
+    paths = []
+    with open(path) as infile:
+        for line in infile:
+            line = line.strip()
+            if line != "":
+                paths.append(line)
+    return paths
+
+
 def read_fasta_to_memory(input_fasta):
     """
     Reads fasta into a memory as a dictionary with header:sequence.
@@ -0,0 +1,452 @@
+import atexit
+import fcntl
+import gzip
+import io
+import os
+import tarfile
+import threading
+import time
+from glob import escape, glob
+from itertools import count
+
+
+# A directory ending in STORE_SUFFIX that holds shards is an Archive_store, and a path
+# such as domains.store/protein_domain-1.pdb refers to a file in the store
+STORE_SUFFIX = ".store"
+
+# Stores roll over to a new shard once a shard reaches this many bytes
+SHARD_SIZE = 2**30
+
+BLOCK_SIZE = tarfile.BLOCKSIZE
+END_OF_ARCHIVE = b"\0" * (2 * BLOCK_SIZE)
+
+
+# ------------------------------------------------------------------------------------ #
+# Classes
+# ------------------------------------------------------------------------------------ #
+class Archive_store:
+    """
+    Stores many small files in a few large, append-only archives (shards) so that
+    millions of structures don't become millions of files on the filesystem. The store
+    is a directory with:
+    - shard-{i}.tar: a regular, uncompressed tar archive (tar -xf can extract it).
+    - shard-{i}.idx: the index of the shard, with one tab-delimited line per file of
+      name, offset of the file's data in the tar, and size in bytes.
+
+    Reading a file is a dictionary lookup and a single read at its offset, and files()
+    and iter_files() go through the shards in the order they were written, so bulk
+    reads are sequential.
+
+    Files are only ever appended. Each writing process holds an exclusive lock on the
+    shard it writes to, so several processes (or jobs) can add files to the same store
+    at once - each writes to its own shard. Each file is added to the tar before its
+    index line is written, so an interrupted write never leaves an indexed file
+    incomplete. If a name is added more than once, the last one added to the highest-
+    numbered shard is read.
+
+    The bytes of each file are stored as they are given - files whose name ends in .gz
+    should be gzipped by the caller (see open_file, which does this).
+    """
+
+    def __init__(self, path, shard_size=SHARD_SIZE):
+        self.path = path
+        self.shard_size = shard_size
+        self.lock = threading.Lock()
+        self.read_fds = dict()
+        self.writer = None
+        self.load_index()
+
+    def __repr__(self):
+        return f"Archive_store({self.path})"
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __iter__(self):
+        return iter(self.files())
+
+    def get_shard_path(self, shard, suffix):
+        return f"{self.path}/shard-{shard:05d}.{suffix}"
+
+    def load_index(self):
+        """
+        Reads the index of every shard into the index slot, a dictionary of
+        name:(shard, offset, size).
+        """
+        self.index = dict()
+        idx_paths = sorted(glob(f"{escape(self.path)}/shard-*.idx"))
+        for idx_path in idx_paths:
+            shard = int(os.path.basename(idx_path)[6:-4])
+            for name, offset, size in read_shard_index(idx_path):
+                self.index[name] = (shard, offset, size)
+
+    def files(self):
+        """
+        Returns the names of the files in the store, in the order they are stored.
+        """
+        locations = sorted((location, name) for name, location in self.index.items())
+        return [name for _, name in locations]
+
+    def read(self, name):
+        """
+        Returns the bytes of the file name.
+        """
+        if name not in self.index:
+            # The file may have been added by another process since the index was read
+            self.load_index()
+        if name not in self.index:
+            msg = f"Cannot find {name} in the store {self.path}."
+            raise KeyError(msg)
+        shard, offset, size = self.index[name]
+        return os.pread(self._get_read_fd(shard), size, offset)
+
+    def iter_files(self):
+        """
+        Yields (name, bytes) for every file, reading each shard from start to end.
+        """
+        for name in self.files():
+            yield name, self.read(name)
+
+    def add(self, name, data):
+        """
+        Appends the file name with the contents data (bytes) to the store.
+        """
+        if name == "" or any(char in name for char in "\t\n\r"):
+            msg = (
+                f"Names in a store can't be empty or contain tabs or newlines: {name!r}"
+            )
+            raise ValueError(msg)
+
+        with self.lock:
+            writer = self._get_writer()
+            offset = writer.write(name, data)
+            self.index[name] = (writer.shard, offset, len(data))
+            if writer.end >= self.shard_size:
+                writer.close()
+                self.writer = None
+
+    def close(self):
+        """
+        Releases the shard being written to, and closes all open files.
+        """
+        with self.lock:
+            if self.writer is not None and self.writer.pid == os.getpid():
+                self.writer.close()
+            self.writer = None
+            for fd in self.read_fds.values():
+                os.close(fd)
+            self.read_fds = dict()
+
+    def _get_read_fd(self, shard):
+        fd = self.read_fds.get(shard)
+        if fd is None:
+            fd = os.open(self.get_shard_path(shard, "tar"), os.O_RDONLY)
+            self.read_fds[shard] = fd
+        return fd
+
+    def _get_writer(self):
+        """
+        Returns the Shard_writer of this process, first locking a shard that isn't in
+        use and has room (or a new shard) if necessary.
+        """
+        # A writer inherited from a parent process is left to the parent
+        if self.writer is not None and self.writer.pid == os.getpid():
+            return self.writer
+
+        os.makedirs(self.path, exist_ok=True)
+        for shard in count():
+            writer = Shard_writer.acquire(self, shard)
+            if writer is not None:
+                self.writer = writer
+                return writer
+
+
+class Shard_writer:
+    """
+    Appends files to a single shard of an Archive_store while holding an exclusive
+    lock on it. Use Shard_writer.acquire to get one.
+    """
+
+    def __init__(self, shard, tar_fd, idx_file, end):
+        self.shard = shard
+        self.tar_fd = tar_fd
+        self.idx_file = idx_file
+        self.end = end
+        self.pid = os.getpid()
+
+    @classmethod
+    def acquire(cls, store, shard):
+        """
+        Locks the shard and returns a Shard_writer for it, or None if another process
+        holds the lock or the shard is full.
+        """
+        tar_fd = os.open(store.get_shard_path(shard, "tar"), os.O_RDWR | os.O_CREAT)
+        try:
+            fcntl.flock(tar_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(tar_fd)
+            return None
+
+        # Only data recorded in the index is kept - anything after it is left over
+        # from an interrupted write
+        idx_path = store.get_shard_path(shard, "idx")
+        end, idx_size = get_shard_end(idx_path)
+        if end >= store.shard_size:
+            os.close(tar_fd)
+            return None
+        os.ftruncate(tar_fd, end)
+        os.pwrite(tar_fd, END_OF_ARCHIVE, end)
+
+        idx_file = open(idx_path, "ab")
+        idx_file.truncate(idx_size)
+        return cls(shard, tar_fd, idx_file, end)
+
+    def write(self, name, data):
+        """
+        Appends the file to the tar, followed by the end-of-archive marker, and then
+        records it in the index. Returns the offset of the data in the tar.
+        """
+        tarinfo = tarfile.TarInfo(name)
+        tarinfo.size = len(data)
+        tarinfo.mtime = int(time.time())
+        tarinfo.mode = 0o644
+        header = tarinfo.tobuf(tarfile.DEFAULT_FORMAT, "utf-8", "surrogateescape")
+
+        offset = self.end + len(header)
+        padding = b"\0" * (-len(data) % BLOCK_SIZE)
+        os.pwrite(self.tar_fd, header + data + padding + END_OF_ARCHIVE, self.end)
+        self.end = offset + len(data) + len(padding)
+
+        self.idx_file.write(f"{name}\t{offset}\t{len(data)}\n".encode())
+        self.idx_file.flush()
+        return offset
+
+    def close(self):
+        self.idx_file.close()
+        os.close(self.tar_fd)
+
+
+class Store_file(io.StringIO):
+    """
+    A text file that is added to an Archive_store when it is closed. Files whose name
+    ends in .gz are gzipped.
+    """
+
+    def __init__(self, store, name):
+        super().__init__()
+        self.store = store
+        self.name = name
+
+    def close(self):
+        if not self.closed:
+            data = self.getvalue().encode()
+            if self.name.endswith(".gz"):
+                data = gzip.compress(data, mtime=0)
+            self.store.add(self.name, data)
+        super().close()
+
+
+# ------------------------------------------------------------------------------------ #
+# Functions
+# ------------------------------------------------------------------------------------ #
+def read_shard_index(idx_path):
+    """
+    Yields (name, offset, size) for each complete line of the shard index.
+    """
+    with open(idx_path, "rb") as infile:
+        for line in infile:
+            if not line.endswith(b"\n"):
+                break
+            name, offset, size = line.decode().rstrip("\n").split("\t")
+            yield name, int(offset), int(size)
+
+
+def get_shard_end(idx_path):
+    """
+    Returns the end of the data of the last indexed file of a shard (i.e. where the
+    next file is written), and the size of the complete lines of the index.
+    """
+    if not os.path.exists(idx_path):
+        return 0, 0
+    with open(idx_path, "rb") as infile:
+        infile.seek(0, os.SEEK_END)
+        idx_size = infile.tell()
+
+        # Read back from the end until the last complete line is found
+        tail = b""
+        position = idx_size
+        while position > 0 and tail.count(b"\n") < 2:
+            step = min(4096, position)
+            position -= step
+            infile.seek(position)
+            tail = infile.read(step) + tail
+
+    # Drop an incomplete last line
+    if not tail.endswith(b"\n"):
+        idx_size -= len(tail) - tail.rfind(b"\n") - 1
+        tail = tail[: tail.rfind(b"\n") + 1]
+    lines = tail.splitlines()
+    if lines == []:
+        return 0, idx_size
+
+    _, offset, size = lines[-1].decode().split("\t")
+    end = int(offset) + int(size)
+    return end + (-end % BLOCK_SIZE), idx_size
+
+
+def split_store_path(path, mode="r"):
+    """
+    If path is a file in an Archive_store (e.g. domains.store/protein.pdb), returns
+    the path of the store and the name of the file. Otherwise, returns None, and path
+    should be used as a regular file.
+
+    For reading (mode 'r'), the directory must already be a store (see is_store). For
+    writing (mode 'w'), the directory can also be missing or empty, in which case the
+    store is made. An existing directory ending in .store that isn't a store is always
+    used as a regular directory.
+    """
+    store_path, sep, name = path.partition(STORE_SUFFIX + "/")
+    if sep == "" or name == "":
+        return None
+    store_path += STORE_SUFFIX
+    if is_store(store_path):
+        return store_path, name
+    if mode != "r" and is_new_store(store_path):
+        return store_path, name
+    return None
+
+
+def is_store(path):
+    """
+    Returns True if path is an Archive_store directory - a directory ending in .store
+    that has (or had opened in this process) at least one shard.
+    """
+    path = path.rstrip("/")
+    if not path.endswith(STORE_SUFFIX):
+        return False
+    if os.path.normpath(path) in _STORES:
+        return True
+    shards = glob(f"{escape(path)}/shard-*.idx") + glob(f"{escape(path)}/shard-*.tar")
+    return len(shards) > 0
+
+
+def is_new_store(path):
+    """
+    Returns True if a store can be made at path, which must be missing or an empty
+    directory.
+    """
+    if not os.path.exists(path):
+        return True
+    if not os.path.isdir(path):
+        return False
+    with os.scandir(path) as entries:
+        return next(entries, None) is None
+
+
+def make_store(path):
+    """
+    Makes a new Archive_store at path, with an empty first shard so that the directory
+    is recognised as a store (see is_store) even before any files are added.
+    """
+    os.makedirs(path, exist_ok=True)
+    tar_fd = os.open(f"{path}/shard-00000.tar", os.O_WRONLY | os.O_CREAT)
+    os.close(tar_fd)
+    open(f"{path}/shard-00000.idx", "ab").close()
+
+
+_STORES = dict()
+
+
+def get_store(store_path):
+    """
+    Returns the Archive_store at store_path. Each store is only opened once per
+    process, and is closed when the process exits.
+    """
+    store_path = os.path.normpath(store_path)
+    store = _STORES.get(store_path)
+    if store is None:
+        store = Archive_store(store_path)
+        _STORES[store_path] = store
+    return store
+
+
+@atexit.register
+def close_stores():
+    """
+    Closes every store opened with get_store.
+    """
+    for store in _STORES.values():
+        store.close()
+    _STORES.clear()
+
+
+def list_store_paths(store_path, suffixes=None):
+    """
+    Returns the path of every file in the store (optionally, only those ending in one
+    of the suffixes), in the order they are stored.
+    """
+    store_path = store_path.rstrip("/")
+    names = get_store(store_path).files()
+    if suffixes is not None:
+        names = [name for name in names if name.endswith(suffixes)]
+    return [f"{store_path}/{name}" for name in names]
+
+
+def open_store_file(path, mode="r"):
+    """
+    Opens a file in an Archive_store in text mode. Files ending in .gz are
+    decompressed when read, and compressed when written. Files are added to the store
+    when the file object that is written to is closed.
+    """
+    store_path, name = split_store_path(path, mode)
+    store = get_store(store_path)
+    if mode == "r":
+        data = store.read(name)
+        if name.endswith(".gz"):
+            data = gzip.decompress(data)
+        return io.StringIO(data.decode())
+    if mode == "w":
+        return Store_file(store, name)
+    msg = f"Files in a store can only be opened with mode r or w, not {mode}."
+    raise ValueError(msg)
+
+
+def read_bytes(path):
+    """
+    Returns the contents of the file at path, which can be in an Archive_store.
+    """
+    if split_store_path(path) is not None:
+        store_path, name = split_store_path(path)
+        return get_store(store_path).read(name)
+    with open(path, "rb") as infile:
+        return infile.read()
+
+
+def write_bytes(path, data):
+    """
+    Writes data to path, which can be in an Archive_store.
+    """
+    if split_store_path(path, "w") is not None:
+        store_path, name = split_store_path(path, "w")
+        get_store(store_path).add(name, data)
+        return
+    with open(path, "wb") as outfile:
+        outfile.write(data)
+
+
+def path_exists(path):
+    """
+    os.path.exists, but also checks for files in an Archive_store.
+    """
+    if split_store_path(path) is not None:
+        store_path, name = split_store_path(path)
+        return name in get_store(store_path)
+    return os.path.exists(path)
+
+
+if __name__ == "__main__":
+    msg = "This script has utilities and functions. Don't call it directly!"
+    raise ValueError(msg)
@@ -1,25 +1,63 @@
-from Bio.PDB import PDBParser, PDBIO, Select, Selection, NeighborSearch
+from Bio.PDB import PDBParser, MMCIFParser, PDBIO, Select, Selection, NeighborSearch
 from Bio.PDB.Structure import Structure
 from Bio.PDB.Model import Model
 from Bio.PDB.Chain import Chain
 from Bio.SeqUtils import seq1
+import numpy as np
+
+from .misc import open_file
+from .store import split_store_path
+
+
+# The fixed-width formats of ATOM/HETATM and TER lines, the same as those written by
+# Bio.PDB.PDBIO
+ATOM_FORMAT_STRING = "%s%5i %-4s%c%3s %c%4i%c   %8.3f%8.3f%8.3f%s%s      %4s%2s%2s\n"
+TER_FORMAT_STRING = (
+    "TER   %5i      %3s %c%4i%c                                                      \n"
+)
+
+
+def is_mmcif(structure_file_path):
+    """
+    Returns True if the structure file is in mmCIF format (ends in .cif or .cif.gz).
+    """
+    return structure_file_path.endswith((".cif", ".cif.gz"))
 
 
 def pdb_to_structure_object(pdb_file_path, structure_name="structure"):
     """
     Given the path to a pdb file and the name of the structure, returns a biopython
-    structure object.
+    structure object. Files ending in .cif are read as mmCIF, and files ending in .gz
+    are decompressed while they are read.
     """
-    parser = PDBParser()
-    structure = parser.get_structure(structure_name, pdb_file_path)
+    if is_mmcif(pdb_file_path):
+        parser = MMCIFParser()
+    else:
+        parser = PDBParser()
+    with open_file(pdb_file_path) as infile:
+        structure = parser.get_structure(structure_name, infile)
     return structure
 
 
+def pdb_to_residue_table(pdb_file_path):
+    """
+    Given the path to a pdb file, returns a Residue_table. This is much faster than
+    pdb_to_structure_object, and can be used in its place when only the residues,
+    sequence, or pLDDTs of a structure are needed. As with pdb_to_structure_object,
+    the file can be gzipped and/or in mmCIF format.
+    """
+    residue_table = Residue_table()
+    residue_table.parse_pdb(pdb_file_path)
+    return residue_table
+
+
 def struc_to_seq(structure):
     """
-    Takes in a biopython structure object and returns the amino acid sequence as a
-    string.
+    Takes in a biopython structure object (or a Residue_table) and returns the amino
+    acid sequence as a string.
     """
+    if isinstance(structure, Residue_table):
+        return structure.get_seq()
 
     chains = {
         chain.id: seq1("".join(residue.resname for residue in chain))
@@ -39,7 +77,7 @@ def struc_to_seq(structure):
 
 def structure_to_pLDDT(structure, format="d"):
     """
-    Takes in a biopython structure object and returns pLDDT.
+    Takes in a biopython structure object (or a Residue_table) and returns pLDDT.
 
     If format is specified as 'd', will return a dictionary of structure pos:pLDDT,
     where pos is the 1-indexed residue position.
@@ -51,6 +89,9 @@ def structure_to_pLDDT(structure, format="d"):
         msg = f"The 'format' parameter must be 'd' or 'l'. Received {format}."
         raise ValueError(msg)
 
+    if isinstance(structure, Residue_table):
+        return structure.get_pLDDT(format)
+
     def get_bfactor_from_residue(residue):
         for atom in residue:
             return atom.get_bfactor()
@@ -73,9 +114,17 @@ def structure_to_pLDDT(structure, format="d"):
 
 
 def write_structure_to_pdb(structure, path):
+    """
+    Writes the biopython structure object to path in pdb format. If path ends with
+    .gz, the file is gzipped. path can be a file in an Archive_store.
+    """
     io = PDBIO()
     io.set_structure(structure)
-    io.save(path)
+    if not path.endswith(".gz") and split_store_path(path, "w") is None:
+        io.save(path)
+        return
+    with open_file(path, "w") as outfile:
+        io.save(outfile)
 
 
 def write_structure_subset(structure, residues_to_keep, outfile):
@@ -101,6 +150,199 @@ def write_structure_subset(structure, residues_to_keep, outfile):
     io.save(outfile, ResSelect())
 
 
+def format_bfactor(bfactor):
+    """
+    Returns the B-factor as the 6 characters of its pdb column. As in PDBIO, values
+    that don't fit with two decimals are written with fewer, and values that don't fit
+    at all are capped at 999999.
+    """
+    if bfactor < 1000 and len(f"{bfactor:.2f}") <= 6:
+        return f"{bfactor:6.2f}"
+    if bfactor < 10000 and len(f"{bfactor:.1f}") <= 6:
+        return f"{bfactor:6.1f}"
+    if bfactor < 10000:
+        return f"{bfactor:6.0f}"
+    return f"{min(int(bfactor), 999999):6d}"
+
+
+def format_atom_line(atom, hetfield, segid, atom_number, resname, resseq, icode, chain):
+    """
+    Returns the ATOM (or HETATM, if the residue has a hetfield) line of the atom, in
+    the fixed-width pdb format written by PDBIO.
+    """
+    record_type = "ATOM  " if hetfield == " " else "HETATM"
+
+    if atom.element:
+        element = atom.element.strip().upper().rjust(2)
+    else:
+        element = "  "
+
+    # Names of single-letter elements are padded, unless they are 4 characters long or
+    # start with a number
+    name = atom.fullname.strip()
+    if len(name) < 4 and name[:1].isalpha() and len(element.strip()) < 2:
+        name = " " + name
+
+    if atom.occupancy is None:
+        occupancy = " " * 6
+    else:
+        occupancy = f"{atom.occupancy:6.2f}"
+
+    x, y, z = atom.coord
+    return ATOM_FORMAT_STRING % (
+        record_type,
+        atom_number,
+        name,
+        atom.altloc,
+        resname,
+        chain,
+        resseq,
+        icode,
+        x,
+        y,
+        z,
+        occupancy,
+        format_bfactor(atom.bfactor),
+        segid,
+        element,
+        "  ",
+    )
+
+
+def get_structure_subsets_lines(structure, residue_sets, model_records=True):
+    """
+    Returns the pdb lines (without the final END line) of several subsets of the
+    structure, in a single traversal of the structure. residue_sets is a list, where
+    each item is an iterable of the 1-indexed positions of the residues of one subset.
+    The lines of each subset are the same as write_structure_subset would write.
+
+    Rather than every residue being checked against every subset, each residue is
+    looked up once, and each of its atom lines is formatted once and then given the
+    atom number of each subset it is written to.
+
+    If model_records is False, MODEL/ENDMDL lines are not written even if the
+    structure has more than one model.
+    """
+    # Residue number : indices of the subsets that contain the residue
+    residue_to_subsets = dict()
+    for i, residues in enumerate(residue_sets):
+        for residue_number in residues:
+            residue_to_subsets.setdefault(residue_number, []).append(i)
+
+    n_subsets = len(residue_sets)
+    lines = [[] for _ in range(n_subsets)]
+    model_flag = model_records and len(structure) > 1
+
+    for model in structure.get_list():
+        # Atom numbers restart at 1 for each model, as in PDBIO
+        atom_numbers = [1] * n_subsets
+        model_written = [False] * n_subsets
+        if model_flag:
+            for subset_lines in lines:
+                subset_lines.append(f"MODEL      {model.serial_num}\n")
+
+        for chain in model.get_list():
+            chain_id = chain.id
+            if len(chain_id) > 1:
+                msg = f"Chain id ('{chain_id}') exceeds PDB format limit."
+                raise ValueError(msg)
+
+            # The last residue of the chain in each subset, for its TER line
+            chain_written = [False] * n_subsets
+            last_residues = [None] * n_subsets
+
+            for residue in chain.get_unpacked_list():
+                hetfield, resseq, icode = residue.id
+                subsets = residue_to_subsets.get(resseq)
+                if subsets is None:
+                    continue
+                if resseq > 9999:
+                    msg = f"Residue number ('{resseq}') exceeds PDB format limit."
+                    raise ValueError(msg)
+
+                # Atom lines with a placeholder atom number
+                atom_lines = [
+                    format_atom_line(
+                        atom,
+                        hetfield,
+                        residue.segid,
+                        0,
+                        residue.resname,
+                        resseq,
+                        icode,
+                        chain_id,
+                    )
+                    for atom in residue.get_unpacked_list()
+                ]
+                for i in subsets:
+                    last_residues[i] = residue
+                    for line in atom_lines:
+                        if atom_numbers[i] > 99999:
+                            msg = f"Atom serial number ('{atom_numbers[i]}') exceeds"
+                            msg += " PDB format limit."
+                            raise ValueError(msg)
+                        # The atom number is in columns 7-11
+                        lines[i].append(f"{line[:6]}{atom_numbers[i]:5d}{line[11:]}")
+                        atom_numbers[i] += 1
+                        chain_written[i] = True
+                        model_written[i] = True
+
+            for i in range(n_subsets):
+                if chain_written[i]:
+                    residue = last_residues[i]
+                    _, resseq, icode = residue.id
+                    lines[i].append(
+                        TER_FORMAT_STRING
+                        % (atom_numbers[i], residue.resname, chain_id, resseq, icode)
+                    )
+
+        if model_flag:
+            for i in range(n_subsets):
+                if model_written[i]:
+                    lines[i].append("ENDMDL\n")
+
+    return lines
+
+
+def write_structure_subsets(structure, residue_sets, outfiles):
+    """
+    Writes several subsets of the structure to pdb files, with a single traversal of
+    the structure. residue_sets is a list, where each item is an iterable of the
+    1-indexed positions of the residues to keep, and outfiles is a list with the path
+    each subset is written to. Each file is the same as the one write_structure_subset
+    would write.
+    """
+    if len(residue_sets) != len(outfiles):
+        msg = "residue_sets and outfiles must have the same length!"
+        raise ValueError(msg)
+
+    lines = get_structure_subsets_lines(structure, residue_sets)
+    for subset_lines, outfile in zip(lines, outfiles):
+        with open_file(outfile, "w") as out:
+            out.writelines(subset_lines)
+            out.write("END   \n")
+
+
+def write_structure_subsets_as_models(structure, residue_sets, outfile):
+    """
+    Writes several subsets of the structure to a single pdb file, where each subset is
+    a model. The models are numbered from 1 in the order of residue_sets, which is a
+    list where each item is an iterable of the 1-indexed positions of the residues to
+    keep. The structure must have a single model.
+    """
+    if len(structure) > 1:
+        msg = "Can only write subsets as models for structures with a single model."
+        raise ValueError(msg)
+
+    lines = get_structure_subsets_lines(structure, residue_sets)
+    with open_file(outfile, "w") as out:
+        for i, subset_lines in enumerate(lines, start=1):
+            out.write(f"MODEL      {i}\n")
+            out.writelines(subset_lines)
+            out.write("ENDMDL\n")
+        out.write("END   \n")
+
+
 def struc_rebase(structure):
     """
     Input is a biopython structure object. This function renumbers all residues such
@@ -171,6 +413,223 @@ def extract_chains(structure, chains):
     return new_structure
 
 
+class Residue_table:
+    """
+    A lightweight, read-only view of the residues of a structure. Rather than building
+    biopython's full Structure/Model/Chain/Residue/Atom object tree, parse_pdb scans
+    the ATOM and HETATM records of a pdb file with fixed-width slicing and keeps one
+    entry per residue:
+    - model_ids: numpy array of the (0-indexed) model of each residue
+    - chain_ids: list of the chain ID of each residue
+    - residue_names: list of the three-letter name of each residue
+    - residue_numbers: numpy array of the residue number (resseq) of each residue
+    - pLDDTs: numpy array of the B-factor of the first atom of each residue, which
+      holds the pLDDT in predicted structures
+    - ca_coords: numpy array of shape (n_residues, 3) with the CA coordinates of each
+      residue, or NaN if a residue doesn't have a CA atom
+
+    Residues are in the same order as biopython's structure.get_residues(), and
+    struc_to_seq and structure_to_pLDDT give the same results for a Residue_table as
+    for the biopython structure. Files with alternate locations (altlocs) are read with
+    biopython instead, as it picks which alternate atom to keep, as are files with a
+    blank occupancy or B-factor column. mmCIF files are also read with biopython.
+    """
+
+    def parse_pdb(self, pdb_file_path):
+        """
+        Given the path to a pdb file, fills the Residue_table with its residues. The
+        file can be gzipped (ending in .gz) or in mmCIF format (ending in .cif).
+        """
+        if is_mmcif(pdb_file_path):
+            self.add_structure(pdb_to_structure_object(pdb_file_path))
+            return
+
+        with open_file(pdb_file_path) as infile:
+            lines = infile.readlines()
+
+        # Residues are grouped by model and chain, in the order each (model, chain)
+        # first appears. This matches biopython, which adds residues to an existing
+        # chain if the chain ID shows up again.
+        group_order = dict()
+        residue_groups = []
+        residue_index = dict()
+        model_ids = []
+        chain_ids = []
+        residue_names = []
+        residue_numbers = []
+        pLDDTs = []
+        ca_coords = []
+
+        model = 0
+        model_open = False
+        for line in lines:
+            record_type = line[0:6]
+            if record_type == "MODEL ":
+                if model_open:
+                    model += 1
+                model_open = True
+                continue
+            if record_type == "ENDMDL":
+                model += 1
+                model_open = False
+                continue
+            if record_type != "ATOM  " and record_type != "HETATM":
+                continue
+
+            # biopython decides how to handle altlocs and blank occupancies/B-factors
+            if (
+                line[16] != " "
+                or line[54:60].strip() == ""
+                or line[60:66].strip() == ""
+            ):
+                self.add_structure(pdb_to_structure_object(pdb_file_path))
+                return
+
+            resname = line[17:20].strip()
+            chain_id = line[21]
+            if record_type == "HETATM":
+                if resname == "HOH" or resname == "WAT":
+                    hetero_flag = "W"
+                else:
+                    hetero_flag = "H_" + resname
+            else:
+                hetero_flag = " "
+            resseq = int(line[22:26].split()[0])
+            residue_id = (model, chain_id, hetero_flag, resseq, line[26])
+
+            i = residue_index.get(residue_id)
+            if i is None:
+                i = len(residue_index)
+                residue_index[residue_id] = i
+                group = group_order.setdefault((model, chain_id), len(group_order))
+                residue_groups.append(group)
+                model_ids.append(model)
+                chain_ids.append(chain_id)
+                residue_names.append(resname)
+                residue_numbers.append(resseq)
+                pLDDTs.append(float(line[60:66]))
+                ca_coords.append((np.nan, np.nan, np.nan))
+
+            if line[12:16].strip() == "CA" and np.isnan(ca_coords[i][0]):
+                ca_coords[i] = (
+                    float(line[30:38]),
+                    float(line[38:46]),
+                    float(line[46:54]),
+                )
+
+        self._set_residues(
+            residue_groups,
+            model_ids,
+            chain_ids,
+            residue_names,
+            residue_numbers,
+            pLDDTs,
+            ca_coords,
+        )
+
+    def add_structure(self, structure):
+        """
+        Fills the Residue_table with the residues of a biopython structure object.
+        """
+        model_ids = []
+        chain_ids = []
+        residue_names = []
+        residue_numbers = []
+        pLDDTs = []
+        ca_coords = []
+        models = [model.id for model in structure]
+        for residue in structure.get_residues():
+            chain = residue.get_parent()
+            model_ids.append(models.index(chain.get_parent().id))
+            chain_ids.append(chain.id)
+            residue_names.append(residue.resname)
+            residue_numbers.append(residue.id[1])
+            for atom in residue:
+                pLDDTs.append(atom.get_bfactor())
+                break
+            if "CA" in residue:
+                ca_coords.append(tuple(residue["CA"].coord))
+            else:
+                ca_coords.append((np.nan, np.nan, np.nan))
+
+        residue_groups = [0] * len(chain_ids)
+        self._set_residues(
+            residue_groups,
+            model_ids,
+            chain_ids,
+            residue_names,
+            residue_numbers,
+            pLDDTs,
+            ca_coords,
+        )
+
+    def _set_residues(
+        self,
+        residue_groups,
+        model_ids,
+        chain_ids,
+        residue_names,
+        residue_numbers,
+        pLDDTs,
+        ca_coords,
+    ):
+        """
+        Sets the slots, ordering the residues by their (model, chain) group.
+        """
+        order = np.argsort(np.asarray(residue_groups, dtype=int), kind="stable")
+        order = order.tolist()
+        self.model_ids = np.asarray(model_ids, dtype=int)[order]
+        self.chain_ids = [chain_ids[i] for i in order]
+        self.residue_names = [residue_names[i] for i in order]
+        self.residue_numbers = np.asarray(residue_numbers, dtype=int)[order]
+        self.pLDDTs = np.asarray(pLDDTs, dtype=float)[order]
+        self.ca_coords = np.asarray(ca_coords, dtype=float).reshape(-1, 3)[order]
+
+    def __len__(self):
+        return len(self.residue_names)
+
+    def get_seq(self):
+        """
+        Returns the amino acid sequence as a string. As with struc_to_seq, the
+        structure must have a single chain.
+        """
+        # As with struc_to_seq, a chain in a later model replaces the same chain of an
+        # earlier model
+        chains = dict()
+        chain_models = dict()
+        for model, chain_id, resname in zip(
+            self.model_ids.tolist(), self.chain_ids, self.residue_names
+        ):
+            if chain_models.get(chain_id) != model:
+                chain_models[chain_id] = model
+                chains[chain_id] = []
+            chains[chain_id].append(resname)
+
+        if len(chains) > 1:
+            msg = (
+                "This function is designed for AF2 or Colabfold-generated structures "
+                "with a single chain. The input has multiple chains!"
+            )
+            raise ValueError(msg)
+
+        for chain, resnames in chains.items():
+            return seq1("".join(resnames))
+
+    def get_pLDDT(self, format="d"):
+        """
+        Returns the pLDDTs in the same formats as structure_to_pLDDT.
+        """
+        if format not in set(["l", "d"]):
+            msg = f"The 'format' parameter must be 'd' or 'l'. Received {format}."
+            raise ValueError(msg)
+
+        pLDDTs = dict(zip(self.residue_numbers.tolist(), self.pLDDTs.tolist()))
+        if format == "d":
+            return pLDDTs
+        elif format == "l":
+            return list(pLDDTs.values())
+
+
 if __name__ == "__main__":
     msg = "This script has utilities and functions. Don't call it directly!"
     raise ValueError(msg)
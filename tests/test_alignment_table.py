@@ -0,0 +1,90 @@
+import numpy as np
+
+from sat.scripts.utils.Alignment_table import Alignment_table
+from sat.scripts.utils.Foldseek_Dataset import Foldseek_Dataset
+
+
+def test_alignment_table_matches_foldseek_dataset():
+    path = "tests/test_data/foldseek_related/rep_out.m8"
+
+    expected = Foldseek_Dataset()
+    expected.parse_alignment(path)
+
+    observed = Alignment_table()
+    observed.parse_alignment(path)
+
+    assert observed.input_alignment_fields == expected.input_alignment_fields
+    assert observed.count_alignments() == expected.count_alignments()
+    assert list(observed.alignment_groups) == list(expected.alignment_groups)
+
+    for query, expected_group in expected.alignment_groups.items():
+        observed_group = observed.alignment_groups[query]
+        assert observed_group.query == query
+        assert len(observed_group.alignments) == len(expected_group.alignments)
+        for o, e in zip(observed_group.alignments, expected_group.alignments):
+            assert o.target == e.target
+            assert o.cluster_rep == e.cluster_rep
+            assert o.qstart == int(e.qstart)
+            assert o.evalue == float(e.evalue)
+            assert o.alntmscore == float(e.alntmscore)
+
+
+def test_alignment_table_groups_noncontiguous_queries(tmp_path):
+    path = f"{tmp_path}/aln.m8"
+    with open(path, "w") as outfile:
+        outfile.write("a\tx\t0.5\t1.0E-10\n")
+        outfile.write("b\ty\t0.6\t2.0E-10\n")
+        outfile.write("a\tz\t0.7\t3.0E-10\n")
+
+    table = Alignment_table()
+    table.parse_alignment(path, "query,target,alntmscore,evalue")
+
+    assert list(table.alignment_groups.keys()) == ["a", "b"]
+    assert table.group_offsets.tolist() == [0, 2, 3]
+    assert table.get_column("target").tolist() == ["x", "z", "y"]
+    assert table.get_column("alntmscore").tolist() == [0.5, 0.7, 0.6]
+
+    targets = [a.target for a in table.alignment_groups["a"].alignments]
+    assert targets == ["x", "z"]
+    assert "c" not in table.alignment_groups
+
+
+def test_alignment_table_subset():
+    table = Alignment_table()
+    table.parse_alignment("tests/test_data/foldseek_related/rep_out.m8")
+
+    mask = (table.columns["alntmscore"] >= 0.5) & (table.columns["evalue"] <= 1e-5)
+    subset = table.subset(mask)
+
+    assert len(subset) == np.sum(mask)
+    assert np.all(subset.columns["alntmscore"] >= 0.5)
+    for query, alignment_group in subset.alignment_groups.items():
+        assert len(alignment_group.alignments) > 0
+        for alignment in alignment_group.alignments:
+            assert alignment.query == query
+            assert alignment.alntmscore >= 0.5
+
+
+def test_alignment_table_filter_and_top_N():
+    path = "tests/test_data/foldseek_related/rep_out.m8"
+    table = Alignment_table()
+    table.parse_alignment(path)
+    table = table.filter("evalue<=1e-3,alntmscore>0.3")
+    table = table.keep_top_N_alignments("alntmscore", 2)
+
+    expected = Foldseek_Dataset()
+    expected.parse_alignment(path)
+    n_expected = 0
+    for query, aln_group in expected.alignment_groups.items():
+        aln_group.filter_by_predicates(
+            [("evalue", "<=", 1e-3), ("alntmscore", ">", 0.3)]
+        )
+        aln_group.keep_top_N_alignments("alntmscore", 2)
+        if aln_group.alignments == []:
+            assert query not in table.alignment_groups
+            continue
+        n_expected += len(aln_group.alignments)
+        observed = table.alignment_groups[query].alignments
+        assert [a.target for a in observed] == [a.target for a in aln_group.alignments]
+
+    assert len(table) == n_expected
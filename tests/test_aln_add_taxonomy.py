@@ -17,6 +17,8 @@ def test_aln_add_taxonomy_main(tmp_path):
     args.taxonID_finder_delimiter = "__"
     args.taxonID_finder_pos = -1
     args.taxonomy_levels = "superkingdom,phylum,class,order,family,genus,species"
+    args.lineage_cache = f"{tmp_path}/lineage_cache.sqlite"
+    args.taxonomy_database = ""
 
     # Run program
     aln_add_taxonomy_main(args)
@@ -0,0 +1,39 @@
+from sat.scripts.aln_cluster import aln_cluster_main
+
+
+def read_cluster_lines(cluster_file):
+    """
+    Returns the header and the sorted cluster lines, as the order of members in a
+    cluster isn't fixed.
+    """
+    with open(cluster_file) as infile:
+        header = infile.readline()
+        return header, sorted(infile)
+
+
+def test_aln_cluster_main(tmp_path):
+    all_inputs = f"{tmp_path}/all_inputs.txt"
+    with open("tests/test_data/foldseek_related/clusters.tsv") as infile, open(
+        all_inputs, "w"
+    ) as outfile:
+        for line in infile:
+            outfile.write(line.rstrip("\n").split("\t")[1] + "\n")
+
+    class args:
+        pass
+
+    args.alignment_file = "tests/test_data/foldseek_related/clusters_alignment.m8"
+    args.alignment_fields = (
+        "query,target,fident,alnlen,mismatch,gapopen,qstart,qend,tstart,tend,"
+        "evalue,bits,alntmscore"
+    )
+    args.all_inputs = all_inputs
+    args.outfile = f"{tmp_path}/clusters.tsv"
+    aln_cluster_main(args)
+
+    # Expected output is from the original implementation, which merged a list of sets
+    observed = read_cluster_lines(args.outfile)
+    expected = read_cluster_lines(
+        "tests/test_data/foldseek_related/aln_cluster_clusters.tsv"
+    )
+    assert observed == expected
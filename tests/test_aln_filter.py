@@ -1,4 +1,13 @@
-from sat.scripts.utils.alignments import Alignment_group, Alignment_object
+import gzip
+import os
+
+import pytest
+
+from sat.scripts.utils.alignments import (
+    Alignment_group,
+    Alignment_object,
+    parse_filter_predicates,
+)
 from sat.scripts.aln_filter import aln_filter_main
 from sat.scripts.utils.Foldseek_Dataset import Foldseek_Dataset
 
@@ -53,6 +62,9 @@ def test_aln_filter_script(tmp_path):
     args.filter_field = "alntmscore"
     args.min_val_filter_field = 0.4
     args.max_val_filter_field = 1
+    args.streaming = False
+    args.columnar = False
+    args.filters = ""
 
     # Run script
     aln_filter_main(args)
@@ -81,3 +93,185 @@ def test_aln_filter_script(tmp_path):
         assert len(alignment_group.alignments) <= args.N
         for aln in alignment_group.alignments:
             assert float(aln.alntmscore) >= args.min_val_filter_field
+
+
+def test_aln_filter_streaming_gzip(tmp_path):
+    class args:
+        pass
+
+    args.alignment_file = (
+        "tests/test_data/foldseek_related/top_query_per_cluster_tax.m8"
+    )
+    args.alignment_fields = ""
+    args.N = 10
+    args.filter_field = "alntmscore"
+    args.min_val_filter_field = 0.4
+    args.max_val_filter_field = 1
+    args.columnar = False
+    args.filters = ""
+
+    args.output_file = f"{tmp_path}/expected.m8"
+    args.streaming = False
+    aln_filter_main(args)
+
+    # Stream a gzipped copy of the input to gzipped output
+    gz_input = f"{tmp_path}/input.m8.gz"
+    with open(args.alignment_file, "rb") as infile, gzip.open(gz_input, "wb") as out:
+        out.write(infile.read())
+
+    args.alignment_file = gz_input
+    args.output_file = f"{tmp_path}/observed.m8.gz"
+    args.streaming = True
+    aln_filter_main(args)
+
+    with open(f"{tmp_path}/expected.m8") as expected, gzip.open(
+        args.output_file, "rt"
+    ) as observed:
+        assert expected.read() == observed.read()
+
+
+def test_aln_filter_streaming_stdout(tmp_path, capsys):
+    class args:
+        pass
+
+    args.alignment_file = (
+        "tests/test_data/foldseek_related/top_query_per_cluster_tax.m8"
+    )
+    args.output_file = "-"
+    args.alignment_fields = ""
+    args.N = 1
+    args.filter_field = "alntmscore"
+    args.min_val_filter_field = 0.5
+    args.max_val_filter_field = 1
+    args.streaming = True
+    args.columnar = False
+    args.filters = ""
+    aln_filter_main(args)
+
+    lines = capsys.readouterr().out.rstrip("\n").split("\n")
+    assert lines[0].startswith("query\ttarget")
+    queries = [line.split("\t")[0] for line in lines[1:]]
+    assert len(queries) == len(set(queries))
+
+
+def test_aln_filter_streaming_bad_header(tmp_path):
+    class args:
+        pass
+
+    # This file has no header, so alignment_fields must be passed
+    args.alignment_file = "tests/test_data/foldseek_related/clusters_alignment.m8"
+    args.output_file = f"{tmp_path}/observed.m8"
+    args.alignment_fields = ""
+    args.N = 1
+    args.filter_field = "alntmscore"
+    args.min_val_filter_field = 0.5
+    args.max_val_filter_field = 1
+    args.streaming = True
+    args.columnar = False
+    args.filters = ""
+    with pytest.raises(ValueError):
+        aln_filter_main(args)
+    assert not os.path.exists(args.output_file)
+
+
+def test_parse_filter_predicates():
+    observed = parse_filter_predicates("evalue<=1e-3, alntmscore >=0.5,qstart>10")
+    expected = [("evalue", "<=", 0.001), ("alntmscore", ">=", 0.5), ("qstart", ">", 10)]
+    assert observed == expected
+
+    with pytest.raises(ValueError):
+        parse_filter_predicates("evalue=<1e-3")
+    with pytest.raises(ValueError):
+        parse_filter_predicates("evalue<=low")
+
+
+def test_filter_by_predicates():
+    fields = ["query", "alntmscore", "evalue"]
+    aln_group = Alignment_group("query")
+    aln_group.alignments = [
+        Alignment_object(["q1", "0.42", "1.0E-10"], fields),
+        Alignment_object(["q2", "0.62", "1.0E-02"], fields),
+        Alignment_object(["q3", "0.60", "1.0E-05"], fields),
+    ]
+
+    aln_group.filter_by_predicates(
+        parse_filter_predicates("alntmscore>=0.5,evalue<=1e-3")
+    )
+    assert [aln.query for aln in aln_group.alignments] == ["q3"]
+    assert aln_group.alignments[0].evalue == 1e-5
+
+
+@pytest.mark.parametrize(
+    "streaming,columnar", [(False, False), (True, False), (False, True)]
+)
+def test_aln_filter_modes_agree(tmp_path, streaming, columnar):
+    class args:
+        pass
+
+    args.alignment_file = "tests/test_data/foldseek_related/rep_out.m8"
+    args.alignment_fields = ""
+    args.N = 3
+    args.filter_field = "alntmscore"
+    args.min_val_filter_field = 0.3
+    args.max_val_filter_field = 1
+    args.filters = "evalue<=1e-2,alnlen>=40"
+    args.streaming = streaming
+    args.columnar = columnar
+    args.output_file = f"{tmp_path}/observed.m8"
+    aln_filter_main(args)
+
+    # Compare against alignment groups filtered directly
+    expected = Foldseek_Dataset()
+    expected.parse_alignment(args.alignment_file)
+    predicates = parse_filter_predicates("evalue<=1e-2,alnlen>=40")
+    expected_rows = []
+    for aln_group in expected.alignment_groups.values():
+        aln_group.aln_filter("alntmscore", 1, 0.3)
+        aln_group.filter_by_predicates(predicates)
+        aln_group.keep_top_N_alignments("alntmscore", 3)
+        for aln in aln_group.alignments:
+            expected_rows.append((aln.query, aln.target, aln.alntmscore, aln.evalue))
+
+    observed = Foldseek_Dataset()
+    observed.parse_alignment(args.output_file)
+    observed_rows = []
+    for aln_group in observed.alignment_groups.values():
+        for aln in aln_group.alignments:
+            observed_rows.append(
+                (aln.query, aln.target, float(aln.alntmscore), float(aln.evalue))
+            )
+
+    assert len(expected_rows) > 0
+    assert observed_rows == expected_rows
+
+
+def test_aln_filter_columnar_N_0(tmp_path):
+    # With N=0 no alignments are sorted, so both modes keep the file order
+    outputs = []
+    for columnar in [False, True]:
+
+        class args:
+            pass
+
+        args.alignment_file = "tests/test_data/foldseek_related/rep_out.m8"
+        args.alignment_fields = ""
+        args.N = 0
+        args.filter_field = "alntmscore"
+        args.min_val_filter_field = 0
+        args.max_val_filter_field = 1
+        args.filters = ""
+        args.streaming = False
+        args.columnar = columnar
+        args.output_file = f"{tmp_path}/observed_{columnar}.m8"
+        aln_filter_main(args)
+
+        observed = Foldseek_Dataset()
+        observed.parse_alignment(args.output_file)
+        rows = []
+        for aln_group in observed.alignment_groups.values():
+            for aln in aln_group.alignments:
+                rows.append((aln.query, aln.target, float(aln.alntmscore)))
+        outputs.append(rows)
+
+    assert len(outputs[0]) > 0
+    assert outputs[1] == outputs[0]
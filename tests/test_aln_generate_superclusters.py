@@ -6,9 +6,13 @@ from sat.scripts.utils.Foldseek_Dataset import (
 
 from sat.scripts.aln_generate_superclusters import (
     get_percentage_of_members_with_alignments,
+    get_cluster_linkages,
+    get_alignment_dict,
+    get_superclusters,
     Super_cluster,
     all_are_linked,
 )
+from sat.scripts.utils.clusters import Cluster_information
 
 
 def test_get_percentage_of_members_with_alignments__all_align():
@@ -95,6 +99,76 @@ def test_get_percentage_of_members_with_alignments__half_align():
     assert observed == expected
 
 
+def pairwise_cluster_linkages(cluster_dict, alignment_dict, linkage_threshold):
+    """
+    Reference implementation that compares every pair of clusters.
+    """
+    cluster_linkages = {rep: set() for rep in cluster_dict}
+    for rep1, members1 in cluster_dict.items():
+        for rep2, members2 in cluster_dict.items():
+            c1_p = get_percentage_of_members_with_alignments(
+                members1, members2, alignment_dict
+            )
+            c2_p = get_percentage_of_members_with_alignments(
+                members2, members1, alignment_dict
+            )
+            if c1_p >= linkage_threshold or c2_p >= linkage_threshold:
+                cluster_linkages[rep1].add(rep2)
+                cluster_linkages[rep2].add(rep1)
+    return cluster_linkages
+
+
+def test_get_cluster_linkages__toy():
+    cluster_dict = {
+        "a": set(["a", "b"]),
+        "c": set(["c", "d", "e"]),
+        "f": set(["f"]),
+    }
+    alignment_dict = {
+        "a": set(["c", "z"]),
+        "b": set(["b"]),
+        "d": set(["f"]),
+    }
+
+    observed = get_cluster_linkages(cluster_dict, alignment_dict, 0.5)
+    expected = {
+        "a": set(["a", "c"]),
+        "c": set(["a"]),
+        "f": set(),
+    }
+    assert observed == expected
+    assert list(observed.keys()) == list(cluster_dict.keys())
+
+    observed = get_cluster_linkages(cluster_dict, alignment_dict, 0)
+    assert observed == {rep: set(cluster_dict) for rep in cluster_dict}
+
+
+def test_get_cluster_linkages__matches_pairwise():
+    cluster_info = Cluster_information()
+    cluster_info.parse_cluster_file(
+        "tests/test_data/foldseek_related/clusters.tsv", "cluster_rep,cluster_member"
+    )
+    data = Foldseek_Dataset()
+    data.parse_alignment(
+        "tests/test_data/foldseek_related/clusters_alignment.m8",
+        "query,target,fident,alnlen,mismatch,gapopen,qstart,qend,tstart,tend,"
+        "evalue,bits,alntmscore",
+    )
+    alignment_dict = get_alignment_dict(data)
+
+    for linkage_threshold in [0.1, 0.3, 0.5, 1]:
+        observed = get_cluster_linkages(
+            cluster_info.cluster_rep_to_members,
+            alignment_dict,
+            linkage_threshold,
+            cluster_info.cluster_member_to_rep,
+        )
+        expected = pairwise_cluster_linkages(
+            cluster_info.cluster_rep_to_members, alignment_dict, linkage_threshold
+        )
+        assert observed == expected
+
+
 def test_all_are_linked__all_linked():
     one = set(["a", "b", "c"])
     two = set(["x", "y", "x"])
@@ -111,6 +185,47 @@ def test_all_are_linked__all_linked():
     assert all_are_linked(one, two, cluster_linkages)
 
 
+def test_get_superclusters():
+    # a, b, and c are all linked, but d is only linked to c. e is linked to nothing.
+    cluster_linkages = {
+        "a": set(["a", "b", "c"]),
+        "b": set(["a", "b", "c"]),
+        "c": set(["a", "b", "c", "d"]),
+        "d": set(["c", "d"]),
+        "e": set(),
+    }
+
+    observed = get_superclusters(cluster_linkages)
+    expected = [set(["a", "b", "c"]), set(["d"]), set(["e"])]
+    assert sorted(observed, key=min) == expected
+
+
+def test_get_superclusters__all_are_linked():
+    cluster_info = Cluster_information()
+    cluster_info.parse_cluster_file(
+        "tests/test_data/foldseek_related/clusters.tsv", "cluster_rep,cluster_member"
+    )
+    data = Foldseek_Dataset()
+    data.parse_alignment(
+        "tests/test_data/foldseek_related/clusters_alignment.m8",
+        "query,target,fident,alnlen,mismatch,gapopen,qstart,qend,tstart,tend,"
+        "evalue,bits,alntmscore",
+    )
+    cluster_linkages = get_cluster_linkages(
+        cluster_info.cluster_rep_to_members, get_alignment_dict(data), 0.1
+    )
+
+    superclusters = get_superclusters(cluster_linkages)
+
+    # Every cluster is in exactly one supercluster, and every subcluster in a
+    # supercluster is linked to every other subcluster in it.
+    observed_reps = [rep for sc in superclusters for rep in sc]
+    assert sorted(observed_reps) == sorted(cluster_info.cluster_rep_to_members)
+    for sc in superclusters:
+        for rep in sc:
+            assert all_are_linked(set([rep]), sc - set([rep]), cluster_linkages)
+
+
 # def test_all_are_linked__only_not_reciprocal():
 
 #     one = Super_cluster("a")
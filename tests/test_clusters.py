@@ -0,0 +1,31 @@
+from sat.scripts.utils.clusters import Union_find
+
+
+def test_union_find__clusters():
+    uf = Union_find()
+    uf.union("a", "b")
+    uf.union("c", "d")
+    uf.union("e", "e")
+    uf.union("b", "d")
+    uf.add("f")
+
+    assert uf.find("a") == uf.find("d")
+    assert uf.find("a") != uf.find("e")
+    assert len(uf) == 6
+    assert "f" in uf
+    assert "z" not in uf
+
+    observed = uf.get_clusters()
+    expected = [set(["a", "b", "c", "d"]), set(["e"]), set(["f"])]
+    assert observed == expected
+
+
+def test_union_find__long_chain():
+    uf = Union_find()
+    for i in range(10000):
+        uf.union(i, i + 1)
+
+    observed = uf.get_clusters()
+    assert len(observed) == 1
+    assert observed[0] == set(range(10001))
+    assert uf.size[uf.member_to_id[uf.find(0)]] == 10001
@@ -0,0 +1,54 @@
+from sat.scripts.utils.domains import (
+    cluster_to_indices,
+    get_domain_stats,
+    get_inter_domain_pae,
+    sequential_mean,
+)
+import numpy as np
+
+
+def test_cluster_to_indices():
+    assert list(cluster_to_indices((3, 1, 2))) == [2, 0, 1]
+    assert list(cluster_to_indices((3, 1, 2), offset=0)) == [3, 1, 2]
+
+
+def test_sequential_mean_matches_loop():
+    rng = np.random.default_rng(0)
+    values = rng.uniform(0, 100, 1000)
+    running_sum = 0
+    for val in values.tolist():
+        running_sum += val
+    assert sequential_mean(values) == running_sum / len(values)
+
+
+def test_get_inter_domain_pae():
+    pae_matrix = np.arange(16, dtype=float).reshape(4, 4)
+    domains = [np.array([0, 1]), np.array([2, 3])]
+    expected = np.array([[2.5, 4.5], [10.5, 12.5]])
+    assert np.array_equal(get_inter_domain_pae(domains, pae_matrix), expected)
+
+
+def test_get_domain_stats():
+    pae_matrix = np.array(
+        [
+            [0, 1, 9, 9, 9],
+            [1, 0, 9, 9, 9],
+            [8, 8, 0, 2, 4],
+            [8, 8, 2, 0, 4],
+            [8, 8, 4, 4, 0],
+        ],
+        dtype=float,
+    )
+    plddt_array = [90, 80, 70, 60, 95]
+    domains = [np.array([1, 0]), np.array([2, 3, 4])]
+    stats = get_domain_stats(domains, pae_matrix, plddt_array)
+
+    assert list(stats["length"]) == [2, 3]
+    assert list(stats["start"]) == [1, 3]
+    assert list(stats["end"]) == [2, 5]
+    assert list(stats["mean_plddt"]) == [85, 75]
+    assert list(stats["median_plddt"]) == [85, 70]
+    assert list(stats["min_plddt"]) == [80, 60]
+    assert list(stats["mean_pae"]) == [0.5, 20 / 9]
+    assert list(stats["median_pae"]) == [0.5, 2]
+    assert np.array_equal(stats["inter_domain_pae"], [[0.5, 9], [8, 20 / 9]])
@@ -1,6 +1,15 @@
-from sat.scripts.utils.ete3_taxonomy import taxon_list_to_lineage_counts, Taxon
+from sat.scripts.utils.ete3_taxonomy import (
+    taxon_list_to_lineage_counts,
+    Taxon,
+    Lineage_cache,
+    get_cannonical_lineages,
+    get_ncbi,
+    set_taxonomy_database,
+)
 
 from collections import Counter
+import subprocess
+import sys
 
 import pytest
 
@@ -17,6 +26,89 @@ def test_name_to_taxid_trailing_numbers():
     assert taxon.taxonID == 493803
 
 
+def test_ete3_is_imported_lazily():
+    # Non-taxonomy subcommands shouldn't pay for importing ete3
+    code = "import sys, sat.scripts.aln_filter; print('ete3' in sys.modules)"
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == "False"
+
+
+def test_set_taxonomy_database_after_use():
+    get_ncbi()
+    with pytest.raises(ValueError):
+        set_taxonomy_database("/some/other/taxa.sqlite")
+
+
+def test_get_cannonical_lineages_matches_taxon(capsys):
+    # Known taxonIDs, a merged taxonID (649756), and taxonIDs that can't be found
+    taxonIDs = ["493803", "10566", "9606", "1010", "649756"]
+    taxonIDs += ["324123412421412421", "not_a_taxonID", ""]
+    taxonomy_levels = "superkingdom,phylum,class,order,family,genus,species".split(",")
+
+    observed = get_cannonical_lineages(taxonIDs, taxonomy_levels)
+    not_found = capsys.readouterr().out.splitlines()
+
+    assert set(observed) == set(taxonIDs)
+    for taxonID in taxonIDs:
+        expected = Taxon(taxonID, taxonomy_levels)
+        assert observed[taxonID] == (expected.lineage, expected.canonical_lineage)
+
+    # Each taxonID that can't be found is reported once
+    assert len(not_found) == len(set(not_found))
+    assert "Cannot find taxonID 324123412421412421" in not_found
+    assert "Cannot find taxonID not_a_taxonID" in not_found
+
+
+def test_lineage_cache(tmp_path):
+    taxonomy_levels = "superkingdom,family,genus,species".split(",")
+    cache_path = f"{tmp_path}/lineage_cache.sqlite"
+
+    cache = Lineage_cache(cache_path, taxonomy_levels)
+    assert len(cache) == 0
+    taxon = Taxon("493803", taxonomy_levels, lineage_cache=cache)
+    unknown = Taxon("324123412421412421", taxonomy_levels, lineage_cache=cache)
+    cache.save()
+
+    expected = Taxon("493803", taxonomy_levels)
+    assert taxon.lineage == expected.lineage
+    assert taxon.canonical_lineage == expected.canonical_lineage
+    assert unknown.lineage is None
+    assert unknown.canonical_lineage == ["", "", "", ""]
+
+    # Reopening the cache loads the saved lineages
+    cache = Lineage_cache(cache_path, taxonomy_levels)
+    assert len(cache) == 2
+    assert "493803" in cache
+    assert cache.get(493803) == (expected.lineage, expected.canonical_lineage)
+
+    # Lineages are cached separately for each set of taxonomy levels
+    assert len(Lineage_cache(cache_path, ["superkingdom"])) == 0
+
+    with pytest.raises(ValueError):
+        Taxon("493803", ["superkingdom"], lineage_cache=cache)
+
+
+def test_lineage_cache_in_memory(tmp_path, capsys):
+    taxonomy_levels = "superkingdom,family,genus,species".split(",")
+
+    # Without a cache path, lineages are only cached in memory
+    cache = Lineage_cache("", taxonomy_levels)
+    assert cache.cache_path is None
+    cache.add_taxonIDs(["493803"])
+    cache.save()
+    assert "493803" in cache
+
+    # A cache file that can't be opened falls back to an in-memory cache
+    cache = Lineage_cache(str(tmp_path), taxonomy_levels)
+    assert cache.cache_path is None
+    assert "Cannot use the lineage cache" in capsys.readouterr().out
+    cache.add_taxonIDs(["493803"])
+    cache.save()
+    assert "493803" in cache
+
+
 # @pytest.mark.ete3
 # def test_taxon_list_to_lineage_counts_multi():
 #     taxonIDs = {"2025360", "2200830", "1010"}
@@ -0,0 +1,40 @@
+import functools
+import os
+
+import pytest
+
+from sat.scripts.utils.misc import get_structure_paths, process_map
+
+
+def test_get_structure_paths(tmp_path):
+    for name in ["b.pdb", "a.pdb", "notes.txt"]:
+        with open(f"{tmp_path}/{name}", "w") as outfile:
+            outfile.write("")
+
+    expected = [f"{tmp_path}/a.pdb", f"{tmp_path}/b.pdb"]
+    assert get_structure_paths(str(tmp_path)) == expected
+    assert get_structure_paths(f"{tmp_path}/*.pdb") == expected
+    assert get_structure_paths(f"{tmp_path}/b.pdb") == [f"{tmp_path}/b.pdb"]
+
+    # File lists keep their order
+    with open(f"{tmp_path}/list.txt", "w") as outfile:
+        outfile.write(f"{tmp_path}/b.pdb\n\n{tmp_path}/a.pdb\n")
+    assert get_structure_paths(f"{tmp_path}/list.txt") == expected[::-1]
+
+    with pytest.raises(ValueError):
+        get_structure_paths(f"{tmp_path}/*.cif")
+    with pytest.raises(ValueError):
+        get_structure_paths(f"{tmp_path}/missing.pdb")
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_process_map_keeps_order(workers):
+    items = list(range(50))
+    observed = list(process_map(functools.partial(pow, exp=2), items, workers))
+    assert observed == [i**2 for i in items]
+
+
+def test_process_map_streams_generators():
+    items = (i for i in range(1000))
+    observed = list(process_map(functools.partial(pow, exp=2), items, 2, chunksize=7))
+    assert observed == [i**2 for i in range(1000)]
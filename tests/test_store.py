@@ -0,0 +1,170 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+import tarfile
+
+import pytest
+
+from sat.scripts.utils.misc import get_structure_paths, make_output_dir, open_file
+from sat.scripts.utils.store import (
+    Archive_store,
+    get_store,
+    is_store,
+    path_exists,
+    split_store_path,
+)
+from sat.scripts.utils.structure import (
+    compare_structures,
+    pdb_to_residue_table,
+    pdb_to_structure_object,
+)
+
+
+def add_files(store_path, names):
+    store = Archive_store(store_path)
+    for name in names:
+        store.add(name, f"{name}\n".encode())
+    store.close()
+
+
+def test_split_store_path(tmp_path):
+    store_path = f"{tmp_path}/domains.store"
+    assert split_store_path(f"{store_path}/a.pdb", "w") == (store_path, "a.pdb")
+    assert split_store_path(f"{store_path}/a.pdb") is None
+    assert split_store_path(store_path, "w") is None
+    assert split_store_path(f"{store_path}/", "w") is None
+    assert split_store_path(f"{tmp_path}/domains.storage/a.pdb", "w") is None
+
+    # Once it has shards, the store is also used for reading
+    add_files(store_path, ["a.pdb"])
+    assert split_store_path(f"{store_path}/a.pdb") == (store_path, "a.pdb")
+    assert is_store(store_path)
+    assert not is_store(f"{tmp_path}/empty.store")
+
+    # A new store made as an output directory is a store before any files are added
+    make_output_dir(f"{tmp_path}/new.store", is_dir=True)
+    assert is_store(f"{tmp_path}/new.store")
+    assert get_structure_paths(f"{tmp_path}/new.store") == []
+
+
+def test_archive_store(tmp_path):
+    store_path = f"{tmp_path}/test.store"
+    store = Archive_store(store_path, shard_size=2000)
+    files = {f"file_{i}.txt": f"{i}\n".encode() * i for i in range(20)}
+    files["a" * 150 + ".pdb"] = b"a long name"
+    for name, data in files.items():
+        store.add(name, data)
+    store.close()
+
+    # The store rolls over to new shards
+    store = Archive_store(store_path)
+    assert len(os.listdir(store_path)) > 2
+    assert len(store) == len(files)
+    assert store.files() == list(files)
+    for name, data in files.items():
+        assert store.read(name) == data
+    assert dict(store.iter_files()) == files
+    with pytest.raises(KeyError):
+        store.read("missing.txt")
+
+    # Each shard is a regular tar archive
+    observed = dict()
+    for shard in sorted(os.listdir(store_path)):
+        if shard.endswith(".tar"):
+            with tarfile.open(f"{store_path}/{shard}") as tar:
+                for member in tar.getmembers():
+                    observed[member.name] = tar.extractfile(member).read()
+    assert observed == files
+
+
+def test_archive_store_append_and_recover(tmp_path):
+    store_path = f"{tmp_path}/test.store"
+    add_files(store_path, ["a.txt", "b.txt"])
+
+    # Simulate a write that was interrupted after the data, but before the index line
+    # was complete
+    with open(f"{store_path}/shard-00000.tar", "ab") as outfile:
+        outfile.write(b"partial data")
+    with open(f"{store_path}/shard-00000.idx", "ab") as outfile:
+        outfile.write(b"c.txt\t12")
+
+    add_files(store_path, ["d.txt"])
+
+    assert sorted(os.listdir(store_path)) == ["shard-00000.idx", "shard-00000.tar"]
+    store = Archive_store(store_path)
+    assert store.files() == ["a.txt", "b.txt", "d.txt"]
+    assert store.read("d.txt") == b"d.txt\n"
+    with tarfile.open(f"{store_path}/shard-00000.tar") as tar:
+        assert tar.getnames() == ["a.txt", "b.txt", "d.txt"]
+
+
+def test_archive_store_concurrent_writers(tmp_path):
+    # Each process writes to its own shard
+    store_path = f"{tmp_path}/test.store"
+    batches = [[f"{i}_{j}.txt" for j in range(50)] for i in range(4)]
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        list(executor.map(add_files, [store_path] * 4, batches))
+
+    store = Archive_store(store_path)
+    assert sorted(store.files()) == sorted(name for batch in batches for name in batch)
+    for name in store.files():
+        assert store.read(name) == f"{name}\n".encode()
+
+
+def test_open_file_store(tmp_path):
+    store_path = f"{tmp_path}/structures.store"
+    for name in ["rebased.pdb", "discontinuous_structure.pdb"]:
+        with open(f"tests/test_data/structure_related/{name}") as infile:
+            data = infile.read()
+        with open_file(f"{store_path}/{name}", "w") as outfile:
+            outfile.write(data)
+        with open_file(f"{store_path}/{name}.gz", "w") as outfile:
+            outfile.write(data)
+    get_store(store_path).close()
+
+    assert path_exists(f"{store_path}/rebased.pdb")
+    assert not path_exists(f"{store_path}/missing.pdb")
+    assert Archive_store(store_path).read("rebased.pdb.gz")[:2] == b"\x1f\x8b"
+
+    observed = get_structure_paths(store_path)
+    assert observed == [
+        f"{store_path}/rebased.pdb",
+        f"{store_path}/rebased.pdb.gz",
+        f"{store_path}/discontinuous_structure.pdb",
+        f"{store_path}/discontinuous_structure.pdb.gz",
+    ]
+
+    # Structures are read from the store as they are from files
+    for path in observed:
+        name = os.path.basename(path).removesuffix(".gz")
+        expected_path = f"tests/test_data/structure_related/{name}"
+        compare_structures(
+            pdb_to_structure_object(expected_path), pdb_to_structure_object(path)
+        )
+        assert pdb_to_residue_table(path).get_seq() == (
+            pdb_to_residue_table(expected_path).get_seq()
+        )
+
+
+def test_regular_store_directory(tmp_path):
+    # A directory that happens to end in .store, but isn't an Archive_store, is used
+    # as a regular directory
+    dir_path = f"{tmp_path}/old.store"
+    os.makedirs(dir_path)
+    with open("tests/test_data/structure_related/rebased.pdb") as infile:
+        data = infile.read()
+    with open(f"{dir_path}/a.pdb", "w") as outfile:
+        outfile.write(data)
+
+    assert not is_store(dir_path)
+    assert split_store_path(f"{dir_path}/a.pdb") is None
+    assert split_store_path(f"{dir_path}/b.pdb", "w") is None
+    assert get_structure_paths(dir_path) == [f"{dir_path}/a.pdb"]
+    assert path_exists(f"{dir_path}/a.pdb")
+    assert not path_exists(f"{dir_path}/b.pdb")
+    with open_file(f"{dir_path}/a.pdb") as infile:
+        assert infile.read() == data
+
+    # Writing to it makes regular files, not shards
+    with open_file(f"{dir_path}/b.pdb", "w") as outfile:
+        outfile.write(data)
+    assert sorted(os.listdir(dir_path)) == ["a.pdb", "b.pdb"]
@@ -1,4 +1,11 @@
-from sat.scripts.struc_detect_interaction import domain_chian_counts
+from Bio.PDB.Chain import Chain
+
+from sat.scripts.struc_detect_interaction import (
+    atoms_interact,
+    domain_chian_counts,
+    find_interacting_residues,
+)
+from sat.scripts.utils.structure import pdb_to_structure_object
 
 
 def test_domain_chian_counts_ordered():
@@ -19,3 +26,40 @@ def test_domain_chian_counts_no_greater():
 
 def test_domain_chian_counts_no_smaller():
     assert domain_chian_counts(frozenset([3, 4, 5]), 3) == (0, 3)
+
+
+def split_into_two_chains(structure_path):
+    """
+    Splits the single chain of a structure in half, yielding two chains that have an
+    interface where they meet.
+    """
+    structure = pdb_to_structure_object(structure_path)
+    residues = list(structure[0]["A"])
+    chain_1 = Chain("A")
+    chain_2 = Chain("B")
+    for i, residue in enumerate(residues):
+        residue = residue.copy()
+        if i < len(residues) // 2:
+            chain_1.add(residue)
+        else:
+            chain_2.add(residue)
+    return chain_1, chain_2
+
+
+def test_find_interacting_residues_matches_all_pairs():
+    chain_1, chain_2 = split_into_two_chains(
+        "tests/test_data/structure_related/rebased.pdb"
+    )
+
+    # Test every pair of atoms
+    expected = set()
+    for atom_a in chain_1.get_atoms():
+        for atom_b in chain_2.get_atoms():
+            if atoms_interact(atom_a, atom_b):
+                expected.add((atom_a.get_parent().id, atom_b.get_parent().id))
+
+    observed = find_interacting_residues(chain_1, chain_2)
+    observed = {(r1.id, r2.id) for r1, r2 in observed}
+
+    assert len(expected) > 0
+    assert observed == expected
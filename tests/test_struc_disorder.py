@@ -1,4 +1,15 @@
-from sat.scripts.struc_disorder import find_disorder, find_order
+import os
+
+import numpy as np
+
+from sat.scripts.struc_disorder import (
+    STRETCH_FIELDS,
+    find_disorder,
+    find_order,
+    find_stretches,
+    struc_disorder,
+    struc_disorder_main,
+)
 
 
 def test_count_disorder():
@@ -85,3 +96,106 @@ def test_count_order_punctuated():
     residues = [item for sublist in stretches for item in sublist]
     result = len(residues)
     assert result == 6, f"Expected 6, but got {result}"
+
+
+def test_struc_disorder_main_batch(tmp_path):
+    class args:
+        pass
+
+    args.structure_file = "tests/test_data/structure_related/get_domains/outputs"
+    args.disorder_cutoff = 50
+    args.order_cutoff = 60
+    args.n_sequential = 6
+    args.check_for_domain_len = 50
+    args.stretch_file = ""
+
+    # Process each structure on its own
+    expected = ""
+    for name in sorted(os.listdir(args.structure_file)):
+        if not name.endswith(".pdb"):
+            continue
+        expected += struc_disorder(
+            f"{args.structure_file}/{name}",
+            args.order_cutoff,
+            args.n_sequential,
+            args.check_for_domain_len,
+        )
+
+    args.workers = 2
+    args.out_file = f"{tmp_path}/disorder.tsv"
+    struc_disorder_main(args)
+
+    with open(args.out_file) as infile:
+        observed = infile.read()
+    assert len(observed.splitlines()) == 4
+    assert observed == expected
+
+
+def test_find_stretches():
+    mask = [True, True, False, True, True, True, False, False, True, True, True]
+    starts, ends = find_stretches(mask, 3)
+    assert starts.tolist() == [3, 8]
+    assert ends.tolist() == [6, 11]
+
+    starts, ends = find_stretches(mask, 1)
+    assert starts.tolist() == [0, 3, 8]
+    assert ends.tolist() == [2, 6, 11]
+
+    starts, ends = find_stretches([], 1)
+    assert starts.tolist() == [] and ends.tolist() == []
+
+
+def test_find_stretches_random():
+    # Compare to a residue-by-residue scan
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        mask = rng.random(rng.integers(0, 60)) < 0.6
+        n_sequential = int(rng.integers(1, 6))
+
+        expected = []
+        current = []
+        for i, value in enumerate(mask):
+            if value:
+                current.append(i)
+                continue
+            if len(current) >= n_sequential:
+                expected.append(current)
+            current = []
+        if len(current) >= n_sequential:
+            expected.append(current)
+
+        starts, ends = find_stretches(mask, n_sequential)
+        observed = [list(range(s, e)) for s, e in zip(starts, ends)]
+        assert observed == expected
+
+
+def test_struc_disorder_main_stretch_file(tmp_path):
+    class args:
+        pass
+
+    args.structure_file = "tests/test_data/structure_related/get_domains/outputs"
+    args.disorder_cutoff = 50
+    args.order_cutoff = 60
+    args.n_sequential = 6
+    args.check_for_domain_len = 50
+    args.workers = 1
+    args.out_file = f"{tmp_path}/disorder.tsv"
+    args.stretch_file = f"{tmp_path}/stretches.tsv"
+    struc_disorder_main(args)
+
+    with open(args.stretch_file) as infile:
+        header = infile.readline().rstrip("\n").split("\t")
+        stretches = [line.rstrip("\n").split("\t") for line in infile]
+    assert header == STRETCH_FIELDS
+
+    # The stretch lengths add up to the ordered and disordered counts
+    with open(args.out_file) as infile:
+        for line in infile:
+            name, ordered, disordered = line.split("\t")[:3]
+            lengths = dict(ordered=0, disordered=0)
+            for stretch in stretches:
+                if stretch[0] == name:
+                    assert int(stretch[2]) - int(stretch[1]) == int(stretch[4])
+                    lengths[stretch[3]] += int(stretch[4])
+            assert lengths["ordered"] == int(ordered)
+            assert lengths["disordered"] == int(disordered)
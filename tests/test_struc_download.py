@@ -1,6 +1,225 @@
 from glob import glob
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import threading
 
-from sat.scripts.struc_download import struc_download_main
+import pytest
+
+from sat.scripts.struc_download import (
+    AF2_API_URL,
+    MANIFEST_NAME,
+    Rate_limiter,
+    read_manifest,
+    struc_download_main,
+)
+from sat.scripts.utils.store import Archive_store
+
+
+# ------------------------------------------------------------------------------------ #
+# Local stand-in for the AF2 database
+# ------------------------------------------------------------------------------------ #
+class AF2_handler(BaseHTTPRequestHandler):
+    """
+    Serves /api/prediction/{uniprotID} and the pdb and PAE files it points to. IDs
+    missing from the server's entries are not found, and the paths in the server's
+    flaky set fail once with a 503 before succeeding. IDs in the server's records
+    dictionary return that api response instead.
+    """
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+            flaky = self.path in server.flaky
+            server.flaky.discard(self.path)
+
+        if flaky:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if self.path.startswith("/api/prediction/"):
+            uniprotID = self.path.split("/")[-1]
+            if uniprotID in server.records:
+                body = json.dumps(server.records[uniprotID]).encode()
+            elif uniprotID in server.entries:
+                base = f"http://127.0.0.1:{server.server_port}/files/AF-{uniprotID}-F1"
+                body = json.dumps(
+                    [
+                        {
+                            "pdbUrl": f"{base}-model_v4.pdb",
+                            "paeDocUrl": f"{base}-predicted_aligned_error_v4.json",
+                        }
+                    ]
+                ).encode()
+            else:
+                self.send_error(404)
+                return
+        elif self.path.startswith("/files/"):
+            body = f"content of {self.path}\n".encode()
+        else:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        return
+
+
+@pytest.fixture
+def af2_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), AF2_handler)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.entries = {"P00001", "P00002", "P00003"}
+    server.flaky = set()
+    server.records = dict()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def get_args(tmp_path, server):
+    class args:
+        pass
+
+    args.infile = f"{tmp_path}/input.txt"
+    args.output_dir = f"{tmp_path}/output"
+    args.infile_columns = "uniprotID,taxonID"
+    args.additional_field_delimiter = "__"
+    args.workers = 4
+    args.rate_limit = 0
+    args.retries = 3
+    args.manifest = ""
+    args.api_url = f"http://127.0.0.1:{server.server_port}/api/prediction"
+
+    with open(args.infile, "w") as outfile:
+        outfile.write("P00001\t9606\nP00002\t9606\nP00003\t10090\nP99999\t9606\n")
+    return args
+
+
+# ------------------------------------------------------------------------------------ #
+# Tests
+# ------------------------------------------------------------------------------------ #
+def test_rate_limiter():
+    rate_limiter = Rate_limiter(0)
+    assert rate_limiter.interval == 0
+    rate_limiter.wait()
+
+    rate_limiter = Rate_limiter(100)
+    first = rate_limiter.next_time
+    for _ in range(5):
+        rate_limiter.wait()
+    assert rate_limiter.next_time - first >= 5 * 0.01
+
+
+def test_struc_download_main_local(tmp_path, af2_server):
+    args = get_args(tmp_path, af2_server)
+    af2_server.flaky = {"/api/prediction/P00002", "/files/AF-P00003-F1-model_v4.pdb"}
+    struc_download_main(args)
+
+    observed = sorted(os.listdir(args.output_dir))
+    expected = sorted(
+        [
+            f"AF-{i}-F1-model_v4__{taxon}.pdb"
+            for i, taxon in [("P00001", 9606), ("P00002", 9606), ("P00003", 10090)]
+        ]
+        + [
+            f"AF-{i}-F1-predicted_aligned_error_v4__{taxon}.json"
+            for i, taxon in [("P00001", 9606), ("P00002", 9606), ("P00003", 10090)]
+        ]
+        + [MANIFEST_NAME]
+    )
+    assert observed == expected
+
+    with open(f"{args.output_dir}/AF-P00001-F1-model_v4__9606.pdb") as infile:
+        assert infile.read() == "content of /files/AF-P00001-F1-model_v4.pdb\n"
+
+    with open(f"{args.output_dir}/{MANIFEST_NAME}") as infile:
+        manifest = sorted(infile.read().splitlines())
+    assert manifest == [
+        "P00001\t9606\tdownloaded",
+        "P00002\t9606\tdownloaded",
+        "P00003\t10090\tdownloaded",
+        "P99999\t9606\tnot_found",
+    ]
+
+    # A rerun skips every entry in the manifest without making any requests
+    n_requests = len(af2_server.requests)
+    struc_download_main(get_args(tmp_path, af2_server))
+    assert len(af2_server.requests) == n_requests
+
+
+def test_struc_download_main_malformed_records(tmp_path, af2_server):
+    # Empty or incomplete api responses are not found, and don't stop the run
+    args = get_args(tmp_path, af2_server)
+    af2_server.records = {"P00001": [], "P00002": [{"pdbUrl": ""}]}
+    struc_download_main(args)
+
+    with open(f"{args.output_dir}/{MANIFEST_NAME}") as infile:
+        manifest = sorted(infile.read().splitlines())
+    assert manifest == [
+        "P00001\t9606\tnot_found",
+        "P00002\t9606\tnot_found",
+        "P00003\t10090\tdownloaded",
+        "P99999\t9606\tnot_found",
+    ]
+
+
+def test_struc_download_main_resume(tmp_path, af2_server):
+    args = get_args(tmp_path, af2_server)
+
+    # Without retries, the flaky entry fails and isn't recorded in the manifest
+    args.retries = 0
+    af2_server.flaky = {"/files/AF-P00002-F1-predicted_aligned_error_v4.json"}
+    struc_download_main(args)
+
+    manifest_path = f"{args.output_dir}/{MANIFEST_NAME}"
+    assert read_manifest(manifest_path) == {
+        "P00001\t9606",
+        "P00003\t10090",
+        "P99999\t9606",
+    }
+    assert not glob(f"{args.output_dir}/*.tmp")
+    assert not glob(f"{args.output_dir}/*P00002*json")
+
+    # The rerun only retries the failed entry, and skips its pdb that is present
+    af2_server.requests = []
+    struc_download_main(get_args(tmp_path, af2_server))
+    assert sorted(af2_server.requests) == [
+        "/api/prediction/P00002",
+        "/files/AF-P00002-F1-predicted_aligned_error_v4.json",
+    ]
+    assert len(read_manifest(manifest_path)) == 4
+    assert len(glob(f"{args.output_dir}/*pdb")) == 3
+    assert len(glob(f"{args.output_dir}/*json")) == 3
+
+
+def test_struc_download_main_store(tmp_path, af2_server):
+    args = get_args(tmp_path, af2_server)
+    args.output_dir = f"{tmp_path}/output.store"
+    struc_download_main(args)
+
+    store = Archive_store(args.output_dir)
+    assert sorted(store.files()) == sorted(
+        f"AF-P0000{i}-F1-{suffix}"
+        for i, taxon in [(1, 9606), (2, 9606), (3, 10090)]
+        for suffix in [
+            f"model_v4__{taxon}.pdb",
+            f"predicted_aligned_error_v4__{taxon}.json",
+        ]
+    )
+    assert store.read("AF-P00001-F1-model_v4__9606.pdb") == (
+        b"content of /files/AF-P00001-F1-model_v4.pdb\n"
+    )
 
 
 # ------------------------------------------------------------------------------------ #
@@ -17,6 +236,11 @@ def teststruc_download_main(tmp_path):
 
     args.infile_columns = "uniprotID,taxonID"
     args.additional_field_delimiter = "__"
+    args.workers = 3
+    args.rate_limit = 0
+    args.retries = 5
+    args.manifest = ""
+    args.api_url = AF2_API_URL
 
     # Run the script
     struc_download_main(args)
@@ -0,0 +1,119 @@
+import pytest
+
+from sat.scripts.struc_find_motif import (
+    Motif_scanner,
+    WILDCARD_AAS,
+    compile_motif,
+    find_motif_matches,
+    parse_motif,
+    struc_find_motif_main,
+)
+
+
+def test_parse_motif():
+    observed = parse_motif("[st]xC(2)x(1,3)")
+    expected = [
+        ("ST", 1, 1),
+        ("".join(sorted(WILDCARD_AAS)), 1, 1),
+        ("C", 2, 2),
+        ("".join(sorted(WILDCARD_AAS)), 1, 3),
+    ]
+    assert observed == expected
+
+
+@pytest.mark.parametrize("motif", ["[ST", "ST]", "[]C", "C(2,1)", "C(a)", "x(0)"])
+def test_parse_motif_malformed(motif):
+    with pytest.raises(ValueError):
+        parse_motif(motif)
+
+
+def test_find_motif_matches():
+    seq = "MSACTAACSSC"
+    observed = find_motif_matches(compile_motif("[ST]xxC"), seq)
+    assert observed == [("TAAC", 5, 8)]
+
+    # Variable-length gaps
+    observed = find_motif_matches(compile_motif("[ST]x(1,2)C"), seq)
+    assert observed == [("SAC", 2, 4), ("TAAC", 5, 8), ("SSC", 9, 11)]
+
+    # Motifs longer than 10 positions
+    observed = find_motif_matches(compile_motif("x" * 11), seq)
+    assert observed == [(seq, 1, 11)]
+
+
+def test_find_motif_matches_overlapping():
+    # Overlapping matches of the same sequence are only reported with overlapping
+    assert find_motif_matches(compile_motif("xx"), "AAA") == [("AA", 1, 2)]
+    assert find_motif_matches(compile_motif("xx"), "AAA", overlapping=True) == [
+        ("AA", 1, 2),
+        ("AA", 2, 3),
+    ]
+
+    # Overlapping matches of different sequences are always reported
+    assert find_motif_matches(compile_motif("xx"), "ABC") == [
+        ("AB", 1, 2),
+        ("BC", 2, 3),
+    ]
+
+
+def test_struc_find_motif_main(capsys):
+    class args:
+        pass
+
+    args.motif = "[ST]xxC"
+    args.structure = ""
+    args.fasta = ""
+    args.seq = "msactaacssc"
+    args.overlapping = False
+    args.motif_file = ""
+    args.output_file = "-"
+    args.workers = 1
+    struc_find_motif_main(args)
+
+    assert capsys.readouterr().out == "match\tstart\tend\nTAAC\t5\t8\n\n"
+
+
+def test_motif_scanner():
+    # The scanner finds the same matches as scanning each motif on its own
+    motifs = ["[ST]xxC", "xx", "C", "[ST]x(1,2)C"]
+    seq = "MSACTAACSSC"
+    for overlapping in [False, True]:
+        scanner = Motif_scanner(motifs, overlapping)
+        observed = sorted(scanner.scan(seq))
+        expected = sorted(
+            (motif,) + match
+            for motif in motifs
+            for match in find_motif_matches(compile_motif(motif), seq, overlapping)
+        )
+        assert observed == expected
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_struc_find_motif_main_multiple(tmp_path, workers):
+    fasta = tmp_path / "seqs.fasta"
+    fasta.write_text(">p1 first\nMSACTAACSSC\n>p2\nAAAAC\n")
+    motif_file = tmp_path / "motifs.txt"
+    motif_file.write_text("# motifs\n[ST]xxC\n\nAC\n")
+    output_file = tmp_path / "matches.tsv"
+
+    class args:
+        pass
+
+    args.motif = ""
+    args.motif_file = str(motif_file)
+    args.structure = ""
+    args.fasta = str(fasta)
+    args.seq = ""
+    args.overlapping = False
+    args.output_file = str(output_file)
+    args.workers = workers
+    struc_find_motif_main(args)
+
+    expected = [
+        "seq_id\tmotif\tmatch\tstart\tend",
+        "p1\tAC\tAC\t3\t4",
+        "p1\t[ST]xxC\tTAAC\t5\t8",
+        "p1\tAC\tAC\t7\t8",
+        "p2\tAC\tAC\t4\t5",
+    ]
+    assert output_file.read_text().splitlines() == expected
@@ -1,11 +1,27 @@
 from sat.scripts.struc_get_domains import (
     filter_clusters,
     smooth_array,
+    smooth_pae_matrix,
     plddt_trim_clusters,
     struc_get_domains_main,
+    parse_json_file,
+    get_pae_cache_path,
+    pae_matrix_to_sparse_graph,
+    domains_from_pae_matrix,
+    domains_from_pae_matrix_networkx,
+    domains_from_pae_matrix_sparse,
 )
+from sat.scripts.utils.domains import DOMAIN_REPORT_FIELDS
+from sat.scripts.utils.misc import get_structure_paths, open_file
 from sat.scripts.utils.structure import pdb_to_structure_object, compare_structures
+from itertools import groupby
+import json
+import pytest
+import os
+import shutil
 import numpy as np
+import networkx as nx
+from networkx.algorithms import community
 
 
 def test_filter_clusters_two_good():
@@ -82,6 +98,59 @@ def test_smooth_array_n_long_enough():
     assert list(smooth_array(in_arr, n=2)) == expected
 
 
+def smooth_array_reference(in_arr, threshold=5, n=20, block_replace=1):
+    """
+    The original smooth_array, which walks the runs of good and bad values one at a
+    time. Used to check the vectorized smoothing.
+    """
+    status = in_arr < threshold
+    grouped_status = [(k, sum(1 for i in g)) for k, g in groupby(status)]
+
+    pos_to_smooth = set()
+    i = 0
+    for status, length in grouped_status:
+        i += length
+        if i - length == 0 and not status:
+            continue
+        if i == len(in_arr) and not status:
+            continue
+        if status:
+            pos_to_smooth.update(range(i - length, i))
+        elif length < n and not status:
+            pos_to_smooth.update(range(i - length, i))
+
+    out_arr = []
+    for i, val in enumerate(in_arr):
+        if i in pos_to_smooth:
+            out_arr.append(block_replace)
+        else:
+            out_arr.append(val)
+    return np.array(out_arr)
+
+
+def test_smooth_pae_matrix_matches_reference():
+    rng = np.random.default_rng(0)
+    pae_matrix = rng.integers(0, 12, size=(15, 40)).astype(float)
+    for n in [1, 2, 5]:
+        rows = smooth_pae_matrix(pae_matrix, n=n, axis=1)
+        columns = smooth_pae_matrix(pae_matrix, n=n, axis=0)
+        for i, row in enumerate(pae_matrix):
+            expected = smooth_array_reference(row, n=n)
+            assert np.array_equal(rows[i], expected)
+            assert np.array_equal(smooth_array(row, n=n), expected)
+        for j, column in enumerate(pae_matrix.T):
+            assert np.array_equal(columns[:, j], smooth_array_reference(column, n=n))
+
+
+def test_smooth_pae_matrix_keeps_float_values():
+    # The first row is entirely smoothed, which must not truncate the other rows
+    pae_matrix = np.array([[1.0, 2.0, 3.0], [10.5, 2.0, 10.5]])
+    expected = np.array([[1.0, 1.0, 1.0], [10.5, 1.0, 10.5]])
+    observed = smooth_pae_matrix(pae_matrix, axis=1)
+    assert observed.dtype == pae_matrix.dtype
+    assert np.array_equal(observed, expected)
+
+
 def test_plddt_trim_clusters_no_trimming():
     clusters = [frozenset([1, 2, 3, 4, 5]), frozenset([6, 7, 8, 9, 10])]
     plddt_array = [70 for i in range(10)]
@@ -132,8 +201,13 @@ def test_struc_get_domains_three_domain_structure(tmp_path):
     args.min_domain_length = 50
     args.min_domain_plddt = 60
     args.smooth_n = 0
+    args.clustering_backend = "networkx"
+    args.single_file = False
+    args.pae_cache = False
+    args.pae_cache_dtype = "float64"
     args.plddt_report = f"{tmp_path}/plddt_report.tsv"
     args.pae_report = f"{tmp_path}/pae_report.tsv"
+    args.domain_report = f"{tmp_path}/domain_report.tsv"
 
     # Run script
     struc_get_domains_main(args)
@@ -181,6 +255,19 @@ def test_struc_get_domains_three_domain_structure(tmp_path):
     expected_pae_report.close()
     observed_pae_report.close()
 
+    # The domain report has one line per domain, with the same mean pLDDTs as the
+    # plddt report
+    with open(args.domain_report) as infile:
+        header = infile.readline().rstrip("\n").split("\t")
+        lines = [line.rstrip("\n").split("\t") for line in infile]
+    with open(args.plddt_report) as infile:
+        plddt_lines = [line.rstrip("\n").split("\t") for line in infile]
+    assert len(header) == len(DOMAIN_REPORT_FIELDS) + 3
+    assert [line[0] for line in lines] == [line[0] for line in plddt_lines]
+    mean_plddt_i = header.index("mean_plddt")
+    assert [line[mean_plddt_i] for line in lines] == [line[1] for line in plddt_lines]
+    assert header[-1] == "mean_pae_to_three_domains_domain-3.pdb"
+
 
 def test_struc_get_domains_whole_structure_used_as_domain(tmp_path):
     # Inputs
@@ -196,8 +283,13 @@ def test_struc_get_domains_whole_structure_used_as_domain(tmp_path):
     args.min_domain_length = 50
     args.min_domain_plddt = 60
     args.smooth_n = 0
+    args.clustering_backend = "networkx"
+    args.single_file = False
+    args.pae_cache = False
+    args.pae_cache_dtype = "float64"
     args.plddt_report = f"{tmp_path}/plddt_report.tsv"
     args.pae_report = f"{tmp_path}/pae_report.tsv"
+    args.domain_report = f"{tmp_path}/domain_report.tsv"
 
     # Run script
     struc_get_domains_main(args)
@@ -228,3 +320,226 @@ def test_struc_get_domains_whole_structure_used_as_domain(tmp_path):
     assert expected_pae_report.read() == observed_pae_report.read()
     expected_pae_report.close()
     observed_pae_report.close()
+
+
+def test_pae_matrix_to_sparse_graph_matches_networkx():
+    pae_matrix, _ = parse_json_file(
+        "tests/test_data/structure_related/get_domains/inputs/full_struc_used_as_domain.scores.json"
+    )
+    graph = pae_matrix_to_sparse_graph(pae_matrix, pae_power=2, pae_cutoff=5)
+
+    # The graph as domains_from_pae_matrix_networkx builds it
+    weights = 1 / pae_matrix**2
+    g = nx.Graph()
+    g.add_nodes_from(range(len(pae_matrix)))
+    edges = np.argwhere(pae_matrix < 5)
+    g.add_weighted_edges_from([(i, j, weights[i, j]) for i, j in edges])
+
+    expected = nx.to_scipy_sparse_array(g, nodelist=range(len(pae_matrix))).tolil()
+    expected.setdiag(expected.diagonal() * 2)
+    assert abs(expected.tocsr() - graph).max() == 0
+
+
+def test_domains_from_pae_matrix_sparse_blocks():
+    # Three blocks of low PAE, in a shuffled order
+    pae_matrix = np.full((60, 60), 30.0)
+    blocks = [range(0, 25), range(25, 40), range(40, 60)]
+    for block in blocks:
+        pae_matrix[np.ix_(block, block)] = 1.0
+    order = np.random.default_rng(0).permutation(60)
+    pae_matrix = pae_matrix[np.ix_(order, order)]
+
+    observed = domains_from_pae_matrix_sparse(pae_matrix)
+
+    position = {residue: i for i, residue in enumerate(order)}
+    expected = [frozenset(position[residue] for residue in block) for block in blocks]
+    assert observed == sorted(expected, key=len, reverse=True)
+
+
+def test_domains_from_pae_matrix_sparse_modularity():
+    pae_matrix, _ = parse_json_file(
+        "tests/test_data/structure_related/get_domains/inputs/three_domains.scores.json"
+    )
+    clusters = domains_from_pae_matrix(pae_matrix, backend="sparse")
+
+    # Every residue is in exactly one cluster
+    assert sorted(i for cluster in clusters for i in cluster) == list(
+        range(len(pae_matrix))
+    )
+
+    # Louvain should find at least as good a partition as networkx
+    g = nx.Graph()
+    edges = np.argwhere(pae_matrix < 5)
+    g.add_weighted_edges_from([(i, j, 1 / pae_matrix[i, j]) for i, j in edges])
+    reference = domains_from_pae_matrix_networkx(pae_matrix)
+    assert community.modularity(g, clusters) >= community.modularity(g, reference)
+
+
+def test_parse_json_file_cache(tmp_path):
+    json_file = f"{tmp_path}/full_struc_used_as_domain.scores.json"
+    shutil.copy(
+        "tests/test_data/structure_related/get_domains/inputs/full_struc_used_as_domain.scores.json",
+        json_file,
+    )
+    cache_path = get_pae_cache_path(json_file)
+    pae_matrix, plddt_array = parse_json_file(json_file)
+
+    # The first call writes the cache, the second reads it
+    for _ in range(2):
+        observed_pae, observed_plddt = parse_json_file(json_file, cache=True)
+        assert os.path.isfile(cache_path)
+        assert observed_pae.dtype == np.float64
+        assert np.array_equal(observed_pae, pae_matrix)
+        assert observed_plddt == plddt_array
+        assert all(type(plddt) is float for plddt in observed_plddt)
+
+    # A different dtype rebuilds the cache
+    observed_pae, _ = parse_json_file(json_file, cache=True, cache_dtype="float16")
+    assert observed_pae.dtype == np.float16
+    assert np.allclose(observed_pae, pae_matrix, atol=0.05)
+
+    # Changing the json file makes the cache out of date
+    with open(json_file, "w") as outfile:
+        json.dump({"pae": [[0, 1], [2, 0]], "plddt": [90, 80]}, outfile)
+    observed_pae, observed_plddt = parse_json_file(
+        json_file, cache=True, cache_dtype="float16"
+    )
+    assert np.array_equal(observed_pae, [[0, 1], [2, 0]])
+    assert observed_plddt == [90, 80]
+
+    # Integer pLDDTs are returned as floats whether or not the cache existed
+    os.remove(cache_path)
+    for _ in range(2):
+        _, observed_plddt = parse_json_file(json_file, cache=True)
+        assert [type(plddt) for plddt in observed_plddt] == [float, float]
+
+
+def test_struc_get_domains_single_file(tmp_path):
+    class args:
+        pass
+
+    args.structure_file_path = (
+        "tests/test_data/structure_related/get_domains/inputs/three_domains.pdb"
+    )
+    args.pae_path = (
+        "tests/test_data/structure_related/get_domains/inputs/three_domains.scores.json"
+    )
+    args.output_dir = f"{tmp_path}/domains"
+    args.pae_power = 1
+    args.pae_cutoff = 5
+    args.graph_resolution = 1
+    args.min_domain_length = 50
+    args.min_domain_plddt = 60
+    args.smooth_n = 0
+    args.clustering_backend = "networkx"
+    args.single_file = True
+    args.pae_cache = False
+    args.pae_cache_dtype = "float64"
+    args.plddt_report = ""
+    args.pae_report = ""
+    args.domain_report = ""
+
+    struc_get_domains_main(args)
+
+    observed = pdb_to_structure_object(f"{tmp_path}/domains/three_domains_domains.pdb")
+    assert len(observed) == 3
+    for i, model in enumerate(observed, start=1):
+        expected = pdb_to_structure_object(
+            f"tests/test_data/structure_related/get_domains/outputs/three_domains_domain-{i}.pdb"
+        )
+        assert [r.id[1] for r in model.get_residues()] == [
+            r.id[1] for r in expected.get_residues()
+        ]
+
+
+@pytest.mark.parametrize("name", ["three_domains.pdb.gz", "herb.pdb"])
+def test_struc_get_domains_output_names(tmp_path, name):
+    # Only the structure suffix is removed from the domain names
+    structure_file_path = f"{tmp_path}/{name}"
+    input_path = (
+        "tests/test_data/structure_related/get_domains/inputs/three_domains.pdb"
+    )
+    with open(input_path) as infile, open_file(structure_file_path, "w") as outfile:
+        outfile.write(infile.read())
+
+    class args:
+        pass
+
+    args.structure_file_path = structure_file_path
+    args.pae_path = (
+        "tests/test_data/structure_related/get_domains/inputs/three_domains.scores.json"
+    )
+    args.output_dir = f"{tmp_path}/domains"
+    args.pae_power = 1
+    args.pae_cutoff = 5
+    args.graph_resolution = 1
+    args.min_domain_length = 50
+    args.min_domain_plddt = 60
+    args.smooth_n = 0
+    args.clustering_backend = "networkx"
+    args.single_file = False
+    args.pae_cache = False
+    args.pae_cache_dtype = "float64"
+    args.plddt_report = f"{tmp_path}/plddt_report.tsv"
+    args.pae_report = ""
+    args.domain_report = ""
+
+    struc_get_domains_main(args)
+
+    basename = name.split(".")[0]
+    expected_names = [f"{basename}_domain-{i}.pdb" for i in range(1, 4)]
+    assert sorted(os.listdir(args.output_dir)) == expected_names
+    with open(args.plddt_report) as infile:
+        assert [line.split("\t")[0] for line in infile] == expected_names
+    for i, expected_name in enumerate(expected_names, start=1):
+        compare_structures(
+            pdb_to_structure_object(
+                f"tests/test_data/structure_related/get_domains/outputs/three_domains_domain-{i}.pdb"
+            ),
+            pdb_to_structure_object(f"{args.output_dir}/{expected_name}"),
+        )
+
+
+def test_struc_get_domains_store(tmp_path):
+    # Domains written to a store are the same as those written to a directory
+    class args:
+        pass
+
+    args.structure_file_path = (
+        "tests/test_data/structure_related/get_domains/inputs/three_domains.pdb"
+    )
+    args.pae_path = (
+        "tests/test_data/structure_related/get_domains/inputs/three_domains.scores.json"
+    )
+    args.pae_power = 1
+    args.pae_cutoff = 5
+    args.graph_resolution = 1
+    args.min_domain_length = 50
+    args.min_domain_plddt = 60
+    args.smooth_n = 0
+    args.clustering_backend = "networkx"
+    args.single_file = False
+    args.pae_cache = False
+    args.pae_cache_dtype = "float64"
+    args.plddt_report = ""
+    args.pae_report = ""
+    args.domain_report = ""
+
+    args.output_dir = f"{tmp_path}/domains"
+    struc_get_domains_main(args)
+    args.output_dir = f"{tmp_path}/domains.store"
+    struc_get_domains_main(args)
+
+    assert sorted(os.listdir(f"{tmp_path}/domains.store")) == [
+        "shard-00000.idx",
+        "shard-00000.tar",
+    ]
+    observed = get_structure_paths(f"{tmp_path}/domains.store")
+    assert [os.path.basename(path) for path in observed] == [
+        f"three_domains_domain-{i}.pdb" for i in range(1, 4)
+    ]
+    for path in observed:
+        with open(f"{tmp_path}/domains/{os.path.basename(path)}") as infile:
+            expected = infile.read()
+        with open_file(path) as infile:
+            assert infile.read() == expected
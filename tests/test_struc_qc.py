@@ -0,0 +1,47 @@
+import pytest
+
+from sat.scripts.struc_qc import struc_qc_main
+
+
+INPUT_DIR = "tests/test_data/structure_related/get_domains/inputs"
+
+
+def get_args(structure_file_path, workers=1, out_file="-"):
+    class args:
+        pass
+
+    args.structure_file_path = structure_file_path
+    args.plddt_cutoff = 70
+    args.workers = workers
+    args.out_file = out_file
+    return args
+
+
+def test_struc_qc_main_single(capsys):
+    # A single structure is printed as it was before batch mode
+    struc_qc_main(get_args(f"{INPUT_DIR}/full_struc_used_as_domain.pdb"))
+    observed = capsys.readouterr().out
+    assert observed == "full_struc_used_as_domain.pdb\t180\t90\t0.5\n"
+
+
+@pytest.mark.parametrize(
+    "structure_file_path",
+    [INPUT_DIR, f"{INPUT_DIR}/*.pdb", "list"],
+)
+def test_struc_qc_main_batch(tmp_path, structure_file_path):
+    if structure_file_path == "list":
+        structure_file_path = f"{tmp_path}/structures.txt"
+        with open(structure_file_path, "w") as outfile:
+            outfile.write(f"{INPUT_DIR}/full_struc_used_as_domain.pdb\n")
+            outfile.write(f"{INPUT_DIR}/three_domains.pdb\n")
+
+    outputs = []
+    for workers in [1, 2, 2]:
+        out_file = f"{tmp_path}/qc_{len(outputs)}.tsv"
+        struc_qc_main(get_args(structure_file_path, workers, out_file))
+        with open(out_file) as infile:
+            outputs.append(infile.read())
+
+    expected = "full_struc_used_as_domain.pdb\t180\t90\t0.5\n"
+    expected += "three_domains.pdb\t669\t555\t0.83\n"
+    assert outputs == [expected] * 3
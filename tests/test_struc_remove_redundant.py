@@ -1,4 +1,20 @@
-from sat.scripts.struc_remove_redundant import is_overlapping
+from itertools import combinations
+import filecmp
+import gzip
+import os
+
+import numpy as np
+import pytest
+
+from sat.scripts.struc_remove_redundant import (
+    find_overlapping_pairs,
+    is_overlapping,
+    struc_remove_redundant_main,
+)
+from sat.scripts.utils.structure import (
+    pdb_to_structure_object,
+    write_structure_subsets,
+)
 
 
 def test_is_overlapping():
@@ -23,3 +39,112 @@ def test_is_overlapping():
     seq2 = "DEFGHIJKLMNOPQRST"
     assert is_overlapping(seq1, seq2, 3) == True
     assert is_overlapping(seq1, seq2, 2) == False
+
+
+def test_find_overlapping_pairs_matches_all_pairs():
+    rng = np.random.default_rng(0)
+    amino_acids = np.array(list("ACDEFGHIKLMNPQRSTVWY"))
+    proteins = ["".join(rng.choice(amino_acids, 200)) for _ in range(5)]
+
+    # Fragments of a few proteins, including identical and very short sequences
+    seqs = []
+    for _ in range(80):
+        protein = proteins[rng.integers(len(proteins))]
+        start = rng.integers(0, 180)
+        seqs.append(protein[start : start + rng.integers(5, 120)])
+    seqs += seqs[:5]
+
+    for end_overlap in [0, 5, 15]:
+        expected = [
+            (i, j)
+            for i, j in combinations(range(len(seqs)), 2)
+            if is_overlapping(seqs[i], seqs[j], end_overlap)
+        ]
+        for k in [3, 8]:
+            assert find_overlapping_pairs(seqs, end_overlap, k) == expected
+
+
+def write_test_domains(input_dir):
+    """
+    Writes four domains of three_domains.pdb to input_dir. domain_2 is within
+    domain_1, so only domain_1, domain_3, and domain_4 survive.
+    """
+    os.makedirs(input_dir)
+    structure = pdb_to_structure_object(
+        "tests/test_data/structure_related/get_domains/inputs/three_domains.pdb"
+    )
+    residue_sets = [
+        set(range(1, 200)),
+        set(range(50, 150)),
+        set(range(300, 400)),
+        set(range(500, 600)),
+    ]
+    outfiles = [f"{input_dir}/domain_{i}.pdb" for i in range(1, 5)]
+    write_structure_subsets(structure, residue_sets, outfiles)
+    return outfiles
+
+
+@pytest.mark.parametrize("output_mode", ["rewrite", "copy", "hardlink", "none"])
+def test_struc_remove_redundant_output_modes(tmp_path, output_mode):
+    infiles = write_test_domains(f"{tmp_path}/inputs")
+
+    class args:
+        pass
+
+    args.input_structure_glob = f"{tmp_path}/inputs/*.pdb"
+    args.output_dir = f"{tmp_path}/outputs"
+    args.output_mode = output_mode
+    args.survivor_list = f"{tmp_path}/survivors.txt"
+    args.workers = 1
+    struc_remove_redundant_main(args)
+
+    expected = [infiles[0], infiles[2], infiles[3]]
+    with open(args.survivor_list) as infile:
+        assert sorted(line.rstrip("\n") for line in infile) == expected
+
+    if output_mode == "none":
+        assert not os.path.exists(args.output_dir)
+        return
+
+    expected_names = [os.path.basename(path) for path in expected]
+    assert sorted(os.listdir(args.output_dir)) == expected_names
+    for path in expected:
+        outfile = f"{args.output_dir}/{os.path.basename(path)}"
+        if output_mode == "rewrite":
+            observed = pdb_to_structure_object(outfile)
+            assert len(list(observed.get_atoms())) == len(
+                list(pdb_to_structure_object(path).get_atoms())
+            )
+        else:
+            assert filecmp.cmp(path, outfile, shallow=False)
+        if output_mode == "hardlink":
+            assert os.path.samefile(path, outfile)
+
+
+def test_struc_remove_redundant_rewrites_gzipped_input(tmp_path):
+    infiles = write_test_domains(f"{tmp_path}/pdbs")
+    os.makedirs(f"{tmp_path}/inputs")
+    for path in infiles:
+        with open(path, "rb") as infile, gzip.open(
+            f"{tmp_path}/inputs/{os.path.basename(path)}.gz", "wb"
+        ) as outfile:
+            outfile.write(infile.read())
+
+    class args:
+        pass
+
+    args.input_structure_glob = f"{tmp_path}/inputs/*.pdb.gz"
+    args.output_dir = f"{tmp_path}/outputs"
+    args.output_mode = "rewrite"
+    args.survivor_list = ""
+    args.workers = 2
+    struc_remove_redundant_main(args)
+
+    assert sorted(os.listdir(args.output_dir)) == [
+        "domain_1.pdb.gz",
+        "domain_3.pdb.gz",
+        "domain_4.pdb.gz",
+    ]
+    # The output is gzipped, as its name says
+    observed = pdb_to_structure_object(f"{args.output_dir}/domain_1.pdb.gz")
+    assert len(list(observed.get_residues())) == 199
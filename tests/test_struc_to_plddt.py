@@ -0,0 +1,56 @@
+import pytest
+
+from sat.scripts.struc_to_plddt import struc_to_plddt_main
+
+
+INPUT_DIR = "tests/test_data/structure_related/get_domains/inputs"
+
+
+def get_args(structure_file, workers=1, out_file=""):
+    class args:
+        pass
+
+    args.structure_file = structure_file
+    args.workers = workers
+    args.out_file = out_file
+    return args
+
+
+def test_struc_to_plddt_main_single(tmp_path, capsys):
+    # A single structure is printed or appended as it was before batch mode
+    structure_file = f"{INPUT_DIR}/full_struc_used_as_domain.pdb"
+    struc_to_plddt_main(get_args(structure_file))
+    assert capsys.readouterr().out == "62.12\n"
+
+    out_file = f"{tmp_path}/plddt.tsv"
+    struc_to_plddt_main(get_args(structure_file, out_file=out_file))
+    struc_to_plddt_main(get_args(structure_file, out_file=out_file))
+    with open(out_file) as infile:
+        assert infile.read() == "full_struc_used_as_domain.pdb\t62.12\n" * 2
+
+
+@pytest.mark.parametrize(
+    "structure_file",
+    [INPUT_DIR, f"{INPUT_DIR}/*.pdb", "list"],
+)
+def test_struc_to_plddt_main_batch(tmp_path, capsys, structure_file):
+    if structure_file == "list":
+        structure_file = f"{tmp_path}/structures.txt"
+        with open(structure_file, "w") as outfile:
+            outfile.write(f"{INPUT_DIR}/full_struc_used_as_domain.pdb\n")
+            outfile.write(f"{INPUT_DIR}/three_domains.pdb\n")
+
+    expected = "full_struc_used_as_domain.pdb\t62.12\n"
+    expected += "three_domains.pdb\t83.94\n"
+
+    outputs = []
+    for workers in [1, 2, 2]:
+        out_file = f"{tmp_path}/plddt_{len(outputs)}.tsv"
+        struc_to_plddt_main(get_args(structure_file, workers, out_file))
+        with open(out_file) as infile:
+            outputs.append(infile.read())
+    assert outputs == [expected] * 3
+
+    # Without an out_file, the same lines are printed
+    struc_to_plddt_main(get_args(structure_file, workers=2))
+    assert capsys.readouterr().out == expected
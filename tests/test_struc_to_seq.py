@@ -0,0 +1,70 @@
+import pytest
+
+from sat.scripts.struc_to_seq import struc_to_seq_main
+
+
+INPUT_DIR = "tests/test_data/structure_related/get_domains/inputs"
+
+SEQ = (
+    "MESLVPGFNEKTHVQLSLPVLQVRDVLVRGFGDSVEEVLSEARQHLKDGTCGLVEVEKGVLPQLEQPYVFIKRSDARTAPHG"
+    "HVMVELVAELEGIQYGRSGETLGVLVPHVGEIPVAYRKVLLRKNGNKGAGGHSYGADLKSFDLGDELGTDPYEDFQENWNT"
+    "KHSSGVTRELMRELNGG"
+)
+
+
+def get_args(structure_file, workers=1, out_file="", header=""):
+    class args:
+        pass
+
+    args.structure_file = structure_file
+    args.workers = workers
+    args.out_file = out_file
+    args.header = header
+    return args
+
+
+def test_struc_to_seq_main_single(tmp_path, capsys):
+    # A single structure is printed or appended as it was before batch mode
+    structure_file = f"{INPUT_DIR}/full_struc_used_as_domain.pdb"
+    struc_to_seq_main(get_args(structure_file))
+    assert capsys.readouterr().out == f"{SEQ}\n"
+
+    out_file = f"{tmp_path}/seq.fasta"
+    struc_to_seq_main(get_args(structure_file, out_file=out_file, header="seq"))
+    with open(out_file) as infile:
+        assert infile.read() == f">seq\n{SEQ}\n"
+
+    with pytest.raises(ValueError):
+        struc_to_seq_main(get_args(structure_file, out_file=out_file))
+
+
+@pytest.mark.parametrize(
+    "structure_file",
+    [INPUT_DIR, f"{INPUT_DIR}/*.pdb", "list"],
+)
+def test_struc_to_seq_main_batch(tmp_path, capsys, structure_file):
+    if structure_file == "list":
+        structure_file = f"{tmp_path}/structures.txt"
+        with open(structure_file, "w") as outfile:
+            outfile.write(f"{INPUT_DIR}/full_struc_used_as_domain.pdb\n")
+            outfile.write(f"{INPUT_DIR}/three_domains.pdb\n")
+
+    # Each record holds the sequence of the structure on its own
+    expected = f">full_struc_used_as_domain\n{SEQ}\n"
+    struc_to_seq_main(get_args(f"{INPUT_DIR}/three_domains.pdb"))
+    expected += f">three_domains\n{capsys.readouterr().out}"
+
+    outputs = []
+    for workers in [1, 2, 2]:
+        out_file = f"{tmp_path}/seqs_{len(outputs)}.fasta"
+        struc_to_seq_main(get_args(structure_file, workers, out_file))
+        with open(out_file) as infile:
+            outputs.append(infile.read())
+    assert outputs == [expected] * 3
+
+    # Without an out_file, the same fasta is printed
+    struc_to_seq_main(get_args(structure_file, workers=2))
+    assert capsys.readouterr().out == expected
+
+    with pytest.raises(ValueError):
+        struc_to_seq_main(get_args(structure_file, header="seq"))
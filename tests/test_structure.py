@@ -0,0 +1,180 @@
+from glob import glob
+import copy
+import gzip
+
+from Bio.PDB import MMCIFIO
+import numpy as np
+import pytest
+
+from sat.scripts.utils.structure import (
+    Residue_table,
+    pdb_to_residue_table,
+    pdb_to_structure_object,
+    struc_to_seq,
+    structure_to_pLDDT,
+    write_structure_subset,
+    write_structure_subsets,
+    write_structure_subsets_as_models,
+)
+
+
+def assert_same_residues(residue_table, structure):
+    residues = list(structure.get_residues())
+    assert len(residue_table) == len(residues)
+    assert residue_table.chain_ids == [r.get_parent().id for r in residues]
+    assert residue_table.residue_names == [r.resname for r in residues]
+    assert residue_table.residue_numbers.tolist() == [r.id[1] for r in residues]
+    for coord, residue in zip(residue_table.ca_coords, residues):
+        if "CA" in residue:
+            assert np.allclose(coord, residue["CA"].coord)
+        else:
+            assert np.all(np.isnan(coord))
+
+    for format in ["d", "l"]:
+        assert structure_to_pLDDT(residue_table, format) == structure_to_pLDDT(
+            structure, format
+        )
+
+
+@pytest.mark.parametrize(
+    "path", sorted(glob("tests/test_data/structure_related/**/*.pdb", recursive=True))
+)
+def test_residue_table_matches_biopython(path):
+    residue_table = pdb_to_residue_table(path)
+    structure = pdb_to_structure_object(path)
+
+    assert_same_residues(residue_table, structure)
+    assert struc_to_seq(residue_table) == struc_to_seq(structure)
+
+
+def test_residue_table_chains_and_hetatms(tmp_path):
+    # Chain A is interrupted by chain B, and there are HETATM records and a second model
+    atom = "{:6}{:5d}  {:<3} {:>3} {}{:4d}    {:8.3f}{:8.3f}{:8.3f}  1.00{:6.2f}\n"
+    lines = [
+        "MODEL        1\n",
+        atom.format("ATOM", 1, "N", "MET", "A", 1, 0, 0, 0, 90.1),
+        atom.format("ATOM", 2, "CA", "MET", "A", 1, 1, 0, 0, 90.2),
+        atom.format("ATOM", 3, "CA", "GLY", "B", 1, 2, 0, 0, 70.0),
+        atom.format("ATOM", 4, "N", "LYS", "A", 2, 3, 0, 0, 50.5),
+        atom.format("HETATM", 5, "O", "HOH", "A", 2, 4, 0, 0, 10.0),
+        "ENDMDL\n",
+        "MODEL        2\n",
+        atom.format("ATOM", 6, "CA", "ALA", "A", 1, 5, 0, 0, 40.0),
+        "ENDMDL\n",
+    ]
+    path = f"{tmp_path}/test.pdb"
+    with open(path, "w") as outfile:
+        outfile.writelines(lines)
+
+    residue_table = pdb_to_residue_table(path)
+    assert_same_residues(residue_table, pdb_to_structure_object(path))
+    assert residue_table.model_ids.tolist() == [0, 0, 0, 0, 1]
+    assert residue_table.pLDDTs.tolist() == [90.1, 50.5, 10.0, 70.0, 40.0]
+
+
+def test_residue_table_altlocs(tmp_path):
+    lines = [
+        "ATOM      1  N   MET A   1       0.000   0.000   0.000  1.00 90.00\n",
+        "ATOM      2  CA AMET A   1       1.000   0.000   0.000  0.40 80.00\n",
+        "ATOM      3  CA BMET A   1       1.100   0.000   0.000  0.60 70.00\n",
+    ]
+    path = f"{tmp_path}/test.pdb"
+    with open(path, "w") as outfile:
+        outfile.writelines(lines)
+
+    residue_table = Residue_table()
+    residue_table.parse_pdb(path)
+    assert_same_residues(residue_table, pdb_to_structure_object(path))
+    assert np.allclose(residue_table.ca_coords[0], [1.1, 0, 0])
+
+
+def test_residue_table_blank_columns():
+    # Residue 2 has a blank B-factor and residue 3 a blank occupancy, which biopython
+    # tolerates (a blank B-factor is read as 0)
+    path = "tests/test_data/structure_related/blank_columns.pdb"
+    residue_table = pdb_to_residue_table(path)
+    assert_same_residues(residue_table, pdb_to_structure_object(path))
+    assert residue_table.pLDDTs.tolist() == [38.99, 0.0, 57.08, 71.43]
+
+
+def test_gzip_and_mmcif_input(tmp_path):
+    path = "tests/test_data/structure_related/rebased.pdb"
+    structure = pdb_to_structure_object(path)
+
+    # Write gzipped, mmCIF, and gzipped mmCIF copies of the structure
+    with open(path, "rb") as infile, gzip.open(f"{tmp_path}/s.pdb.gz", "wb") as out:
+        out.write(infile.read())
+    io = MMCIFIO()
+    io.set_structure(structure)
+    io.save(f"{tmp_path}/s.cif")
+    with open(f"{tmp_path}/s.cif", "rb") as infile:
+        with gzip.open(f"{tmp_path}/s.cif.gz", "wb") as out:
+            out.write(infile.read())
+
+    for suffix in ["pdb.gz", "cif", "cif.gz"]:
+        copy_path = f"{tmp_path}/s.{suffix}"
+        copy = pdb_to_structure_object(copy_path)
+        assert struc_to_seq(copy) == struc_to_seq(structure)
+        assert structure_to_pLDDT(copy) == structure_to_pLDDT(structure)
+
+        residue_table = pdb_to_residue_table(copy_path)
+        assert_same_residues(residue_table, structure)
+
+
+def test_write_structure_subsets_matches_write_structure_subset(tmp_path):
+    structure = pdb_to_structure_object(
+        "tests/test_data/structure_related/get_domains/inputs/three_domains.pdb"
+    )
+    # A second model, to check MODEL/ENDMDL lines
+    model = copy.deepcopy(structure[0])
+    model.id = 1
+    model.serial_num = 2
+    structure.add(model)
+
+    # Overlapping, empty, and missing residues
+    residue_sets = [set(range(1, 200)), set(range(150, 400)), set(), {5000}]
+    outfiles = [f"{tmp_path}/subset_{i}.pdb" for i in range(len(residue_sets))]
+    write_structure_subsets(structure, residue_sets, outfiles)
+    for residues, outfile in zip(residue_sets, outfiles):
+        write_structure_subset(structure, residues, f"{tmp_path}/expected.pdb")
+        with open(outfile) as observed, open(f"{tmp_path}/expected.pdb") as expected:
+            assert observed.read() == expected.read()
+
+
+def test_write_structure_subsets_atom_records(tmp_path):
+    # HETATMs, two-letter elements, a blank occupancy, and large B-factors are written
+    # as they are by PDBIO
+    lines = [
+        "ATOM      1  N   MET A   1       0.000   0.000   0.000  1.00 90.00           N\n",
+        "ATOM      2  CA  MET A   1       1.000   0.000   0.000       1234.5           C\n",
+        "ATOM      3  CA  GLY A   2       2.000   0.000   0.000  1.00 99999.           C\n",
+        "HETATM    4 ZN    ZN A   3       3.000   0.000   0.000  1.00 10.00          ZN\n",
+        "HETATM    5  O   HOH A   4       4.000   0.000   0.000  0.50 -5.25           O\n",
+    ]
+    path = f"{tmp_path}/test.pdb"
+    with open(path, "w") as outfile:
+        outfile.writelines(lines)
+    structure = pdb_to_structure_object(path)
+
+    residue_sets = [{1, 2, 3, 4}, {2, 4}]
+    outfiles = [f"{tmp_path}/subset_{i}.pdb" for i in range(len(residue_sets))]
+    write_structure_subsets(structure, residue_sets, outfiles)
+    for residues, outfile in zip(residue_sets, outfiles):
+        write_structure_subset(structure, residues, f"{tmp_path}/expected.pdb")
+        with open(outfile) as observed, open(f"{tmp_path}/expected.pdb") as expected:
+            assert observed.read() == expected.read()
+
+
+def test_write_structure_subsets_as_models(tmp_path):
+    structure = pdb_to_structure_object(
+        "tests/test_data/structure_related/get_domains/inputs/three_domains.pdb"
+    )
+    residue_sets = [set(range(1, 31)), set(range(31, 81))]
+    write_structure_subsets_as_models(
+        structure, residue_sets, f"{tmp_path}/domains.pdb"
+    )
+
+    observed = pdb_to_structure_object(f"{tmp_path}/domains.pdb")
+    assert len(observed) == 2
+    for model, residues in zip(observed, residue_sets):
+        assert [r.id[1] for r in model.get_residues()] == sorted(residues)